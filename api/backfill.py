@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resumable historical backfill over any date range.
+
+POST /api/backfill with the VERCEL_MANUAL_SECRET bearer token:
+    {"start": "2026-01-01", "end": "2026-03-31"}            start a job
+    {"start": ..., "end": ..., "athletes": ["123", ...]}     only some athletes
+    {"job_id": "...", "resume": true}                        resume after a failure
+    {"job_id": "..."}                                        job status
+
+A job is split into one chunk per athlete per page of Strava's activity
+list (at the maximum page size). Chunks are queued through QStash back to
+this same endpoint, signed, and each one checkpoints its progress in
+Redis before queueing the next page. A chunk that runs out of time
+requeues itself and picks up where it left off, since activities already
+saved by the job are skipped.
+
+If an athlete's credentials or activity list fail permanently (access
+revoked, say), their chunk goes to the dead-letter store and the rest
+of the job finishes without them. Resuming the job, or reprocessing
+that dead letter, picks them back up from the same page.
+
+Chunks run in the bulk lane (see api/lanes.py) and step aside while live
+webhook events are being handled, requeueing themselves a little later.
+Delayed chunks rejoin the lane queue when they arrive, so they stay
+within its parallelism. Each activity also takes the bulk, global and
+athlete slots from api/concurrency.py, so a chunk never processes an
+athlete the webhook is already working on; a chunk that can't get them
+requeues itself with the usual bulk backoff.
+"""
+
+import os
+import json
+import time
+import uuid
+from datetime import datetime
+from flask import Flask, request, jsonify
+from upstash_redis import Redis
+import qstash
+from .strava_functions import (STRAVA_MAX_PAGE_SIZE, get_user_creds, get_activities_page,
+                               activity_processing, update_scores, store_activity,
+                               dead_letter, activity_event, PermanentError, RetryableError)
+from .tracing import start_trace
+from .http_client import CircuitOpenError
+from .concurrency import acquire_slots, release_slots, shed_delay
+from .lanes import BULK, BULK_YIELD_DELAY, ensure_queues, lane_message, requeue_delayed, should_yield
+
+QSTASH_TOKEN = os.environ.get('QSTASH_TOKEN')
+QSTASH_CURRENT = os.environ.get("QSTASH_CURRENT_SIGNING_KEY")
+QSTASH_NEXT = os.environ.get("QSTASH_NEXT_SIGNING_KEY")
+KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
+BACKFILL_URL = os.environ.get("BACKFILL_URL", "https://hr-github.vercel.app/api/backfill")
+# Leave headroom under the serverless timeout for the checkpoint and requeue
+CHUNK_TIME_BUDGET = float(os.environ.get("BACKFILL_CHUNK_SECONDS", 45))
+# How long to wait before retrying a chunk that hit Strava's rate limit
+RATE_LIMIT_DELAY = "15m"
+# Progress prefix for athletes whose chunk failed permanently
+FAILED = "failed:"
+# Dead letter source for parked chunks, which are reprocessed with resume_job
+CHUNK_SOURCE = "backfill_chunk"
+
+qstash_client = qstash.QStash(QSTASH_TOKEN)
+receiver = qstash.Receiver(
+    current_signing_key=QSTASH_CURRENT,
+    next_signing_key=QSTASH_NEXT,
+)
+
+app = Flask(__name__)
+
+def job_key(job_id):
+    return f"backfill:{job_id}"
+
+def progress_key(job_id):
+    """Hash of athlete id -> next page to fetch, 'done', or 'failed:<page>'"""
+    return f"backfill:{job_id}:progress"
+
+def saved_key(job_id):
+    """Set of activity ids the job has already saved"""
+    return f"backfill:{job_id}:saved"
+
+def to_timestamp(day):
+    return int(datetime.strptime(day, "%Y-%m-%d").timestamp())
+
+def queue_chunks(chunks, delay=None):
+    """Sends chunks back to this endpoint through QStash's bulk lane"""
+    if not chunks:
+        return
+    ensure_queues(qstash_client)
+    messages = [lane_message(BULK, BACKFILL_URL, chunk, delay) for chunk in chunks]
+    qstash_client.message.batch_json(messages)
+    print(f"Queued {len(messages)} backfill chunk(s)")
+
+def start_job(redis, start, end, athletes):
+    users = json.loads(os.environ.get("STRAVA_USERS"))
+    athletes = [a for a in (athletes or users) if a in users]
+    job_id = uuid.uuid4().hex[:12]
+    redis.hset(job_key(job_id), values={
+        "after": str(to_timestamp(start)),
+        # Inclusive of the whole end day
+        "before": str(to_timestamp(end) + 86400),
+        "status": "running",
+        "created": str(int(time.time())),
+        "athletes": json.dumps(athletes),
+        "processed": "0",
+    })
+    if athletes:
+        redis.hset(progress_key(job_id), values={a: "1" for a in athletes})
+    queue_chunks([{"job_id": job_id, "athlete_id": a, "page": 1} for a in athletes])
+    return job_id
+
+def resume_job(redis, job_id, athletes=None):
+    """
+    Requeues every athlete that isn't done (or just those in athletes),
+    failed ones from the page they failed on
+    """
+    progress = redis.hgetall(progress_key(job_id))
+    pending = [{"job_id": job_id, "athlete_id": a, "page": int(p.removeprefix(FAILED))}
+               for a, p in progress.items()
+               if p != "done" and (athletes is None or a in athletes)]
+    failed = {chunk["athlete_id"]: str(chunk["page"]) for chunk in pending
+              if progress[chunk["athlete_id"]].startswith(FAILED)}
+    if failed:
+        redis.hset(progress_key(job_id), values=failed)
+    if pending:
+        # Lets the job complete, and rebuild, again once these are done
+        redis.hdel(job_key(job_id), "completed_at")
+        redis.hset(job_key(job_id), "status", "running")
+    queue_chunks(pending)
+    return len(pending)
+
+def job_status(redis, job_id):
+    job = redis.hgetall(job_key(job_id))
+    if not job:
+        return None
+    progress = redis.hgetall(progress_key(job_id))
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "processed": int(job.get("processed", 0)),
+        "athletes_done": sum(1 for p in progress.values() if p == "done"),
+        "athletes_failed": sum(1 for p in progress.values() if p.startswith(FAILED)),
+        "athletes_total": len(progress),
+        "progress": progress,
+    }
+
+def finish_athlete(redis, job_id, athlete_id, state="done"):
+    """Marks an athlete as finished and rebuilds scores once every athlete is"""
+    redis.hset(progress_key(job_id), athlete_id, state)
+    progress = redis.hgetall(progress_key(job_id))
+    if all(p == "done" or p.startswith(FAILED) for p in progress.values()):
+        # Only the chunk that sets the completion marker gets to rebuild,
+        # two final chunks can't both win an HSETNX
+        if redis.hsetnx(job_key(job_id), "completed_at", str(int(time.time()))):
+            redis.hset(job_key(job_id), "status", "complete")
+            print(f"Backfill {job_id} complete, rebuilding scores")
+            update_scores(athlete_ids=[a for a, p in progress.items() if p == "done"])
+
+def fail_athlete(redis, job_id, athlete_id, page):
+    """Gives up on an athlete, remembering the page so resume_job can retry it"""
+    finish_athlete(redis, job_id, athlete_id, f"{FAILED}{page}")
+
+def run_chunk(redis, chunk):
+    """Processes one page of one athlete's activities for a job"""
+    job_id = chunk["job_id"]
+    athlete_id = chunk["athlete_id"]
+    page = int(chunk["page"])
+    started = time.time()
+
+    job = redis.hgetall(job_key(job_id))
+    if not job:
+        print(f"Unknown backfill job {job_id}, dropping chunk")
+        return
+    checkpoint = redis.hget(progress_key(job_id), athlete_id)
+    if checkpoint != str(page):
+        # Duplicate delivery of a chunk that was already checkpointed
+        print(f"Chunk {athlete_id}/{page} already handled (checkpoint {checkpoint})")
+        return
+
+    if should_yield(redis):
+        print(f"Live events in flight, yielding chunk {athlete_id}/{page}")
+        queue_chunks([chunk], delay=BULK_YIELD_DELAY)
+        return
+
+    try:
+        user_creds = get_user_creds(athlete_id)
+        activities = get_activities_page(user_creds, int(job["after"]), int(job["before"]), page)
+    except PermanentError as e:
+        # Revoked or unknown athlete: none of their pages can work, so park
+        # the chunk and let the rest of the job finish without them
+        dead_letter(redis, f"backfill-{job_id}-{athlete_id}", chunk, e, CHUNK_SOURCE)
+        fail_athlete(redis, job_id, athlete_id, page)
+        return
+    except RetryableError as e:
+        if e.status != 429:
+            raise
+        print("Strava rate limit hit, delaying chunk")
+        queue_chunks([chunk], delay=RATE_LIMIT_DELAY)
+        return
+    except CircuitOpenError as err:
+        print(f"{err}, delaying chunk")
+        queue_chunks([chunk], delay=f"{err.retry_after}s")
+        return
+
+    for activity in activities:
+        activity_id = str(activity["id"])
+        if redis.sismember(saved_key(job_id), activity_id):
+            continue
+        if time.time() - started > CHUNK_TIME_BUDGET:
+            # Out of time, pick the same page back up in a fresh invocation
+            print(f"Chunk {athlete_id}/{page} out of time, requeueing")
+            queue_chunks([chunk])
+            return
+        if should_yield(redis):
+            # Saved activities are skipped when the page is picked back up
+            print(f"Live events in flight, yielding chunk {athlete_id}/{page}")
+            queue_chunks([chunk], delay=BULK_YIELD_DELAY)
+            return
+        slots, shed_scope = acquire_slots(redis, athlete_id, BULK)
+        if slots is None:
+            # Saved activities are skipped when the page is picked back up
+            deferrals = chunk.get("deferrals", 0)
+            delay = shed_delay(BULK, deferrals)
+            print(f"Over the {shed_scope} concurrency limit, deferring chunk {athlete_id}/{page} by {delay}")
+            queue_chunks([{**chunk, "deferrals": deferrals + 1}], delay=delay)
+            return
+        try:
+            processed_data = activity_processing(athlete_id, activity_id, summary=activity)
+            store_activity(redis, athlete_id, activity_id, processed_data)
+        except PermanentError as e:
+            # Park it and carry on with the rest of the page
+            dead_letter(redis, f"{athlete_id}-{activity_id}-create",
+                        activity_event(athlete_id, activity_id), e, "backfill")
+            redis.sadd(saved_key(job_id), activity_id)
+            continue
+        except RetryableError as e:
+            if e.status == 429:
+                print("Strava rate limit hit, delaying chunk")
+                queue_chunks([chunk], delay=RATE_LIMIT_DELAY)
+                return
+            if e.retry_after:
+                # Strava's circuit is open, come back when it may have recovered
+                print(f"{e}, delaying chunk")
+                queue_chunks([chunk], delay=f"{e.retry_after}s")
+                return
+            raise
+        finally:
+            release_slots(redis, slots)
+        redis.sadd(saved_key(job_id), activity_id)
+        redis.hincrby(job_key(job_id), "processed", 1)
+
+    if len(activities) == STRAVA_MAX_PAGE_SIZE:
+        redis.hset(progress_key(job_id), athlete_id, str(page + 1))
+        queue_chunks([{"job_id": job_id, "athlete_id": athlete_id, "page": page + 1}])
+    else:
+        finish_athlete(redis, job_id, athlete_id)
+
+@app.route('/api/backfill', methods=['POST'])
+def backfill():
+    redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+
+    # --- Chunk deliveries from QStash ---
+    signature = request.headers.get("Upstash-Signature")
+    if signature:
+        try:
+            receiver.verify(
+                signature=signature,
+                body=request.get_data(as_text=True),
+                url=BACKFILL_URL
+            )
+        except Exception as e:
+            print(f"❌ SECURITY ALERT: Invalid QStash signature. Error: {e}")
+            return "Invalid signature", 401
+        chunk = request.get_json()
+        try:
+            # Delayed chunks go through the bulk lane queue before running
+            if requeue_delayed(qstash_client, BACKFILL_URL, chunk):
+                return 'Chunk Requeued', 200
+        except Exception as e:
+            print(f"❌ ERROR putting the delayed chunk in its lane. Error: {e}")
+            return 'Chunk Failed', 500
+        start_trace(f"backfill-{chunk.get('job_id')}-{chunk.get('athlete_id')}-{chunk.get('page')}")
+        try:
+            run_chunk(redis, chunk)
+        except Exception as e:
+            print(f"❌ ERROR running backfill chunk {chunk}. Error: {e}")
+            # Let QStash retry, the checkpoint makes the retry pick up where this stopped
+            return 'Chunk Failed', 500
+        return 'Chunk Complete', 200
+
+    # --- Manual control ---
+    auth_header = request.headers.get('Authorization')
+    expected_token = f"Bearer {os.environ.get('VERCEL_MANUAL_SECRET')}"
+    if not auth_header or auth_header != expected_token:
+        return jsonify(message="Unauthorized"), 401
+
+    body = request.get_json(silent=True) or {}
+    try:
+        if "job_id" in body:
+            if body.get("resume"):
+                queued = resume_job(redis, body["job_id"])
+                return jsonify(message="Backfill resumed.", job_id=body["job_id"], queued=queued), 200
+            status = job_status(redis, body["job_id"])
+            if status is None:
+                return jsonify(message="Unknown job."), 404
+            return jsonify(status), 200
+        if not body.get("start") or not body.get("end"):
+            return jsonify(message="start and end dates (YYYY-MM-DD) are required."), 400
+        try:
+            if to_timestamp(body["start"]) > to_timestamp(body["end"]):
+                return jsonify(message="start must not be after end."), 400
+        except (TypeError, ValueError):
+            return jsonify(message="start and end must be dates (YYYY-MM-DD)."), 400
+        job_id = start_job(redis, body["start"], body["end"], body.get("athletes"))
+        return jsonify(message="Backfill started.", job_id=job_id), 202
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return jsonify(message="An error occurred during script execution."), 500
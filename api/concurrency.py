@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrency limits for activity processing. When lots of athletes
+finish workouts together every QStash delivery would otherwise hit
+Strava, Redis and GitHub at the same moment and use up their quotas
+together, so each activity first takes a slot from Redis semaphores,
+whether it comes from a webhook event, a backfill chunk or the daily
+sync (both of those are bulk work):
+
+    bulk      BULK_CONCURRENCY bulk events at once (bulk events only)
+    global    ACTIVITY_CONCURRENCY events at once across all instances,
+              live and bulk together
+    athlete   ATHLETE_CONCURRENCY events at once for one athlete
+
+An event that can't get all of them is shed: it goes back to QStash
+with a jittered delay of around SHED_DELAY_SECONDS instead of running
+and failing. For bulk events the delay doubles each time the same event
+is shed (the event counts its deferrals), so a backlog spreads out
+instead of coming back all at once; live events always come back soon.
+After MAX_DEFERRALS the handler stops deferring and hands the event
+back to QStash's own retries, which end in the dead-letter store.
+Backfill chunks are shed the same way but keep waiting at the longest
+delay, and the daily sync leaves a busy athlete's activity for its
+next run.
+
+A semaphore is a sorted set of holder tokens scored by when their lease
+runs out, so a function killed mid event frees its slot after
+SLOT_LEASE_SECONDS. A new holder is in if its rank is inside the limit;
+two instances racing for the last slot can both lose, never both win.
+If Redis can't be reached the limits are skipped rather than stopping
+all work.
+"""
+
+import os
+import time
+import uuid
+import random
+from .freshness import increment
+from .lanes import BULK
+
+# Room for both lanes at their default parallelism, so normally only a
+# pileup beyond what the queues let through (several deployments, manual
+# runs, QStash retries on top) gets shed
+ACTIVITY_CONCURRENCY = int(os.environ.get("ACTIVITY_CONCURRENCY", 12))
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 2))
+ATHLETE_CONCURRENCY = int(os.environ.get("ATHLETE_CONCURRENCY", 1))
+# Longer than the function can run, so a live holder never loses its slot
+SLOT_LEASE_SECONDS = int(os.environ.get("SLOT_LEASE_SECONDS", 120))
+SHED_DELAY_SECONDS = float(os.environ.get("SHED_DELAY_SECONDS", 5))
+MAX_SHED_DELAY_SECONDS = float(os.environ.get("MAX_SHED_DELAY_SECONDS", 60))
+# Times one event is deferred before it goes back to QStash's retries
+MAX_DEFERRALS = int(os.environ.get("MAX_DEFERRALS", 10))
+
+GLOBAL_SLOTS_KEY = "slots:activities"
+BULK_SLOTS_KEY = "slots:activities:bulk"
+
+def athlete_slots_key(athlete_id):
+    return f"slots:athlete:{athlete_id}"
+
+def try_acquire(redis, key, limit, token):
+    """Takes a slot in the semaphore at key, returns whether it got one"""
+    now = time.time()
+    redis.zremrangebyscore(key, "-inf", now)
+    redis.zadd(key, {token: now + SLOT_LEASE_SECONDS})
+    redis.expire(key, SLOT_LEASE_SECONDS)
+    rank = redis.zrank(key, token)
+    if rank is not None and rank < limit:
+        return True
+    redis.zrem(key, token)
+    return False
+
+def acquire_slots(redis, athlete_id, lane):
+    """
+    Takes every slot one event needs. Returns (slots, None) to go ahead,
+    where slots goes to release_slots after, or (None, scope) when the
+    event should be shed.
+    """
+    token = uuid.uuid4().hex
+    semaphores = [("global", GLOBAL_SLOTS_KEY, ACTIVITY_CONCURRENCY),
+                  ("athlete", athlete_slots_key(athlete_id), ATHLETE_CONCURRENCY)]
+    if lane == BULK:
+        semaphores.insert(0, ("bulk", BULK_SLOTS_KEY, BULK_CONCURRENCY))
+    slots = []
+    try:
+        for scope, key, scope_limit in semaphores:
+            if not try_acquire(redis, key, scope_limit, token):
+                release_slots(redis, slots)
+                increment(redis, "events_shed_total", scope=scope, lane=lane)
+                return None, scope
+            slots.append((key, token))
+    except Exception as e:
+        print(f"Could not check the concurrency limits, going ahead: {e}")
+    return slots, None
+
+def release_slots(redis, slots):
+    for key, token in slots:
+        try:
+            redis.zrem(key, token)
+        except Exception as e:
+            # The lease runs out on its own
+            print(f"Could not release {key}: {e}")
+
+def shed_delay(lane, deferrals=0):
+    """A QStash delay for shed work, jittered so it doesn't all come back at once"""
+    backoff = 2 ** deferrals if lane == BULK else 1
+    base = min(SHED_DELAY_SECONDS * backoff, MAX_SHED_DELAY_SECONDS)
+    return f"{int(random.uniform(base, 2 * base))}s"
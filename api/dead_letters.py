@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Look at and reprocess jobs that failed permanently.
+
+POST /api/dead_letters with the VERCEL_MANUAL_SECRET bearer token:
+    {}                                        list everything parked
+    {"action": "reprocess", "ids": [...]}     requeue those events
+    {"action": "reprocess", "ids": "all"}     requeue everything
+    {"action": "discard", "ids": [...]}       drop them
+
+Reprocessing publishes the original webhook style event back to the
+activity handler through QStash, in the bulk lane (see api/lanes.py), and
+removes it from the store. Backfill chunks that were parked resume their
+athlete's part of the job instead (see api/backfill.py). If it
+fails permanently again it will be parked again.
+"""
+
+import os
+import json
+from flask import Flask, request, jsonify
+from upstash_redis import Redis
+import qstash
+from .strava_functions import DEAD_LETTER_KEY
+from .lanes import BULK, PROCESSING_URL, ACTIVITY_RETRIES, ensure_queues, lane_message
+from .backfill import CHUNK_SOURCE, resume_job
+
+QSTASH_TOKEN = os.environ.get('QSTASH_TOKEN')
+KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
+
+qstash_client = qstash.QStash(QSTASH_TOKEN)
+
+app = Flask(__name__)
+
+def selected(letters, ids):
+    if ids == "all":
+        return list(letters)
+    return [letter_id for letter_id in ids or [] if letter_id in letters]
+
+@app.route('/api/dead_letters', methods=['POST'])
+def dead_letters():
+    auth_header = request.headers.get('Authorization')
+    expected_token = f"Bearer {os.environ.get('VERCEL_MANUAL_SECRET')}"
+    if not auth_header or auth_header != expected_token:
+        return jsonify(message="Unauthorized"), 401
+
+    body = request.get_json(silent=True) or {}
+    action = body.get("action", "list")
+    try:
+        redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+        letters = {k: json.loads(v) for k, v in redis.hgetall(DEAD_LETTER_KEY).items()}
+        if action == "list":
+            return jsonify(count=len(letters), dead_letters=letters), 200
+        ids = selected(letters, body.get("ids"))
+        if not ids:
+            return jsonify(message="No matching dead letters."), 404
+        if action == "reprocess":
+            chunks = [letters[i]["event"] for i in ids if letters[i]["source"] == CHUNK_SOURCE]
+            for chunk in chunks:
+                resume_job(redis, chunk["job_id"], athletes=[chunk["athlete_id"]])
+            events = [letters[i]["event"] for i in ids if letters[i]["source"] != CHUNK_SOURCE]
+            if events:
+                # Catch-up work, so it goes behind live events
+                ensure_queues(qstash_client)
+                qstash_client.message.batch_json([
+                    lane_message(BULK, PROCESSING_URL, {**event, "lane": BULK},
+                                 retries=ACTIVITY_RETRIES)
+                    for event in events])
+            redis.hdel(DEAD_LETTER_KEY, *ids)
+            print(f"Requeued {len(ids)} dead letters")
+            return jsonify(message="Requeued.", ids=ids), 200
+        if action == "discard":
+            redis.hdel(DEAD_LETTER_KEY, *ids)
+            return jsonify(message="Discarded.", ids=ids), 200
+        return jsonify(message=f"Unknown action '{action}'."), 400
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return jsonify(message="An error occurred during script execution."), 500
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Forwards webhook events from the Redis inbox to the activity handler.
+
+The webhook only appends each event to the events:inbox list and acks
+Strava straight away, so QStash being slow can never push it past
+Strava's 2 second window. This endpoint drains the inbox into the live
+lane (see api/lanes.py) in batches of up to FLUSH_BATCH_SIZE with one
+QStash batch call each, and returns as soon as the inbox is empty. An
+empty inbox costs a couple of Redis commands.
+
+It runs from a QStash schedule (FLUSH_CRON, every minute), so an event
+waits up to a minute before it is forwarded. The schedule is set up out
+of band: POST {"action": "schedule"} here with the VERCEL_MANUAL_SECRET
+bearer token (the Set Up Flush Schedule workflow does this on every
+push to main) creates or updates it under the fixed id
+FLUSH_SCHEDULE_ID. FLUSH_URL has to be this deployment's public URL.
+Any other manual POST flushes the inbox straight away.
+
+Only one flusher runs at a time (events:flush_lease). Events are removed
+from the inbox after QStash has accepted them, so a crash in between
+sends a batch twice rather than losing it; the activity handler treats
+a repeated event like an update.
+"""
+
+import os
+import json
+import time
+import uuid
+from flask import Flask, request, jsonify
+from upstash_redis import Redis
+import qstash
+from .freshness import increment
+from .leases import release_lease
+from .lanes import LIVE, PROCESSING_URL, ACTIVITY_RETRIES, ensure_queues, lane_message, mark_live_busy
+
+QSTASH_TOKEN = os.environ.get('QSTASH_TOKEN')
+QSTASH_CURRENT = os.environ.get("QSTASH_CURRENT_SIGNING_KEY")
+QSTASH_NEXT = os.environ.get("QSTASH_NEXT_SIGNING_KEY")
+KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
+FLUSH_URL = os.environ.get("FLUSH_URL", "https://hr-github.vercel.app/api/flush_events")
+# QStash accepts up to 100 messages per batch call
+FLUSH_BATCH_SIZE = int(os.environ.get("FLUSH_BATCH_SIZE", 100))
+# Most seconds one run spends draining; leaves headroom under the function timeout
+FLUSH_BUDGET_SECONDS = float(os.environ.get("FLUSH_BUDGET_SECONDS", 45))
+
+FLUSH_CRON = os.environ.get("FLUSH_CRON", "* * * * *")
+# Fixed, so creating the schedule again updates it instead of adding another
+FLUSH_SCHEDULE_ID = os.environ.get("FLUSH_SCHEDULE_ID", "flush-events")
+
+INBOX_KEY = "events:inbox"
+FLUSH_LEASE_KEY = "events:flush_lease"
+
+qstash_client = qstash.QStash(QSTASH_TOKEN)
+receiver = qstash.Receiver(
+    current_signing_key=QSTASH_CURRENT,
+    next_signing_key=QSTASH_NEXT,
+)
+
+app = Flask(__name__)
+
+def create_flush_schedule():
+    """Creates or updates the QStash schedule that runs this endpoint"""
+    qstash_client.schedule.create(destination=FLUSH_URL, cron=FLUSH_CRON, schedule_id=FLUSH_SCHEDULE_ID)
+    print(f"✅ Flush schedule {FLUSH_SCHEDULE_ID} set to '{FLUSH_CRON}'")
+
+def forward_batch(events):
+    """Publishes inbox entries to the activity handler's live lane in one QStash call"""
+    ensure_queues(qstash_client)
+    qstash_client.message.batch_json([
+        lane_message(LIVE, PROCESSING_URL, json.loads(event), retries=ACTIVITY_RETRIES)
+        for event in events
+    ])
+
+def flush_inbox(redis, lease_token, deadline):
+    """Drains the inbox until it's empty or the deadline, returns how many events were forwarded"""
+    flushed = 0
+    while time.time() < deadline:
+        events = redis.lrange(INBOX_KEY, 0, FLUSH_BATCH_SIZE - 1)
+        if not events:
+            break
+        # Two flushers trimming the same list would drop events
+        if redis.get(FLUSH_LEASE_KEY) != lease_token:
+            print("Lost the flush lease, stopping")
+            break
+        # Bulk work holds back from here until these have been handled
+        mark_live_busy(redis)
+        forward_batch(events)
+        redis.ltrim(INBOX_KEY, len(events), -1)
+        flushed += len(events)
+        increment(redis, "events_flushed_total", len(events))
+        print(f"✅ Forwarded {len(events)} events")
+    return flushed
+
+def manual_request():
+    auth_header = request.headers.get('Authorization')
+    return bool(auth_header) and auth_header == f"Bearer {os.environ.get('VERCEL_MANUAL_SECRET')}"
+
+def authorized():
+    if manual_request():
+        return True
+    signature = request.headers.get("Upstash-Signature")
+    if not signature:
+        return False
+    try:
+        receiver.verify(signature=signature, body=request.get_data(as_text=True), url=FLUSH_URL)
+    except Exception as e:
+        print(f"❌ SECURITY ALERT: Invalid QStash signature. Error: {e}")
+        return False
+    return True
+
+@app.route('/api/flush_events', methods=['POST'])
+def flush_events():
+    if not authorized():
+        return jsonify(message="Unauthorized"), 401
+
+    if manual_request() and (request.get_json(silent=True) or {}).get("action") == "schedule":
+        try:
+            create_flush_schedule()
+        except Exception as e:
+            print(f"❌ ERROR: Could not set up the flush schedule. Error: {e}")
+            return jsonify(message="Could not set up the flush schedule."), 500
+        return jsonify(message="Flush schedule set.", schedule_id=FLUSH_SCHEDULE_ID, cron=FLUSH_CRON), 200
+
+    redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+    lease_token = uuid.uuid4().hex
+    lease_ms = int((FLUSH_BUDGET_SECONDS + 30) * 1000)
+    if not redis.set(FLUSH_LEASE_KEY, lease_token, nx=True, px=lease_ms):
+        return jsonify(message="Another flush is running.", flushed=0), 200
+    try:
+        flushed = flush_inbox(redis, lease_token, time.time() + FLUSH_BUDGET_SECONDS)
+    except Exception as e:
+        # Whatever wasn't trimmed is still in the inbox for the next run
+        print(f"❌ ERROR: Failed to forward events. Error: {e}")
+        return jsonify(message="Flush failed."), 500
+    finally:
+        release_lease(redis, FLUSH_LEASE_KEY, lease_token)
+    return jsonify(flushed=flushed, remaining=redis.llen(INBOX_KEY)), 200
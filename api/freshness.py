@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Freshness metrics: how long it takes from Strava telling us about an
+activity until a scoreboard that includes it is published.
+
+The webhook stamps every event with received_at before queueing it. The
+pipeline then records latency histograms for each stage in Redis:
+
+    queue_wait   receipt until the activity handler picks the event up
+    processing   fetching and storing the activity
+    rebuild      rebuilding a league's scoreboard
+    publish      uploading that scoreboard to GitHub
+    end_to_end   receipt until a scoreboard including the event is on GitHub
+
+along with counters for events received, forwarded from the inbox,
+processed (by outcome) and retried, and for the retries and circuit
+breakers in api/http_client.py. api/metrics.py renders them in the
+Prometheus text format.
+
+A histogram is a hash with one field per bucket (observations that fell
+in it, not cumulative) and a running sum. Counters all live in one hash
+whose fields are the metric name with its labels. Recording a metric
+must never fail the job it measures, so errors are only printed.
+"""
+
+import time
+from .leagues import league_key
+
+# Upper bounds in seconds, from a quick handler run to a retried event
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# stage -> (kept per league, help text)
+STAGES = {
+    "queue_wait": (False, "Seconds from webhook receipt until the activity handler picked the event up"),
+    "processing": (False, "Seconds spent fetching and storing an activity"),
+    "rebuild": (True, "Seconds spent rebuilding a league's scoreboard"),
+    "publish": (True, "Seconds spent uploading a league's scoreboard to GitHub"),
+    "end_to_end": (True, "Seconds from webhook receipt until a scoreboard including the event was published"),
+}
+COUNTERS = {
+    "events_received_total": "Webhook events received from Strava",
+    "events_flushed_total": "Events forwarded from the inbox to the activity handler",
+    "events_processed_total": "Events the activity handler finished with, by outcome",
+    "event_retries_total": "Event deliveries that were QStash retries",
+    "bulk_yields_total": "Times bulk work stepped aside for live events",
+    "events_shed_total": "Events deferred because a concurrency limit was reached, by scope and lane",
+    "publishes_total": "Scoreboards uploaded to GitHub",
+    "publish_failures_total": "Scoreboard uploads to GitHub that failed",
+    "http_retries_total": "Calls to Strava, GitHub or Vercel retried after a network error or 5xx",
+    "circuit_opened_total": "Times a service's circuit breaker opened",
+    "circuit_rejections_total": "Calls refused without trying because a circuit was open",
+}
+METRIC_PREFIX = "hr_"
+COUNTERS_KEY = "metrics:counters"
+# Events waiting for a publish, scored by the generation that first saw them
+PENDING_KEY = "metrics:pending"
+
+def histogram_key(stage, league=None):
+    base = f"metrics:{stage}"
+    return base if league is None else league_key(base, league)
+
+def bucket_for(seconds):
+    for bound in BUCKETS:
+        if seconds <= bound:
+            return str(bound)
+    return "+Inf"
+
+def observe(redis, stage, seconds, league=None):
+    """Adds one observation to a stage's latency histogram"""
+    seconds = max(seconds, 0)
+    key = histogram_key(stage, league)
+    try:
+        redis.hincrby(key, bucket_for(seconds), 1)
+        redis.hincrbyfloat(key, "sum", seconds)
+    except Exception as e:
+        print(f"Could not record {stage} latency: {e}")
+
+def counter_field(name, **labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+def increment(redis, name, amount=1, **labels):
+    try:
+        redis.hincrby(COUNTERS_KEY, counter_field(name, **labels), amount)
+    except Exception as e:
+        print(f"Could not increment {name}: {e}")
+
+def mark_pending(redis, league_name, generation, received):
+    """
+    Remembers events (event id -> received_at) that a rebuild picked up,
+    so the publish that includes them can record their end to end latency.
+    The rebuild took its generation after the events were stored, so any
+    generation from this one on includes them.
+    """
+    if not received:
+        return
+    try:
+        redis.zadd(league_key(PENDING_KEY, league_name),
+                   {f"{event_id}@{received_at}": generation for event_id, received_at in received.items()})
+    except Exception as e:
+        print(f"Could not record pending events: {e}")
+
+def observe_published(redis, league_name, generation, published_at=None):
+    """Records end to end latency for every event the published generation includes"""
+    published_at = published_at or time.time()
+    key = league_key(PENDING_KEY, league_name)
+    try:
+        pending = redis.zrangebyscore(key, "-inf", generation)
+        for member in pending:
+            received_at = float(member.rsplit("@", 1)[1])
+            observe(redis, "end_to_end", published_at - received_at, league_name)
+        if pending:
+            redis.zremrangebyscore(key, "-inf", generation)
+    except Exception as e:
+        print(f"Could not record end to end latency: {e}")
+
+# --- Rendering ---
+def render_histogram(lines, name, fields, labels=""):
+    counts = {field: int(value) for field, value in fields.items() if field != "sum"}
+    cumulative = 0
+    for bound in BUCKETS:
+        cumulative += counts.get(str(bound), 0)
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    cumulative += counts.get("+Inf", 0)
+    lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {cumulative}')
+    suffix = "{" + labels.rstrip(",") + "}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {float(fields.get('sum', 0))}")
+    lines.append(f"{name}_count{suffix} {cumulative}")
+
+def render_metrics(redis, league_names):
+    """Everything in the Prometheus text exposition format"""
+    lines = []
+    counters = redis.hgetall(COUNTERS_KEY)
+    for name, help_text in COUNTERS.items():
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+        series = {field: value for field, value in counters.items()
+                  if field == name or field.startswith(name + "{")}
+        for field, value in sorted(series.items()) or [(name, 0)]:
+            lines.append(f"{METRIC_PREFIX}{field} {int(value)}")
+    for stage, (per_league, help_text) in STAGES.items():
+        name = f"{METRIC_PREFIX}{stage}_seconds"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        if per_league:
+            for league in league_names:
+                render_histogram(lines, name, redis.hgetall(histogram_key(stage, league)),
+                                 labels=f'league="{league}",')
+        else:
+            render_histogram(lines, name, redis.hgetall(histogram_key(stage)))
+    return "\n".join(lines) + "\n"
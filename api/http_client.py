@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+One way out to Strava, GitHub and Vercel, so a hanging or failing
+upstream can't hold a function until the platform kills it.
+
+Every call through request() gets:
+
+    a timeout     (connect, read) seconds per service, see SERVICES
+    retries       idempotent calls (and calls that never connected) are
+                  retried on network errors and 5xx, with full jitter
+                  backoff, within the service's attempt and time budget
+    a breaker     after BREAKER_FAILURES failed calls to a service within
+                  BREAKER_WINDOW_SECONDS the circuit opens and every
+                  function instance fails fast with CircuitOpenError for
+                  BREAKER_OPEN_SECONDS. After that one trial call is let
+                  through: success closes the circuit, failure opens it
+                  again.
+
+Breaker state lives in Redis (breaker:<service>:*) so all instances see
+the same circuit. Only failures write to it; a healthy call costs one
+MGET. If Redis itself can't be reached the breaker lets calls through.
+
+A failed call is a network error or a 5xx. 4xx answers, 429 included,
+mean the upstream is up and are left to the caller (classify_response).
+"""
+
+import os
+import time
+import random
+import requests
+from upstash_redis import Redis
+from .freshness import increment
+
+# Seconds to wait for the TCP connection, a little over a multiple of 3
+# so it doesn't line up with TCP's retransmission window
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+# service -> read timeout, extra attempts for retryable calls, and the
+# most seconds a call may spend across all its attempts
+SERVICES = {
+    "strava": {"timeout": (CONNECT_TIMEOUT, float(os.environ.get("STRAVA_TIMEOUT", 10))),
+               "retries": 2, "budget": 20},
+    "github": {"timeout": (CONNECT_TIMEOUT, float(os.environ.get("GITHUB_TIMEOUT", 15))),
+               "retries": 2, "budget": 30},
+    "vercel": {"timeout": (CONNECT_TIMEOUT, float(os.environ.get("VERCEL_TIMEOUT", 10))),
+               "retries": 1, "budget": 15},
+}
+# Methods that are safe to send twice. Token refreshes (POST) rotate the
+# refresh token and GitHub PUTs carry a sha, so those aren't retried
+# unless the first attempt never connected.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "DELETE"}
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_MAX_SECONDS = 4
+
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_WINDOW_SECONDS = int(os.environ.get("BREAKER_WINDOW_SECONDS", 60))
+BREAKER_OPEN_SECONDS = int(os.environ.get("BREAKER_OPEN_SECONDS", 30))
+
+_redis_clients = {}
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a service whose circuit is open"""
+    def __init__(self, service, retry_after):
+        super().__init__(f"{service} circuit is open, retry in {retry_after}s")
+        self.service = service
+        self.retry_after = retry_after
+
+def breaker_key(service, part):
+    return f"breaker:{service}:{part}"
+
+def breaker_redis():
+    """Redis client for breaker state, one per process (they're slow to build)"""
+    url = os.environ.get("KV_REST_API_URL")
+    token = os.environ.get("KV_REST_API_TOKEN")
+    if not url:
+        return None
+    key = (Redis, url, token)
+    if key not in _redis_clients:
+        _redis_clients[key] = Redis(url=url, token=token)
+    return _redis_clients[key]
+
+def allow_request(redis, service):
+    """
+    Raises CircuitOpenError while the service's circuit is open. Returns
+    True when this call is the half open trial, False for a normal call.
+    """
+    if redis is None:
+        return False
+    try:
+        opened_until, probation = redis.mget(breaker_key(service, "open"), breaker_key(service, "probation"))
+        if opened_until:
+            increment(redis, "circuit_rejections_total", service=service)
+            raise CircuitOpenError(service, max(1, int(float(opened_until) - time.time())))
+        if not probation:
+            return False
+        # Half open: one caller gets to try, the rest keep failing fast
+        if redis.set(breaker_key(service, "trial"), "1", nx=True, ex=int(SERVICES[service]["budget"])):
+            return True
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        print(f"Could not check the {service} circuit: {e}")
+        return False
+    increment(redis, "circuit_rejections_total", service=service)
+    raise CircuitOpenError(service, 1)
+
+def record_success(redis, service, trial):
+    if not trial:
+        return
+    try:
+        redis.delete(breaker_key(service, "probation"), breaker_key(service, "trial"),
+                     breaker_key(service, "failures"))
+        print(f"🟢 {service} circuit closed")
+    except Exception as e:
+        print(f"Could not close the {service} circuit: {e}")
+
+def record_failure(redis, service, trial):
+    if redis is None:
+        return
+    try:
+        failures = redis.incr(breaker_key(service, "failures"))
+        if failures == 1:
+            redis.expire(breaker_key(service, "failures"), BREAKER_WINDOW_SECONDS)
+        if trial or failures >= BREAKER_FAILURES:
+            open_circuit(redis, service)
+    except Exception as e:
+        print(f"Could not record a {service} failure: {e}")
+
+def open_circuit(redis, service):
+    opened_until = time.time() + BREAKER_OPEN_SECONDS
+    redis.set(breaker_key(service, "open"), str(opened_until), ex=BREAKER_OPEN_SECONDS)
+    # Outlives the open state so the first call after it is a trial
+    redis.set(breaker_key(service, "probation"), "1", ex=BREAKER_OPEN_SECONDS + BREAKER_WINDOW_SECONDS)
+    redis.delete(breaker_key(service, "failures"), breaker_key(service, "trial"))
+    increment(redis, "circuit_opened_total", service=service)
+    print(f"🔴 {service} circuit open for {BREAKER_OPEN_SECONDS}s")
+
+def backoff(attempt):
+    """Full jitter: anywhere from 0 up to the exponential step"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def request(service, method, url, **kwargs):
+    """
+    requests.<method>(url, **kwargs) for one of SERVICES, with its timeout,
+    retry budget and circuit breaker. Returns the last response (which
+    may be a 5xx once the budget is spent) or raises the last network
+    error, or CircuitOpenError without calling out at all.
+    """
+    config = SERVICES[service]
+    kwargs.setdefault("timeout", config["timeout"])
+    method = method.upper()
+    redis = breaker_redis()
+    trial = allow_request(redis, service)
+    # A trial call gets one shot so a bad upstream isn't hit repeatedly
+    attempts = 1 if trial else 1 + config["retries"]
+    deadline = time.monotonic() + config["budget"]
+    send = getattr(requests, method.lower())
+
+    for attempt in range(attempts):
+        error, response = None, None
+        try:
+            response = send(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+            error = err
+        if error is None and response.status_code < 500:
+            record_success(redis, service, trial)
+            return response
+
+        retryable = method in IDEMPOTENT_METHODS or isinstance(error, requests.exceptions.ConnectTimeout)
+        delay = backoff(attempt)
+        if not retryable or attempt + 1 == attempts or time.monotonic() + delay >= deadline:
+            break
+        what = type(error).__name__ if error else f"HTTP {response.status_code}"
+        print(f"{service} {method} failed ({what}), retrying in {delay:.2f}s")
+        if redis is not None:
+            increment(redis, "http_retries_total", service=service)
+        time.sleep(delay)
+
+    record_failure(redis, service, trial)
+    if error is not None:
+        raise error
+    return response
+
+def get(service, url, **kwargs):
+    return request(service, "GET", url, **kwargs)
+
+def post(service, url, **kwargs):
+    return request(service, "POST", url, **kwargs)
+
+def put(service, url, **kwargs):
+    return request(service, "PUT", url, **kwargs)
+
+def patch(service, url, **kwargs):
+    return request(service, "PATCH", url, **kwargs)
+
+def delete(service, url, **kwargs):
+    return request(service, "DELETE", url, **kwargs)
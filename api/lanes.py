@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Priority lanes for queued work, so a big historical job never holds up
+the workout someone just finished.
+
+    live   webhook events forwarded by api/flush_events.py
+    bulk   backfill chunks, dead letter reprocessing and other catch-up work
+
+Each lane is its own QStash queue with its own parallelism limit
+(LIVE_LANE_PARALLELISM, BULK_LANE_PARALLELISM), on top of QStash's own
+queueing. Bulk work also yields to live work: whenever live events are
+forwarded or processed the lanes:live_busy flag is refreshed, and a bulk
+job that sees it requeues itself a little later instead of competing for
+Strava's rate limit and the publish lease.
+
+Events carry their lane in the body ("lane": "bulk"); anything without
+one, like Strava's own webhook events, is live.
+
+QStash queues don't take delays, so a delayed message (a bulk job
+yielding, shed or rate limited work) is published straight to its
+endpoint with its lane in the body ("delayed_lane"). When it arrives the
+endpoint hands it to requeue_delayed, which puts it into the lane queue
+instead of handling it, so delayed work still counts against the lane's
+parallelism.
+"""
+
+import os
+from .freshness import increment
+
+LIVE = "live"
+BULK = "bulk"
+LANES = {
+    LIVE: {"queue": os.environ.get("LIVE_QUEUE", "activities-live"),
+           "parallelism": int(os.environ.get("LIVE_LANE_PARALLELISM", 10))},
+    BULK: {"queue": os.environ.get("BULK_QUEUE", "activities-bulk"),
+           "parallelism": int(os.environ.get("BULK_LANE_PARALLELISM", 2))},
+}
+# Where activity events are handled, and how many times QStash retries
+# each one. Every publisher of activity events uses these: the handler
+# only dead-letters on what it knows is the final attempt.
+PROCESSING_URL = os.environ.get("PROCESSING_URL", "https://hr-github.vercel.app/api/strava_activity_handler")
+ACTIVITY_RETRIES = int(os.environ.get("ACTIVITY_RETRIES", 5))
+LIVE_BUSY_KEY = "lanes:live_busy"
+# How long after the last live event bulk work keeps holding back
+LIVE_BUSY_MS = int(float(os.environ.get("LIVE_BUSY_SECONDS", 10)) * 1000)
+# How long a bulk job waits before trying again after yielding
+BULK_YIELD_DELAY = os.environ.get("BULK_YIELD_DELAY", "10s")
+# Body field marking a delayed message that still has to join its lane
+DELAYED_LANE_FIELD = "delayed_lane"
+
+_queues_ready = False
+
+def ensure_queues(qstash_client):
+    """Creates or resizes the lane queues, once per process"""
+    global _queues_ready
+    if _queues_ready:
+        return
+    try:
+        for lane in LANES.values():
+            qstash_client.queue.upsert(lane["queue"], parallelism=lane["parallelism"])
+        _queues_ready = True
+    except Exception as e:
+        print(f"Could not set up the lane queues: {e}")
+
+def lane_message(lane, url, body, delay=None, **options):
+    """
+    A batch_json message for a lane. QStash queues don't take delays, so a
+    delayed message is published straight to the endpoint, marked with its
+    lane for requeue_delayed.
+    """
+    message = {"url": url, "body": body, **options}
+    if delay:
+        message["delay"] = delay
+        message["body"] = {**body, DELAYED_LANE_FIELD: lane}
+    else:
+        message["queue"] = LANES[lane]["queue"]
+    return message
+
+def requeue_delayed(qstash_client, url, body, **options):
+    """
+    Puts a delayed message that has just arrived into its lane queue.
+    Returns True if it did, and the endpoint should stop there; False for
+    a message that came through its queue and should be handled now.
+    """
+    lane = body.get(DELAYED_LANE_FIELD)
+    if lane is None:
+        return False
+    ensure_queues(qstash_client)
+    queued = {k: v for k, v in body.items() if k != DELAYED_LANE_FIELD}
+    qstash_client.message.batch_json([lane_message(lane, url, queued, **options)])
+    return True
+
+def delay_seconds(delay):
+    """Seconds in a QStash delay such as "10s", "5m" or "1h", for Retry-After"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if delay[-1] in units:
+        return int(float(delay[:-1]) * units[delay[-1]])
+    return int(delay)
+
+def event_lane(event):
+    return event.get("lane", LIVE)
+
+def mark_live_busy(redis):
+    try:
+        redis.set(LIVE_BUSY_KEY, "1", px=LIVE_BUSY_MS)
+    except Exception as e:
+        print(f"Could not flag live work: {e}")
+
+def should_yield(redis):
+    """True when bulk work should step aside for live events"""
+    try:
+        busy = redis.exists(LIVE_BUSY_KEY) > 0
+    except Exception as e:
+        print(f"Could not check for live work: {e}")
+        return False
+    if busy:
+        increment(redis, "bulk_yields_total")
+    return busy
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read-only standings straight from the leaderboard sorted set, no rebuild.
+
+GET /api/leaderboard                    top 10
+GET /api/leaderboard?top=25             top 25
+GET /api/leaderboard?athlete=Sean       Sean's rank and the 2 athletes either side
+GET /api/leaderboard?athlete=Sean&around=5
+Add &league=<name> for a league other than the default one.
+
+The sorted set is keyed by athlete id; names come from STRAVA_USERS.
+athlete= takes a name or an athlete id (for two athletes sharing a name).
+"""
+
+import os
+import json
+from flask import Flask, request, jsonify
+from upstash_redis import Redis
+from .strava_functions import LEADERBOARD_KEY
+from .leagues import DEFAULT_LEAGUE, league_key
+
+KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
+DEFAULT_TOP = 10
+MAX_TOP = 100
+DEFAULT_AROUND = 2
+
+app = Flask(__name__)
+
+def standings(entries, first_rank, users):
+    """Turns ZRANGE ... WITHSCORES output into ranked rows (rank 1 = leader)"""
+    return [{"rank": first_rank + i + 1, "name": users.get(athlete_id, {}).get("name"), "score": score}
+            for i, (athlete_id, score) in enumerate(entries)]
+
+def athlete_rank(redis, key, athlete, users):
+    """(athlete id, 0-based rank) for a name or id, or (None, None) if not ranked"""
+    candidates = [athlete_id for athlete_id, user in users.items() if user.get("name") == athlete]
+    for athlete_id in candidates or [athlete]:
+        rank = redis.zrevrank(key, athlete_id)
+        if rank is not None:
+            return athlete_id, rank
+    return None, None
+
+def bounded_int(value, default, low, high):
+    try:
+        return min(max(int(value), low), high)
+    except (TypeError, ValueError):
+        return default
+
+@app.route('/api/leaderboard', methods=['GET'])
+def leaderboard():
+    redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+    key = league_key(LEADERBOARD_KEY, request.args.get("league", DEFAULT_LEAGUE))
+    try:
+        users = json.loads(os.environ.get("STRAVA_USERS", "{}"))
+        total = redis.zcard(key)
+        athlete = request.args.get("athlete")
+        if athlete:
+            athlete_id, rank = athlete_rank(redis, key, athlete, users)
+            if rank is None:
+                response = jsonify(message="Athlete not on the leaderboard.")
+                response.status_code = 404
+            else:
+                around = bounded_int(request.args.get("around"), DEFAULT_AROUND, 0, MAX_TOP)
+                start = max(rank - around, 0)
+                entries = redis.zrange(key, start, rank + around,
+                                       rev=True, withscores=True)
+                response = jsonify(athlete=users.get(athlete_id, {}).get("name", athlete),
+                                   rank=rank + 1, total=total,
+                                   neighbours=standings(entries, start, users))
+        else:
+            top = bounded_int(request.args.get("top"), DEFAULT_TOP, 1, MAX_TOP)
+            entries = redis.zrange(key, 0, top - 1, rev=True, withscores=True)
+            response = jsonify(total=total, top=standings(entries, 0, users))
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        response = jsonify(message="Could not read the leaderboard.")
+        response.status_code = 500
+    # The scoreboard site is served from a different origin
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+League configuration. One deployment can run several competitions, each
+with its own roster, rules and output file.
+
+LEAGUES holds a JSON object of league name -> settings, all optional:
+
+    {
+      "family": {"athletes": ["123", "456"], "output": "scores.json",
+                 "rules": {"weekly_cap": 150}, "teams": {"team1": ["Sean"]}},
+      "office": {"athletes": ["789"], "rules": {"pto": 0}}
+    }
+
+Without LEAGUES every athlete in STRAVA_USERS plays in a single "default"
+league that publishes scores.json and uses the original Redis key names,
+so existing deployments carry on unchanged.
+"""
+
+import os
+import json
+
+DEFAULT_LEAGUE = "default"
+DEFAULT_RULES = {
+    "daily_cap": 50,
+    "weekly_cap": 150,
+    "pto": 750,
+    # Month of the team challenge, reported as "march" in the scoreboard
+    "challenge_month": 3,
+}
+
+def league_key(base, league):
+    """Redis key for a league. The default league keeps the unsuffixed name"""
+    return base if league == DEFAULT_LEAGUE else f"{base}:{league}"
+
+def league_file(base, league):
+    """Output file for a league, e.g. scores.json -> scores-office.json"""
+    if league == DEFAULT_LEAGUE:
+        return base
+    stem, ext = os.path.splitext(base)
+    return f"{stem}-{league}{ext}"
+
+def load_leagues(users=None):
+    """Returns league name -> {name, athletes, output, history, rules, teams}"""
+    if users is None:
+        users = json.loads(os.environ.get("STRAVA_USERS"))
+    raw = os.environ.get("LEAGUES")
+    configured = json.loads(raw) if raw else {DEFAULT_LEAGUE: {}}
+    leagues = {}
+    for name, settings in configured.items():
+        leagues[name] = {
+            "name": name,
+            # Athletes that have since deauthorized are dropped
+            "athletes": [a for a in settings.get("athletes", users) if a in users],
+            "output": settings.get("output", league_file("scores.json", name)),
+            "history": settings.get("history", league_file("history.json", name)),
+            "rules": {**DEFAULT_RULES, **settings.get("rules", {})},
+            "teams": settings.get("teams"),
+        }
+    return leagues
+
+def leagues_for_athletes(leagues, athlete_ids):
+    """Names of the leagues any of the athletes play in"""
+    athlete_ids = {str(a) for a in athlete_ids}
+    return [name for name, league in leagues.items() if athlete_ids & set(league["athletes"])]
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Leases are Redis keys taken with SET NX and a TTL, holding the holder's
+token. Releasing or extending one has to check the token and act in one
+step: a GET then DEL (or PEXPIRE) can touch the next holder's lease if
+ours ran out in between.
+"""
+
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def release_lease(redis, key, token):
+    """Deletes the lease only while token still holds it, returns whether it did"""
+    return redis.eval(RELEASE_SCRIPT, keys=[key], args=[token]) == 1
+
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+def extend_lease(redis, key, token, ms):
+    """
+    Gives the lease another ms only while token still holds it, returns
+    whether it did. Doubles as the fence check before a write.
+    """
+    return redis.eval(EXTEND_SCRIPT, keys=[key], args=[token, str(ms)]) == 1
@@ -10,6 +10,8 @@ print("DEBUG: Top of manual_update_scores.py") # <-- ADD THIS
 from flask import Flask, request, jsonify
 import os
 from .strava_functions import update_scores
+from .tracing import start_trace
+from .profiling import profiling_requested, profile_call, store_profile
 
 print("DEBUG: Imported strava_functions successfully") # <-- ADD THIS
 
@@ -30,6 +32,13 @@ def handler_of_manual_update():
 
     # 2. Your Script's Logic Goes Here
     try:
+        start_trace()
+        if profiling_requested(request.headers):
+            # Opt-in profiled run, only reachable after the secret check above
+            _, report = profile_call(update_scores)
+            report_key = store_profile("manual_update_scores", report)
+            return jsonify(message="Script executed successfully.", profile=report,
+                           profile_key=report_key), 200
         update_scores()
         # 3. Send a success response
         return jsonify(message="Script executed successfully."), 200
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Freshness metrics (see api/freshness.py) in the Prometheus text format.
+
+GET /api/metrics with "Authorization: Bearer <METRICS_TOKEN>", which
+falls back to VERCEL_MANUAL_SECRET when no separate scrape token is set.
+"""
+
+import os
+from flask import Flask, request, Response, jsonify
+from upstash_redis import Redis
+from .freshness import render_metrics
+from .leagues import load_leagues
+
+KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
+
+app = Flask(__name__)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    token = os.environ.get("METRICS_TOKEN") or os.environ.get("VERCEL_MANUAL_SECRET")
+    auth_header = request.headers.get('Authorization')
+    if not token or auth_header != f"Bearer {token}":
+        return jsonify(message="Unauthorized"), 401
+
+    try:
+        redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+        body = render_metrics(redis, list(load_leagues()))
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return jsonify(message="Could not read the metrics."), 500
+    response = Response(body, mimetype="text/plain")
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    response.headers["Cache-Control"] = "no-store"
+    return response
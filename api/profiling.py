@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-demand CPU and memory profiling for the authenticated endpoints.
+
+Send "X-Profile: 1" along with the usual Authorization header and the
+handler runs under cProfile and tracemalloc. The top hot functions and
+allocation sites come back in the response and are kept in Redis for a
+week under profile:<endpoint>:<timestamp>.
+
+cProfile only sees the thread it runs in, so code that fans out to
+worker threads checks profiling_active() and stays on the calling
+thread during a profiled run.
+"""
+
+import os
+import json
+import time
+import cProfile
+import pstats
+import tracemalloc
+import contextvars
+from upstash_redis import Redis
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_TTL = 7 * 24 * 3600
+DEFAULT_TOP = 25
+
+_profiling = contextvars.ContextVar("profiling", default=False)
+
+def profiling_requested(headers):
+    """True when the request asked for a profiled run"""
+    return headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+def profiling_active():
+    """True inside profile_call, where work should stay on this thread"""
+    return _profiling.get()
+
+def profile_call(func, *args, top=DEFAULT_TOP, **kwargs):
+    """
+    Runs func under cProfile and tracemalloc and returns its result along
+    with a report of the top functions by cumulative time and the lines
+    that allocated the most memory still held at the end of the run.
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start(10)
+    active = _profiling.set(True)
+    start = time.perf_counter()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        wall = time.perf_counter() - start
+        _profiling.reset(active)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    stats = pstats.Stats(profiler)
+    hot = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        hot.append({
+            "function": name,
+            "file": filename,
+            "line": line,
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    hot.sort(key=lambda h: h["cumtime_ms"], reverse=True)
+
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+    allocations = []
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        allocations.append({
+            "file": frame.filename,
+            "line": frame.lineno,
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        })
+
+    report = {
+        "wall_ms": round(wall * 1000, 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "hot_functions": hot[:top],
+        "allocation_sites": allocations,
+    }
+    return result, report
+
+def store_profile(endpoint, report):
+    """Keeps a profile report in Redis and returns its key"""
+    KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+    KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
+    redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+    key = f"profile:{endpoint}:{int(time.time())}"
+    try:
+        redis.set(key, json.dumps(report), ex=PROFILE_TTL)
+        print(f"Stored profile report at {key}")
+    except Exception as e:
+        print(f"Could not store profile report: {e}")
+        return None
+    return key
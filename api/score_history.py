@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Daily score snapshots and the columnar history archive built from them.
+
+Every update_scores run writes one row per day to the score_history hash
+in Redis (the last run of the day wins), which is a single HSET. The
+first publish of each day turns the hash into history.json, up to and
+including yesterday, and publishes it next to scores.json, so every day
+in the archive holds that day's final standings. The archive is
+columnar so a trend chart can pull one athlete's series straight out of
+it:
+
+    {
+      "dates": ["2026-01-01", ...],
+      "athletes": ["Alice", ...],
+      "columns": {"score": [[...one value per date...], ...one list per athlete], ...}
+    }
+
+Days an athlete wasn't on the roster are null.
+"""
+
+import json
+from .leagues import DEFAULT_LEAGUE, league_key
+
+HISTORY_KEY = "score_history"
+PUBLISHED_KEY = "score_history:published"
+HISTORY_FILE = "history.json"
+# Per athlete values kept for every day
+FIELDS = ("score", "week", "march", "pto")
+
+def this_week_score(last_7):
+    """Points since Monday, from the last_7 block of scores.json"""
+    found_monday = False
+    total = 0
+    for key, value in last_7.items():
+        if key == "PTO remaining":
+            continue
+        if "Mon" in key:
+            found_monday = True
+        if found_monday:
+            total += value
+    return total
+
+def snapshot_row(final_data):
+    """Condenses a scores.json payload into one columnar day of history"""
+    leaderboard = final_data["leaderboard"]
+    return {
+        "athletes": [athlete["name"] for athlete in leaderboard],
+        "score": [round(athlete["score"], 1) for athlete in leaderboard],
+        "week": [round(this_week_score(athlete["last_7"]), 1) for athlete in leaderboard],
+        "march": [round(athlete["march"], 1) for athlete in leaderboard],
+        "pto": [athlete["last_7"].get("PTO remaining", 0) for athlete in leaderboard],
+    }
+
+def record_snapshot(redis, final_data, day, league=DEFAULT_LEAGUE):
+    """Stores (or replaces) the snapshot for day"""
+    redis.hset(league_key(HISTORY_KEY, league), day.isoformat(),
+               json.dumps(snapshot_row(final_data)))
+
+def archive_due(redis, day, league=DEFAULT_LEAGUE):
+    """True if the league's history file hasn't been published yet today"""
+    return redis.get(league_key(PUBLISHED_KEY, league)) != day.isoformat()
+
+def mark_published(redis, day, league=DEFAULT_LEAGUE):
+    redis.set(league_key(PUBLISHED_KEY, league), day.isoformat())
+
+def build_archive(history):
+    """Turns the score_history hash into the columnar history.json layout"""
+    dates = sorted(history)
+    rows = [json.loads(history[d]) for d in dates]
+    athletes = sorted({name for row in rows for name in row["athletes"]})
+    position = {name: i for i, name in enumerate(athletes)}
+    columns = {field: [[None] * len(dates) for _ in athletes] for field in FIELDS}
+    for d, row in enumerate(rows):
+        for i, name in enumerate(row["athletes"]):
+            for field in FIELDS:
+                columns[field][position[name]][d] = row[field][i]
+    return {"dates": dates, "athletes": athletes, "columns": columns}
+
+def load_history(redis, league=DEFAULT_LEAGUE, before=None):
+    """
+    The archive built straight from Redis, without waiting for a publish.
+    before (a date) leaves out that day and later ones, which may still
+    change.
+    """
+    history = redis.hgetall(league_key(HISTORY_KEY, league))
+    if before is not None:
+        history = {d: row for d, row in history.items() if d < before.isoformat()}
+    return build_archive(history)
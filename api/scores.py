@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Serves the latest scoreboard straight from Redis, so a new workout shows
+up as soon as the rebuild finishes instead of after GitHub Pages redeploys.
+
+GET /api/scores returns the same JSON as scores.json with a strong ETag
+(?league=<name> for a league other than the default one).
+Clients that send it back in If-None-Match get a bodyless 304 until the
+scoreboard changes, and the ETag is checked before the scoreboard itself
+is read from Redis.
+"""
+
+import os
+from flask import Flask, request, Response, jsonify
+from upstash_redis import Redis
+from .strava_functions import SCORES_LATEST_KEY
+from .leagues import DEFAULT_LEAGUE, league_key
+
+KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
+# Short enough that a poll every minute or so sees new scores quickly, and
+# lets the CDN absorb bursts of visitors
+CACHE_CONTROL = "public, max-age=15, s-maxage=15, stale-while-revalidate=60"
+# Errors mustn't be cached, or the CDN keeps serving them after recovery
+ERROR_CACHE_CONTROL = "no-store"
+
+app = Flask(__name__)
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match can hold several ETags, weak ones included, or *"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def with_headers(response, etag=None):
+    if etag:
+        response.headers["ETag"] = etag
+    # Only a scoreboard (200) or a confirmation of one (304) is cacheable
+    cacheable = response.status_code in (200, 304)
+    response.headers["Cache-Control"] = CACHE_CONTROL if cacheable else ERROR_CACHE_CONTROL
+    # The scoreboard site is served from a different origin
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Expose-Headers"] = "ETag"
+    return response
+
+@app.route('/api/scores', methods=['GET'])
+def scores():
+    redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+    key = league_key(SCORES_LATEST_KEY, request.args.get("league", DEFAULT_LEAGUE))
+    try:
+        etag = redis.hget(key, "etag")
+        if etag is None:
+            response = jsonify(message="No scoreboard has been built yet.")
+            response.status_code = 404
+            return with_headers(response)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return with_headers(Response(status=304), etag)
+        # Read both together so the ETag sent always matches the body
+        etag, data = redis.hmget(key, "etag", "data")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        response = jsonify(message="Could not read the scoreboard.")
+        response.status_code = 500
+        return with_headers(response)
+    return with_headers(Response(data, mimetype="application/json"), etag)
@@ -7,11 +7,20 @@ Created on Fri Oct  3 15:47:36 2025
 """
 import os
 import json
-from flask import Flask, request
+import time
+from flask import Flask, request, make_response
 from upstash_redis import Redis
 import qstash
 import requests
-from .strava_functions import activity_processing, update_scores
+from .strava_functions import (activity_processing, update_scores, store_activity,
+                               delete_activity, delete_athlete_activities, dead_letter,
+                               PermanentError, RetryableError)
+from .tracing import start_trace
+from . import http_client
+from .freshness import observe, increment
+from .lanes import (LIVE, BULK, BULK_YIELD_DELAY, PROCESSING_URL, ACTIVITY_RETRIES, event_lane,
+                    delay_seconds, lane_message, mark_live_busy, requeue_delayed, should_yield)
+from .concurrency import acquire_slots, release_slots, shed_delay, MAX_DEFERRALS
 
 QSTASH_TOKEN = os.environ.get('QSTASH_TOKEN')
 
@@ -26,7 +35,7 @@ KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
 
 
 # Initialize the QStash client to send messages
-#qstash_client = qstash.QStash(QSTASH_TOKEN)
+qstash_client = qstash.QStash(QSTASH_TOKEN)
 
 receiver = qstash.Receiver(
     current_signing_key=QSTASH_CURRENT,
@@ -54,7 +63,7 @@ def process_queued_event():
         receiver.verify(
             signature=signature,
             body=request.get_data(as_text=True),
-            url="https://hr-github.vercel.app/api/strava_activity_handler"
+            url=PROCESSING_URL
         )
         print("✅ QStash signature verified.")
     except Exception as e:
@@ -63,6 +72,13 @@ def process_queued_event():
 
     # --- Event Logic with Nested Hash Structure ---
     event_data = request.get_json()
+    try:
+        # Delayed events go through their lane queue before being handled
+        if requeue_delayed(qstash_client, PROCESSING_URL, event_data, retries=ACTIVITY_RETRIES):
+            return 'Requeued', 200
+    except Exception as e:
+        print(f"❌ ERROR putting the delayed event in its lane. Error: {e}")
+        return 'Requeue Failed', 500
     print("Processing event data:")
     #print(json.dumps(event_data, indent=2))
 
@@ -70,12 +86,70 @@ def process_queued_event():
     aspect_type = event_data.get('aspect_type')
     owner_id = event_data.get('owner_id')
     object_id = event_data.get('object_id')
+    # Tie every log line for this event together
+    event_id = start_trace(request.headers.get("Upstash-Message-Id") or f"{owner_id}-{object_id}-{aspect_type}")
     
     # The key for the top-level hash is the athlete's ID
     athlete_key = str(owner_id)
+    letter_id = f"{owner_id}-{object_id}-{aspect_type}"
+    retried = int(request.headers.get("Upstash-Retried", 0))
+    last_attempt = retried >= ACTIVITY_RETRIES
+    redis = Redis(url=KV_REST_API_URL,token=KV_REST_API_TOKEN)
+    live = event_lane(event_data) == LIVE
+    # Stamped by the webhook. Bulk events can carry an old stamp (a dead
+    # letter being reprocessed), which would only skew the freshness numbers
+    received_at = event_data.get('received_at') if live else None
+    if retried:
+        increment(redis, "event_retries_total")
+
+    if live:
+        mark_live_busy(redis)
+    elif should_yield(redis):
+        # Bulk work goes to the back while live events are being handled
+        print("Live events in flight, deferring bulk event")
+        try:
+            qstash_client.message.batch_json([
+                lane_message(BULK, PROCESSING_URL, event_data, BULK_YIELD_DELAY, retries=ACTIVITY_RETRIES)])
+        except Exception as e:
+            # Still stepping aside, QStash's own retry brings it back later
+            print(f"Could not requeue the bulk event, handing it back to QStash: {e}")
+            response = make_response('Yielding To Live Events', 429)
+            response.headers['Retry-After'] = str(delay_seconds(BULK_YIELD_DELAY))
+            return response
+        return 'Deferred', 200
 
+    slots, shed_scope = acquire_slots(redis, athlete_key, event_lane(event_data))
+    if slots is None:
+        # Over capacity: come back a little later rather than run and fail
+        deferrals = event_data.get('deferrals', 0)
+        delay = shed_delay(event_lane(event_data), deferrals)
+        if deferrals >= MAX_DEFERRALS:
+            print(f"Deferred {deferrals} times, handing the event back to QStash")
+            if last_attempt:
+                dead_letter(redis, letter_id, event_data,
+                            RetryableError(f"Over the {shed_scope} concurrency limit after {deferrals} deferrals"),
+                            "webhook")
+                increment(redis, "events_processed_total", outcome="exhausted")
+                return 'Over Capacity, Retries Exhausted', 200
+            response = make_response('Over Capacity', 429)
+            response.headers['Retry-After'] = str(delay_seconds(delay))
+            return response
+        print(f"Over the {shed_scope} concurrency limit, deferring event by {delay}")
+        try:
+            qstash_client.message.batch_json([
+                lane_message(event_lane(event_data), PROCESSING_URL, {**event_data, 'deferrals': deferrals + 1},
+                             delay, retries=ACTIVITY_RETRIES)])
+        except Exception as e:
+            print(f"Could not requeue the event, handing it back to QStash: {e}")
+            response = make_response('Over Capacity', 429)
+            response.headers['Retry-After'] = str(delay_seconds(delay))
+            return response
+        return 'Deferred', 200
+
+    processing_started = time.time()
+    if received_at:
+        observe(redis, "queue_wait", processing_started - received_at)
     try:
-        redis = Redis(url=KV_REST_API_URL,token=KV_REST_API_TOKEN)
         if object_type == 'activity':
             # The field within the hash is the activity's ID
             activity_field = str(object_id)
@@ -88,13 +162,13 @@ def process_queued_event():
                 # Check if token needs refreshing
                 # Use token and Activity ID to bring in information
                 activity_value = activity_processing(str(owner_id),str(object_id))
-                redis.hset(athlete_key, activity_field, str(activity_value))
+                store_activity(redis, athlete_key, activity_field, activity_value)
                 print("✅ Successfully saved activity")
 
             elif aspect_type == 'delete':
                 # For deletes, we remove the specific activity field from the athlete's hash.
                 print("Deleting activity...")
-                redis.hdel(athlete_key, activity_field)
+                delete_activity(redis, athlete_key, activity_field)
                 print("✅ Successfully deleted activity")
 
         elif object_type == 'athlete':
@@ -103,18 +177,42 @@ def process_queued_event():
                 # This handles the deauthorization event.
                 # We delete the entire hash for the athlete, removing all their data.
                 print("Athlete deauthorized. Deleting all their data...")
-                redis.delete(athlete_key)
+                delete_athlete_activities(redis, athlete_key)
                 # Also need to delete all secrets that were associated with athlete
                 remove_athlete_secrets(str(object_id))
                 
                 print("✅ Successfully deleted all data for athlete")
-        update_scores()
+        observe(redis, "processing", time.time() - processing_started)
+        # Only the leagues this athlete plays in need rebuilding
+        update_scores(athlete_ids=[athlete_key],
+                      received={event_id: received_at} if received_at else None)
+
+    except PermanentError as e:
+        # Retrying can't help, so stop QStash from trying again
+        dead_letter(redis, letter_id, event_data, e, "webhook")
+        increment(redis, "events_processed_total", outcome="permanent")
+        return 'Processing Failed Permanently', 200
 
     except Exception as e:
         print(f"❌ ERROR processing event for athlete. Error: {e}")
+        if last_attempt:
+            dead_letter(redis, letter_id, event_data, e, "webhook")
+            increment(redis, "events_processed_total", outcome="exhausted")
+            return 'Processing Failed, Retries Exhausted', 200
+        increment(redis, "events_processed_total", outcome="retryable")
         # Return an error to QStash so it can retry the job if something fails.
-        return 'Processing Failed', 500
+        status = 429 if getattr(e, "status", None) == 429 else 500
+        response = make_response('Processing Failed', status)
+        # Rate limits and open circuits say when it's worth trying again
+        retry_after = getattr(e, "retry_after", None)
+        if retry_after:
+            response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    finally:
+        release_slots(redis, slots)
 
+    increment(redis, "events_processed_total", outcome="ok")
     # Return 200 OK to QStash to confirm the job is done.
     return 'Processing Complete', 200
 
@@ -153,7 +251,7 @@ def remove_athlete_secrets(athlete_id):
             "target": ["production", "preview", "development"]
         }
         print("Updating 'STRAVA_USERS' secret...")
-        create_response_users = requests.patch(url_users, headers=headers, json=payload_users)
+        create_response_users = http_client.patch("vercel", url_users, headers=headers, json=payload_users)
         create_response_users.raise_for_status()
         print("Secret STRAVA_USERS updated successfully.")
 
@@ -164,7 +262,7 @@ def remove_athlete_secrets(athlete_id):
             "target": ["production", "preview", "development"]
         }
         print("Updating 'HR_DATA' secret...")
-        create_response_hr = requests.patch(url_hr, headers=headers, json=payload_hr)
+        create_response_hr = http_client.patch("vercel", url_hr, headers=headers, json=payload_hr)
         create_response_hr.raise_for_status()
         print("Secret 'HR_DATA' updated successfully.")
         
@@ -183,7 +281,7 @@ def remove_athlete_secrets(athlete_id):
 
     try:
         print("Triggering Vercel redeployment...")
-        response = requests.post(hook_url)
+        response = http_client.post("vercel", hook_url)
         
         # Check if the request was accepted
         response.raise_for_status() 
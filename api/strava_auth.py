@@ -4,6 +4,7 @@ import requests
 import json
 import base64
 from urllib.parse import urlparse, parse_qs
+from . import http_client
 
 # --- Environment Variables ---
 CLIENT_ID = os.environ.get("STRAVA_CLIENT_ID")
@@ -12,6 +13,7 @@ PAT_FOR_SECRETS = os.environ.get("PAT_FOR_SECRETS")
 REPO_OWNER = os.environ.get("GITHUB_REPO_OWNER")
 REPO_NAME = os.environ.get("GITHUB_REPO_NAME")
 JOIN_PASSWORD = os.environ.get("JOIN_PASSWORD")
+STRAVA_BASE_URL = os.environ.get("STRAVA_BASE_URL", "https://www.strava.com")
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -51,8 +53,9 @@ class handler(BaseHTTPRequestHandler):
             return
 
         try:
-            token_response = requests.post(
-                "https://www.strava.com/api/v3/oauth/token",
+            token_response = http_client.post(
+                "strava",
+                f"{STRAVA_BASE_URL}/api/v3/oauth/token",
                 data={ "client_id": CLIENT_ID, "client_secret": CLIENT_SECRET, "code": code, "grant_type": "authorization_code" }
             )
             token_response.raise_for_status()
@@ -176,7 +179,7 @@ def update_secrets(user_data, hr_data):
             "target": ["production", "preview", "development"]
         }
         print(f"Creating/updating '{SECRET_KEY_TO_CHANGE}' secret...")
-        create_response_users = requests.patch(url_users, headers=headers, json=payload_users)
+        create_response_users = http_client.patch("vercel", url_users, headers=headers, json=payload_users)
         create_response_users.raise_for_status()
         print(f"Secret '{SECRET_KEY_TO_CHANGE}' updated successfully.")
 
@@ -192,7 +195,7 @@ def update_secrets(user_data, hr_data):
             "target": ["production", "preview", "development"]
         }
         print(f"Creating/updating '{OTHER_KEY_TO_CHANGE}' secret...")
-        create_response_hr = requests.patch(url_hr, headers=headers, json=payload_hr)
+        create_response_hr = http_client.patch("vercel", url_hr, headers=headers, json=payload_hr)
         create_response_hr.raise_for_status()
         print(f"Secret '{OTHER_KEY_TO_CHANGE}' updated successfully.")
         
@@ -211,7 +214,7 @@ def update_secrets(user_data, hr_data):
 
     try:
         print("Triggering Vercel redeployment...")
-        response = requests.post(hook_url)
+        response = http_client.post("vercel", hook_url)
         
         # Check if the request was accepted
         response.raise_for_status() 
@@ -10,15 +10,101 @@ import os
 import json
 import time
 import base64
+import hashlib
 import requests
 import math
 from datetime import date, timedelta, datetime
 from dateutil import parser
 from upstash_redis import Redis
 from collections import defaultdict
+from itertools import islice
 import ast
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 import numpy as np
+from .tracing import span, traced
+from .score_history import (this_week_score, record_snapshot, archive_due,
+                            mark_published, load_history)
+from .leagues import (DEFAULT_LEAGUE, DEFAULT_RULES, league_key, load_leagues,
+                      leagues_for_athletes)
+from .freshness import observe, increment, mark_pending, observe_published
+from . import http_client
+from .leases import release_lease, extend_lease
+from .profiling import profiling_active
+
+# Base URLs can be pointed at local stand-ins (see loadtest/)
+STRAVA_BASE_URL = os.environ.get("STRAVA_BASE_URL", "https://www.strava.com")
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+# Largest page Strava's athlete activities list will return
+STRAVA_MAX_PAGE_SIZE = 200
+# Streams longer than this (~5.5 hours at 1 sample/s) get their zone times
+# computed in chunks of ZONE_CHUNK_SIZE samples to bound memory
+LONG_STREAM_SAMPLES = 20000
+ZONE_CHUNK_SIZE = 4096
+# Points Strava returns for each stream resolution, lowest first
+STREAM_RESOLUTIONS = (("low", 100), ("medium", 1000), ("high", 10000))
+# Accuracy budget for stream downloads: the widest average spacing (in
+# seconds) between HR samples we'll accept for a smaller payload. The
+# default 0 always fetches full resolution, since downsampling changes
+# stored zone times (up to ~0.5% of a score at 10s); it's opt in. Keep it
+# well under the 300s pause clamp in time_in_zones. See
+# benchmarks/stream_resolution.py for the tradeoff.
+STREAM_MAX_SAMPLE_SECONDS = float(os.environ.get("STREAM_MAX_SAMPLE_SECONDS", 0))
+# Activity fields activity_processing uses, all of which the athlete
+# activities list already returns
+SUMMARY_FIELDS = ("sport_type", "start_date_local", "elapsed_time")
+
+# --- Failure classification ---
+# Jobs that can never succeed (deleted or private activity, revoked access,
+# unknown athlete) raise PermanentError and get parked in the dead-letter
+# store; anything that may work later (rate limits, Strava/GitHub outages,
+# network trouble) raises RetryableError and is retried with backoff.
+DEAD_LETTER_KEY = "dead_letters"
+PERMANENT_STATUSES = {400, 401, 403, 404, 410, 422}
+# Strava's short rate limit window
+RATE_LIMIT_RETRY_SECONDS = 15 * 60
+
+class PermanentError(Exception):
+    """A failure that retrying won't fix"""
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class RetryableError(Exception):
+    """A failure that should be retried, after retry_after seconds if given"""
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def classify_response(response, what):
+    """Raises the right error for a failed HTTP response, returns if it's fine"""
+    status = response.status_code
+    if status < 400:
+        return
+    message = f"{what} failed with HTTP {status}: {response.text[:200]}"
+    if status == 429:
+        raise RetryableError(message, status, retry_after=RATE_LIMIT_RETRY_SECONDS)
+    if status in PERMANENT_STATUSES:
+        raise PermanentError(message, status)
+    raise RetryableError(message, status)
+
+def dead_letter(redis, letter_id, event, error, source):
+    """Parks a job that failed permanently so it can be looked at and reprocessed"""
+    redis.hset(DEAD_LETTER_KEY, letter_id, json.dumps({
+        "event": event,
+        "source": source,
+        "error": str(error),
+        "status": getattr(error, "status", None),
+        "failed_at": int(time.time()),
+    }))
+    print(f"☠️ Parked {letter_id} in the dead-letter store: {error}")
+
+def activity_event(athlete_id, activity_id, aspect_type="create"):
+    """A Strava webhook style event, for jobs that didn't come from the webhook"""
+    return {"object_type": "activity", "aspect_type": aspect_type,
+            "object_id": int(activity_id), "owner_id": int(athlete_id)}
 
 def token_expired(expires_at):
     """Check if the Strava token is expired."""
@@ -27,8 +113,9 @@ def token_expired(expires_at):
 def refresh_strava_token(client_id, client_secret, user_creds, athlete_id):
     """Refresh the Strava access token."""
     print("Strava token is expired, refreshing...")
-    response = requests.post(
-        "https://www.strava.com/oauth/token",
+    response = http_client.post(
+        "strava",
+        f"{STRAVA_BASE_URL}/oauth/token",
         data={
             "client_id": client_id,
             "client_secret": client_secret,
@@ -37,8 +124,8 @@ def refresh_strava_token(client_id, client_secret, user_creds, athlete_id):
         }
     )
     
-    if response.status_code != 200:
-        raise Exception(f"Token refresh failed: {response.text}")
+    # A 400/401 here means the athlete revoked access
+    classify_response(response, "Token refresh")
     
     token_data = response.json()
     print("Token refreshed successfully.")
@@ -68,7 +155,7 @@ def refresh_strava_token(client_id, client_secret, user_creds, athlete_id):
             "target": ["production", "preview", "development"]
         }
         print(f"Creating/updating '{SECRET_KEY_TO_CHANGE}' secret...")
-        create_response_users = requests.patch(url_users, headers=headers, json=payload_users)
+        create_response_users = http_client.patch("vercel", url_users, headers=headers, json=payload_users)
         create_response_users.raise_for_status()
         print(f"Secret '{SECRET_KEY_TO_CHANGE}' updated successfully.")
         
@@ -83,18 +170,64 @@ def refresh_strava_token(client_id, client_secret, user_creds, athlete_id):
     
     return token_data
 
-def activity_handler(athlete_id, activity_id):
-    """Pulls data from a specific activity from Strava"""
+def get_user_creds(athlete_id):
+    """Returns the athlete's Strava credentials, refreshing the token if needed"""
+    client_id = os.environ.get("STRAVA_CLIENT_ID")
+    client_secret = os.environ.get("STRAVA_CLIENT_SECRET")
+    users = json.loads(os.environ.get("STRAVA_USERS"))
+    user_creds = users[athlete_id]
+    if token_expired(user_creds["expires_at"]):
+        refresh_strava_token(client_id, client_secret, user_creds, athlete_id)
+    return user_creds
+
+def get_activities_page(user_creds, after_timestamp, before_timestamp=None, page=1,
+                        per_page=STRAVA_MAX_PAGE_SIZE):
+    """Fetch a single page of an athlete's activities between two timestamps."""
+    headers = {'Authorization': f'Bearer {user_creds["access_token"]}'}
+    params = {'after': after_timestamp, 'page': page, 'per_page': per_page}
+    if before_timestamp is not None:
+        params['before'] = before_timestamp
+    with span("strava.list_activities", page=page, per_page=per_page) as s:
+        response = http_client.get("strava", f'{STRAVA_BASE_URL}/api/v3/athlete/activities',
+                                   headers=headers, params=params)
+        s["http_status"] = response.status_code
+    # A 401 here means the athlete revoked access, a 429 the rate limit
+    classify_response(response, f"Listing activities page {page}")
+    return response.json()
+
+def pick_stream_resolution(elapsed_time, max_sample_seconds=STREAM_MAX_SAMPLE_SECONDS):
+    """
+    Lowest stream resolution that keeps samples at most max_sample_seconds
+    apart over the activity's elapsed time, or None for full resolution.
+    Activities too long for even "high" (10000 points) to stay within the
+    budget, over ~27.8 hours at 10s, also get full resolution: the budget
+    is about accuracy, so the biggest streams aren't reduced.
+    """
+    if max_sample_seconds <= 0 or not elapsed_time:
+        return None
+    for resolution, points in STREAM_RESOLUTIONS:
+        if elapsed_time / points <= max_sample_seconds:
+            return resolution
+    return None
+
+def activity_handler(athlete_id, activity_id, summary=None):
+    """
+    Pulls data from a specific activity from Strava. A summary from the
+    athlete's activities list (get_activities_page) with every
+    SUMMARY_FIELDS stands in for the activity fetch, leaving only the
+    streams call. Raises PermanentError or RetryableError when it can't.
+    """
     # Get all secret user data
     try:
         client_id = os.environ.get("STRAVA_CLIENT_ID")
         client_secret = os.environ.get("STRAVA_CLIENT_SECRET")
         users = json.loads(os.environ.get("STRAVA_USERS"))
         #hr_data_config = json.loads(os.environ["HR_DATA"])
-    except (KeyError, json.JSONDecodeError) as e:
-        print(f"Error: Missing or invalid environment variable. Please check your GitHub Secrets. Details: {e}")
-        return
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise PermanentError(f"Missing or invalid STRAVA_USERS environment variable: {e}")
     # Pair it down to just the data related to the specific person
+    if athlete_id not in users:
+        raise PermanentError(f"Athlete {athlete_id} is not a registered user")
     user_creds = users[athlete_id]
     #Verify the token isn't expire. Handle it if it is
     if token_expired(user_creds["expires_at"]):
@@ -103,44 +236,54 @@ def activity_handler(athlete_id, activity_id):
         user_creds["refresh_token"] = token_data["refresh_token"]
         user_creds["expires_at"] = token_data["expires_at"]
     # Pull the information from Strava
-    strava_url = f"https://www.strava.com/api/v3/activities/{activity_id}"
+    strava_url = f"{STRAVA_BASE_URL}/api/v3/activities/{activity_id}"
     headers = {
         'Authorization': f'Bearer {user_creds["access_token"]}'
     }
 
-    try:
-        # Make the GET request to the API
-        response = requests.get(strava_url, headers=headers)
-
-        # This will raise an exception for HTTP error codes (4xx or 5xx)
-        response.raise_for_status()
-
-        # If the request was successful, parse the JSON response
-        activity_data = response.json()
-        print("✅ Successfully fetched activity data.")
-        #return activity_data
-
-    except requests.exceptions.HTTPError as http_err:
-        print(f"❌ HTTP error occurred: {http_err}")
-        print(f"   Status Code: {response.status_code}")
-        print(f"   Response Body: {response.text}")
+    if summary is not None and all(summary.get(k) is not None for k in SUMMARY_FIELDS):
+        activity_data = summary
+    else:
+        try:
+            # Make the GET request to the API
+            with span("strava.activity", athlete_id=athlete_id, activity_id=activity_id) as s:
+                response = http_client.get("strava", strava_url, headers=headers)
+                s["http_status"] = response.status_code
+                s["bytes"] = len(response.content)
+        except requests.exceptions.RequestException as err:
+            raise RetryableError(f"Could not reach Strava for activity {activity_id}: {err}",
+                                 retry_after=getattr(err, "retry_after", None))
         # Common errors:
         # 401 Unauthorized -> Your access_token is invalid or expired.
         # 404 Not Found -> The activity ID doesn't exist or is private.
-        return None
-    except Exception as err:
-        print(f"❌ An other error occurred: {err}")
-        return None
+        classify_response(response, f"Fetching activity {activity_id}")
+        activity_data = response.json()
+        print("✅ Successfully fetched activity data.")
     
     # Get HR stream
     headers = {'Authorization': f'Bearer {user_creds["access_token"]}'}
-    stream_url = f"https://www.strava.com/api/v3/activities/{activity_id}/streams"
+    stream_url = f"{STRAVA_BASE_URL}/api/v3/activities/{activity_id}/streams"
     stream_params = {'keys': 'heartrate,time', 'key_by_type': 'true'}
+    resolution = pick_stream_resolution(activity_data.get('elapsed_time'))
+    if resolution:
+        stream_params['resolution'] = resolution
+        stream_params['series_type'] = 'time'
     
-    stream_resp = requests.get(stream_url, headers=headers, params=stream_params)
-    if stream_resp.status_code == 200:
-        hr_stream = stream_resp.json().get('heartrate', {}).get('data', [])
-        time_stream = stream_resp.json().get('time',{}).get('data',[])
+    try:
+        with span("strava.streams", athlete_id=athlete_id, activity_id=activity_id,
+                  resolution=resolution or "full") as s:
+            stream_resp = http_client.get("strava", stream_url, headers=headers, params=stream_params)
+            s["http_status"] = stream_resp.status_code
+            s["bytes"] = len(stream_resp.content)
+    except requests.exceptions.RequestException as err:
+        raise RetryableError(f"Could not reach Strava for activity {activity_id} streams: {err}",
+                             retry_after=getattr(err, "retry_after", None))
+    classify_response(stream_resp, f"Fetching streams for activity {activity_id}")
+    with span("strava.parse_streams", activity_id=activity_id) as s:
+        streams = stream_resp.json()
+        hr_stream = streams.get('heartrate', {}).get('data', [])
+        time_stream = streams.get('time',{}).get('data',[])
+        s["samples"] = len(hr_stream)
     return activity_data, hr_stream, time_stream
 
 def zone_builder(athlete_id):
@@ -191,6 +334,11 @@ def time_in_zones(athlete_id,hr_data, time_data):
     # Define Athlete Specific Zones
     zone_maxes, min_hr = zone_builder(athlete_id)
     # Find time spent in each zone
+    accumulate_zones(zones, hr_data, weights, zone_maxes, min_hr)
+    return zones, np.sum(weights)
+
+def accumulate_zones(zones, hr_data, weights, zone_maxes, min_hr):
+    """Adds each sample's weight to the zone its heart rate falls in"""
     # We zip hr_data with our calculated weights to increment correctly
     for hr, duration in zip(hr_data, weights):
         if hr < min_hr:
@@ -205,15 +353,68 @@ def time_in_zones(athlete_id,hr_data, time_data):
             zones["z4"] += duration
         else:
             zones["z5"] += duration
-    return zones, np.sum(weights)
+
+def time_in_zones_chunked(athlete_id, hr_data, time_data, chunk_size=ZONE_CHUNK_SIZE):
+    """
+    Same result as time_in_zones, but works through the streams chunk_size
+    samples at a time so memory stays O(chunk_size) however long the
+    activity is. hr_data and time_data can be any iterables, and time_data
+    must be in order (as Strava's time stream is).
+
+    A block of samples sharing a timestamp can't be weighted until the
+    next timestamp is seen, so the last block of every chunk is carried
+    over into the next one. Zone totals come out identical to
+    time_in_zones; the returned total time is summed chunk by chunk, so it
+    can differ from np.sum over the whole stream in the last few bits.
+    """
+    zones = {"z1": 0 , "z2" : 0, "z3": 0, "z4": 0, "z5": 0}
+    zone_maxes, min_hr = zone_builder(athlete_id)
+    samples = zip(hr_data, time_data)
+    carried_hr = np.array([])
+    carried_t = np.array([], dtype=np.int64)
+    total = 0.0
+    while True:
+        chunk = list(islice(samples, chunk_size))
+        if not chunk:
+            break
+        hr = np.concatenate((carried_hr, [h for h, _ in chunk]))
+        t = np.concatenate((carried_t, [s for _, s in chunk]))
+        unique_times, counts = np.unique(t, return_counts=True)
+        if len(unique_times) == 1:
+            # Still inside the same block, keep collecting it
+            carried_hr, carried_t = hr, t
+            continue
+        # Every block but the last now knows the time of the one after it
+        block_durations = np.diff(unique_times)
+        block_durations[block_durations > 300] = 1.0
+        weight_per_block = block_durations / counts[:-1]
+        done = len(t) - counts[-1]
+        weights = np.repeat(weight_per_block, counts[:-1])
+        accumulate_zones(zones, hr[:done], weights, zone_maxes, min_hr)
+        total += np.sum(weights)
+        carried_hr, carried_t = hr[done:], t[done:]
+    if len(carried_t) == 0:
+        return zones, 0
+    # The final block gets the default 1s duration
+    weights = np.repeat(1 / len(carried_t), len(carried_t))
+    accumulate_zones(zones, carried_hr, weights, zone_maxes, min_hr)
+    total += np.sum(weights)
+    return zones, total
     
     
-def activity_processing(athlete_id, activity_id):
+@traced("activity_processing")
+def activity_processing(athlete_id, activity_id, summary=None):
     """This handles the activity data received from a request and
-    only pulls and saves the hr data needed for the competition"""
-    activity_data, hr_data, time_data = activity_handler(athlete_id, activity_id)
+    only pulls and saves the hr data needed for the competition.
+    Pass the activity's summary from a list call to skip fetching it."""
+    activity_data, hr_data, time_data = activity_handler(athlete_id, activity_id, summary)
     print("Successfully pulled activity data")
-    zone_info, tot_time = time_in_zones(athlete_id,hr_data, time_data)
+    with span("time_in_zones", athlete_id=athlete_id, activity_id=activity_id,
+              samples=len(hr_data)):
+        if len(hr_data) > LONG_STREAM_SAMPLES:
+            zone_info, tot_time = time_in_zones_chunked(athlete_id, hr_data, time_data)
+        else:
+            zone_info, tot_time = time_in_zones(athlete_id,hr_data, time_data)
     print("Successfully managed zone times")
     # --- SANITIZATION STEP ---
     # Convert all numpy types in the dictionary to standard Python floats
@@ -232,19 +433,103 @@ def activity_processing(athlete_id, activity_id):
     zone_info["date"] = date_str
     print("Created KV input")
     return zone_info
-    
-def score_processor(daily_scores):
+
+# --- Activity storage ---
+# Each athlete's activities live in one hash (athlete_id -> activity_id -> record).
+# Alongside it a sorted set dates them, so a rebuild reads only the season's
+# records instead of every year the athlete has stored:
+#   idx:date:<athlete_id>   activity_id scored by date ordinal
+#   idx:date:built          hash of athlete_id -> 1 once their index is complete
+DATE_INDEX_BUILT_KEY = "idx:date:built"
+
+def date_index_key(athlete_id):
+    return f"idx:date:{athlete_id}"
+
+def store_activity(redis, athlete_id, activity_id, record):
+    """Saves a processed activity. Every write of an activity record should go through here."""
+    athlete_id, activity_id = str(athlete_id), str(activity_id)
+    with span("redis.hset", athlete_id=athlete_id, activity_id=activity_id):
+        redis.hset(athlete_id, activity_id, str(record))
+        # An update can move the date, ZADD just rescores it
+        redis.zadd(date_index_key(athlete_id), {activity_id: date.fromisoformat(record["date"]).toordinal()})
+
+def delete_activity(redis, athlete_id, activity_id):
+    """Removes an activity"""
+    athlete_id, activity_id = str(athlete_id), str(activity_id)
+    with span("redis.hdel", athlete_id=athlete_id, activity_id=activity_id):
+        redis.hdel(athlete_id, activity_id)
+        redis.zrem(date_index_key(athlete_id), activity_id)
+
+def delete_athlete_activities(redis, athlete_id):
+    """Removes every activity an athlete has stored"""
+    athlete_id = str(athlete_id)
+    redis.delete(athlete_id, date_index_key(athlete_id))
+    redis.hdel(DATE_INDEX_BUILT_KEY, athlete_id)
+
+def build_date_index(redis, athlete_id, activities):
+    """
+    Indexes every record of an athlete's full hash, for activities stored
+    before the index existed. Only members that are gone from the hash now
+    are removed, so an activity stored meanwhile keeps its entry.
+    """
+    athlete_id = str(athlete_id)
+    key = date_index_key(athlete_id)
+    if activities:
+        redis.zadd(key, {activity_id: date.fromisoformat(ast.literal_eval(record)["date"]).toordinal()
+                         for activity_id, record in activities.items()})
+    missing = [a for a in redis.zrange(key, 0, -1) if a not in activities]
+    if missing:
+        gone = [a for a, record in zip(missing, redis.hmget(athlete_id, *missing)) if record is None]
+        if gone:
+            redis.zrem(key, *gone)
+    redis.hset(DATE_INDEX_BUILT_KEY, athlete_id, "1")
+    print(f"Built the date index for athlete {athlete_id} ({len(activities)} activities)")
+
+def activities_since(redis, athlete_id, start_date):
+    """Raw records (as stored) of the activities dated start_date or later"""
+    athlete_id = str(athlete_id)
+    activity_ids = redis.zrangebyscore(date_index_key(athlete_id), start_date.toordinal(), "+inf")
+    if not activity_ids:
+        return {}
+    records = redis.hmget(athlete_id, *activity_ids)
+    # An id can outlive its record for a moment while it's being deleted
+    return {a: record for a, record in zip(activity_ids, records) if record is not None}
+
+def iter_activities(redis, athlete_id, batch_size=500):
+    """
+    Yields (activity_id, record) for every stored activity, walking the
+    hash with HSCAN so only batch_size records are held at a time. As with
+    any SCAN, a record changed mid-walk can come back twice.
+    """
+    cursor = 0
+    while True:
+        cursor, batch = redis.hscan(str(athlete_id), cursor, count=batch_size)
+        for activity_id, record in batch.items():
+            yield activity_id, ast.literal_eval(record)
+        if cursor == 0:
+            break
+
+def activity_score(zone_data):
+    """Competition points for one activity record"""
+    return (zone_data['z1'] + zone_data['z2'] + zone_data['z3'] +
+            2*(zone_data['z4'] + zone_data['z5'])) / 60
+
+def score_processor(daily_scores, rules=DEFAULT_RULES, today=None):
     """This takes the scores for every day the athlete has worked out.
     Then it applies a daily limit, extracts the current weeks days, applies
     a weekly limt to the scores, and finally totals up all the scores.
+    The limits come from the league's rules, and today (default: the
+    current date) sets which week is the current one.
     Returns the total score, current week's output"""
     print("Applying limits to scores")
-    PTO = 750
+    PTO = rules["pto"]
+    daily_cap = rules["daily_cap"]
+    weekly_cap = rules["weekly_cap"]
     capped_daily_scores = {}
     for day, score in daily_scores.items():
-        capped_daily_scores[day] = min(score,50)
+        capped_daily_scores[day] = min(score,daily_cap)
     
-    today = date.today()
+    today = today or date.today()
     start_date = today - timedelta(days=6)
     
     current_week_details = {}
@@ -272,18 +557,18 @@ def score_processor(daily_scores):
         # .get(week, 0) handles the "Ghost Week" where the athlete did nothing
         score = raw_weekly_scores.get(week, 0)
     #for week, score in raw_weekly_scores.items():
-        if (score < 150) and (PTO > 0) and (week != current_week):
-            points_short = 150 - score
+        if (score < weekly_cap) and (PTO > 0) and (week != current_week):
+            points_short = weekly_cap - score
             if points_short < PTO:
                 PTO -= points_short
                 score += points_short
-                capped_weekly_scores[week] = 150
+                capped_weekly_scores[week] = weekly_cap
             else:
                 score += PTO
                 PTO = 0
                 capped_weekly_scores[week] = score
         else:
-            capped_weekly_scores[week] = min(score,150)
+            capped_weekly_scores[week] = min(score,weekly_cap)
         
     total_score = sum(capped_weekly_scores.values())
     current_week_details["PTO remaining"] = round(PTO,1)
@@ -292,32 +577,105 @@ def score_processor(daily_scores):
     return total_score, current_week_details
         
 
-def update_scores():
-    """This handles recreating a scores.json file that is used
-    on the website to produce the scoreboard and other information.
-    It will findout each athlete's total score, current week's production,
-    zone percentages, and sport type frequencies"""
+@traced("update_scores")
+def update_scores(athlete_ids=None, league_names=None, received=None):
+    """This handles recreating the scores.json file of every league that
+    is used on the website to produce the scoreboard and other information.
+    Pass athlete_ids to rebuild only the leagues those athletes play in, or
+    league_names to pick leagues directly. Leagues are rebuilt in parallel
+    (serially under profile_call) and each publishes independently. received maps the ids of the webhook
+    events being handled to their receipt times, for freshness metrics."""
     # Get necessary secrets and access to all activity data
-    STRAVA_USERS = os.environ.get("STRAVA_USERS")
+    STRAVA_USERS = json.loads(os.environ.get("STRAVA_USERS"))
+    print("Sucessfully pulled athlete information")
+    leagues = load_leagues(STRAVA_USERS)
+    if league_names is None:
+        league_names = list(leagues) if athlete_ids is None else leagues_for_athletes(leagues, athlete_ids)
+    if not league_names:
+        print("No leagues affected, nothing to rebuild")
+        return
+    if len(league_names) == 1 or profiling_active():
+        # A profiled run stays on this thread so cProfile sees the rebuilds
+        for name in league_names:
+            rebuild_league(leagues[name], STRAVA_USERS, received)
+        return
+    with ThreadPoolExecutor(max_workers=len(league_names)) as pool:
+        # Each worker gets a copy of the trace context so spans stay correlated
+        futures = [pool.submit(contextvars.copy_context().run, rebuild_league, leagues[name], STRAVA_USERS, received)
+                   for name in league_names]
+        for future in futures:
+            future.result()
+
+@traced("rebuild_league")
+def rebuild_league(league, STRAVA_USERS, received=None):
+    """Builds one league's scoreboard from its athletes' activities and publishes it."""
     KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
     KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
     redis = Redis(url=KV_REST_API_URL,token=KV_REST_API_TOKEN)
+    league_name = league["name"]
+    # Fencing token: a rebuild that starts later always gets a higher number
+    generation = redis.incr(league_key(SCORES_GENERATION_KEY, league_name))
+    mark_pending(redis, league_name, generation, received)
+    rebuild_started = time.time()
+    
+    print(f"Rebuilding league: {league_name}")
+    print(f"Number of athletes: {len(league['athletes'])}")
+    activities_by_athlete = {}
+    start = season_start()
+    built = redis.hmget(DATE_INDEX_BUILT_KEY, *league["athletes"]) if league["athletes"] else []
+    for athlete_id, indexed in zip(league["athletes"], built):
+        if indexed:
+            with span("redis.activities_since", athlete_id=athlete_id) as s:
+                activities = activities_since(redis, athlete_id, start)
+                s["activities"] = len(activities)
+                s["bytes"] = sum(len(v) for v in activities.values())
+        else:
+            with span("redis.hgetall", athlete_id=athlete_id) as s:
+                activities = redis.hgetall(athlete_id)
+                s["activities"] = len(activities)
+                s["bytes"] = sum(len(v) for v in activities.values())
+            build_date_index(redis, athlete_id, activities)
+        activities_by_athlete[athlete_id] = activities
+
+    final_data = build_scoreboard(league, STRAVA_USERS, activities_by_athlete)
+    # The leaderboard is one entry per athlete, in roster order
+    totals = {athlete_id: athlete["score"]
+              for athlete_id, athlete in zip(league["athletes"], final_data["leaderboard"])}
+    if SCORES_FORMAT == "compact":
+        final_data = compact_scoreboard(final_data)
+    observe(redis, "rebuild", time.time() - rebuild_started, league_name)
+    publish_scores(redis, league, generation, final_data, totals)
+
+def season_start(now=None):
+    """
+    First day of the season. Scores are totalled by week number of the
+    year, so a season is a calendar year in Mountain time.
+    """
+    now = now or datetime.now(pytz.timezone('America/Denver'))
+    return date(now.year, 1, 1)
+
+def build_scoreboard(league, STRAVA_USERS, activities_by_athlete, now=None):
+    """Works out the league's scores.json from its athletes' stored activities
+    (athlete id -> activity id -> record, as kept in Redis) with no I/O, so
+    it can also run offline (see update_scores.py at the repository root).
+    It will findout each athlete's total score, current week's production,
+    zone percentages, and sport type frequencies. now defaults to the
+    current time in Mountain time. Only activities from the current
+    season (see season_start) count."""
+    league_name = league["name"]
+    rules = league["rules"]
+    start = season_start(now)
     
     score_board = {}
     per_zone = {}
     last_7 = {}
     sport_choice = {}
     march = {}
-    
-    STRAVA_USERS = json.loads(STRAVA_USERS)
-    
-    print("Sucessfully pulled athlete information")
-    print(f"Number of athletes: {len(STRAVA_USERS)}")
     athlete_number = 0
     
-    for athlete_id in STRAVA_USERS:
+    for athlete_id in league["athletes"]:
         athlete_number += 1
-        activities = redis.hgetall(athlete_id)
+        activities = activities_by_athlete.get(athlete_id, {})
         raw_daily_scores = defaultdict(float)
         march_score = 0
         zone1 = 0
@@ -329,13 +687,14 @@ def update_scores():
         athlete_sports = defaultdict(float)
         print(f"Beginning work for athlete: {athlete_number}")
         for activity, zone_data in activities.items():
-            zone_data = ast.literal_eval(zone_data)
-            act_score = 0
-            act_score += zone_data['z1'] + zone_data['z2'] + zone_data['z3'] + 2*(zone_data['z4'] + zone_data['z5'])
-            act_score /= 60
+            if isinstance(zone_data, str):
+                zone_data = ast.literal_eval(zone_data)
             date_obj = date.fromisoformat(zone_data['date'])
+            if date_obj < start:
+                continue
+            act_score = activity_score(zone_data)
             raw_daily_scores[date_obj] += act_score
-            if date_obj.month == 3:
+            if date_obj.month == rules["challenge_month"]:
                 march_score += act_score
             zone1 += zone_data['z1']
             zone2 += zone_data['z2']
@@ -344,66 +703,265 @@ def update_scores():
             zone5 += zone_data['z5']
             tot_time += zone_data['tot_time']
             athlete_sports[zone_data['sport']] += 1
-        athlete_score, athlete_week = score_processor(raw_daily_scores)
-        athlete_name = STRAVA_USERS[athlete_id]['name']
-        score_board[athlete_name] = athlete_score
+        athlete_score, athlete_week = score_processor(raw_daily_scores, rules,
+                                                      now.date() if now else None)
+        score_board[athlete_id] = athlete_score
         if tot_time > 0:
-            per_zone[athlete_name] = {"Z1":zone1/tot_time*100, "Z2":zone2/tot_time*100, 
+            per_zone[athlete_id] = {"Z1":zone1/tot_time*100, "Z2":zone2/tot_time*100, 
                                       "Z3":zone3/tot_time*100, "Z4":zone4/tot_time*100, 
                                       "Z5":zone5/tot_time*100}
         else:
-            per_zone[athlete_name] = {"Z1":0, "Z2":0, 
+            per_zone[athlete_id] = {"Z1":0, "Z2":0, 
                                       "Z3":0, "Z4":0, 
                                       "Z5":0}
-        last_7[athlete_name] = athlete_week
-        sport_choice[athlete_name] = athlete_sports
-        march[athlete_name] = march_score
+        last_7[athlete_id] = athlete_week
+        sport_choice[athlete_id] = athlete_sports
+        march[athlete_id] = march_score
         print(f"Finished work for athlete: {athlete_number}")
     
-    print("Compiling information for scores.json")
-    score_board_list = [{"name": name, "score": round(score_board[name],1), "zones" : per_zone[name],
-                         "last_7": last_7[name], "sports": sport_choice[name], "march": march[name]} for name, score in score_board.items()]
-
-    mountain_tz = pytz.timezone('America/Denver')
-    mountain_time = datetime.now(mountain_tz)
-    current_fam_score = sum(athlete['score'] for athlete in score_board_list )
-    remaining_week_potential = 0
-    for athlete in score_board_list:
-        found_monday = False
-        this_week = 0
-        for key,value in athlete['last_7'].items():
-            if key == "PTO remaining":
-                continue
-            if "Mon" in key:
-                found_monday = True
-            if found_monday:
-                this_week += value
-        potential = max(150 - this_week,0)
-        if mountain_time.weekday() < 5:
-            remaining_week_potential += potential
-        elif potential < athlete['last_7']['PTO remaining']:
-            remaining_week_potential += potential
-        else:
-            remaining_week_potential += min(potential, (7-mountain_time.weekday())*50+athlete['last_7']['PTO remaining'])
-    future_week_potential = (52-int(mountain_time.strftime("%W")))*150*athlete_number
-    potential_max = current_fam_score + remaining_week_potential + future_week_potential
+    print(f"Compiling information for {league['output']}")
+    with span("scores.compile", league=league_name, athletes=athlete_number):
+        score_board_list = [{"name": STRAVA_USERS[athlete_id]['name'], "score": round(score_board[athlete_id],1), "zones" : per_zone[athlete_id],
+                             "last_7": last_7[athlete_id], "sports": sport_choice[athlete_id], "march": march[athlete_id]} for athlete_id in score_board]
+
+        mountain_time = now or datetime.now(pytz.timezone('America/Denver'))
+        current_fam_score = sum(athlete['score'] for athlete in score_board_list )
+        remaining_week_potential = 0
+        weekly_cap = rules["weekly_cap"]
+        for athlete in score_board_list:
+            this_week = this_week_score(athlete['last_7'])
+            potential = max(weekly_cap - this_week,0)
+            if mountain_time.weekday() < 5:
+                remaining_week_potential += potential
+            elif potential < athlete['last_7']['PTO remaining']:
+                remaining_week_potential += potential
+            else:
+                remaining_week_potential += min(potential, (7-mountain_time.weekday())*rules["daily_cap"]+athlete['last_7']['PTO remaining'])
+        future_week_potential = (52-int(mountain_time.strftime("%W")))*weekly_cap*athlete_number
+        potential_max = current_fam_score + remaining_week_potential + future_week_potential
     
-    final_data = {
-        "lastUpdated": mountain_time.isoformat(),
-        "leaderboard": score_board_list,
-        "total_score": current_fam_score,
-        "potential": potential_max
-    }
+        final_data = {
+            "lastUpdated": mountain_time.isoformat(),
+            "leaderboard": score_board_list,
+            "total_score": current_fam_score,
+            "potential": potential_max
+        }
+        if league_name != DEFAULT_LEAGUE:
+            final_data["league"] = league_name
+        if league["teams"]:
+            final_data["teams"] = league["teams"]
+    return final_data
 
-    upload_to_github(final_data)
+# --- Compact scoreboard ---
+# SCORES_FORMAT=compact publishes scores rounded to what the site shows, as
+# minified JSON. The default "pretty" keeps the original indented, full
+# precision file. No precompressed copies are published: GitHub Pages
+# compresses on the wire, and each extra file would be its own commit
+# and Pages build.
+SCORES_FORMAT = os.environ.get("SCORES_FORMAT", "pretty")
+# Scores are shown to 1 decimal; zone shares are re-normalised before
+# display, so they keep one more
+SCORE_DECIMALS = 1
+ZONE_DECIMALS = 2
 
-    print("Successfully updated scores.json")
-    
-     
+def compact_scoreboard(final_data):
+    """A copy of a scoreboard rounded to display precision"""
+    compact = dict(final_data)
+    compact["lastUpdated"] = datetime.fromisoformat(final_data["lastUpdated"]).isoformat(timespec="seconds")
+    compact["leaderboard"] = [{
+        **athlete,
+        "score": round(athlete["score"], SCORE_DECIMALS),
+        "zones": {zone: round(share, ZONE_DECIMALS) for zone, share in athlete["zones"].items()},
+        "sports": {sport: int(count) for sport, count in athlete["sports"].items()},
+        "march": round(athlete["march"], SCORE_DECIMALS),
+    } for athlete in final_data["leaderboard"]]
+    compact["total_score"] = round(final_data["total_score"], SCORE_DECIMALS)
+    compact["potential"] = round(final_data["potential"], SCORE_DECIMALS)
+    return compact
+
+def serialize_scores(final_data, compact=False):
+    if compact:
+        return json.dumps(final_data, separators=(",", ":")).encode("utf-8")
+    return json.dumps(final_data, indent=2).encode("utf-8")
+
+def upload_scoreboard(final_data, file_path):
+    """Uploads a scoreboard in the configured format"""
+    if SCORES_FORMAT != "compact":
+        return upload_to_github(final_data, file_path=file_path)
+    return upload_to_github(None, file_path=file_path, content=serialize_scores(final_data, compact=True))
+
+# --- Publishing ---
+# Several rebuilds can run at once, so publishing goes through a lease:
+#   scores:generation   counter, each rebuild takes the next number at its start
+#   scores:data:<gen>   a finished rebuild's scores.json, kept for an hour
+#   scores:ready        finished generations waiting to be published
+#   scores:lease        held by the one rebuild allowed to talk to GitHub
+#   scores:published    newest generation on GitHub
+#   scores:latest       hash with the newest generation handed to GitHub,
+#                       its data and ETag (served by api/scores.py)
+# A rebuild that isn't the newest one started, or that finds the lease
+# taken, leaves its data in scores:ready and hands off; the lease holder
+# publishes the newest ready generation before letting go.
+# Every league has its own set of these keys (see leagues.league_key), so
+# leagues never wait on each other.
+SCORES_GENERATION_KEY = "scores:generation"
+SCORES_READY_KEY = "scores:ready"
+SCORES_LEASE_KEY = "scores:lease"
+SCORES_PUBLISHED_KEY = "scores:published"
+SCORES_LATEST_KEY = "scores:latest"
+# Sorted set of athlete id -> total score, served by api/leaderboard.py.
+# Keyed by id so a rename or two athletes sharing a name can't leave
+# stale or merged members; names are looked up when rendering.
+LEADERBOARD_KEY = "leaderboard"
+# Long enough for one upload (a GET and a PUT, each within GitHub's retry
+# budget) with room to spare. The holder extends it before every write,
+# which is also its fence check.
+SCORES_LEASE_MS = 90000
+SCORES_DATA_TTL = 3600
+
+def scores_data_key(league_name, generation):
+    return f"{league_key('scores:data', league_name)}:{generation}"
+
+def scores_totals_key(league_name, generation):
+    """Athlete id -> total score for a generation, feeding the leaderboard"""
+    return f"{league_key('scores:totals', league_name)}:{generation}"
+
+def scores_etag(data):
+    """Strong ETag for a serialized scoreboard"""
+    return '"' + hashlib.sha256(data.encode("utf-8")).hexdigest()[:32] + '"'
+
+def newest_ready_generation(redis, league_name):
+    ready = redis.zrange(league_key(SCORES_READY_KEY, league_name), 0, 0, rev=True)
+    return int(ready[0]) if ready else 0
+
+def published_generation(redis, league_name):
+    return int(redis.get(league_key(SCORES_PUBLISHED_KEY, league_name)) or 0)
+
+def publish_scores(redis, league, generation, final_data, totals):
+    """
+    Queues this rebuild's scoreboard and publishes it unless a newer
+    rebuild of the league is on the way or another job holds the league's
+    publish lease, in which case that job takes it from here.
+    """
+    league_name = league["name"]
+    lease_key = league_key(SCORES_LEASE_KEY, league_name)
+    redis.set(scores_data_key(league_name, generation), json.dumps(final_data), ex=SCORES_DATA_TTL)
+    redis.set(scores_totals_key(league_name, generation), json.dumps(totals), ex=SCORES_DATA_TTL)
+    redis.zadd(league_key(SCORES_READY_KEY, league_name), {str(generation): generation})
+    newest = int(redis.get(league_key(SCORES_GENERATION_KEY, league_name)) or 0)
+    if generation < newest:
+        print(f"Rebuild {generation} of {league_name} superseded by {newest}, handing off")
+        return
+    lease_token = str(generation)
+    while True:
+        if not redis.set(lease_key, lease_token, nx=True, px=SCORES_LEASE_MS):
+            print(f"Another rebuild holds the {league_name} publish lease, handing off")
+            return
+        try:
+            published = publish_ready_scores(redis, league, lease_token)
+        finally:
+            release_lease(redis, lease_key, lease_token)
+        if not published:
+            # A failed upload stays ready for the next rebuild rather than
+            # being retried here until the function times out
+            return
+        # Something may have been handed off between the last check and the release
+        if newest_ready_generation(redis, league_name) <= published_generation(redis, league_name):
+            return
+
+def publish_ready_scores(redis, league, lease_token):
+    """
+    Uploads the league's newest ready generation while holding the lease.
+    Returns False if an upload failed, True otherwise. Every write is
+    fenced: the lease is extended first, and if it has run out (a slow
+    GitHub can outlast it) this stops and leaves the rest to whoever
+    holds it now, so an older generation never overwrites a newer one.
+    """
+    league_name = league["name"]
+    ready_key = league_key(SCORES_READY_KEY, league_name)
+    lease_key = league_key(SCORES_LEASE_KEY, league_name)
+
+    def fence():
+        if extend_lease(redis, lease_key, lease_token, SCORES_LEASE_MS):
+            return True
+        print("Lost the publish lease, handing off")
+        return False
+
+    while True:
+        generation = newest_ready_generation(redis, league_name)
+        if generation <= published_generation(redis, league_name):
+            redis.zremrangebyscore(ready_key, "-inf", generation)
+            return True
+        data = redis.get(scores_data_key(league_name, generation))
+        if data is None:
+            # Expired before anyone got to it
+            redis.zrem(ready_key, str(generation))
+            continue
+        if not fence():
+            return True
+        final_data = json.loads(data)
+        # Readers of api/scores.py see it straight away, before GitHub Pages does
+        redis.hset(league_key(SCORES_LATEST_KEY, league_name),
+                   values={"generation": str(generation), "data": data, "etag": scores_etag(data)})
+        totals = redis.get(scores_totals_key(league_name, generation))
+        # Missing only for a generation queued before totals were kept
+        if totals is not None:
+            update_leaderboard(redis, league_name, json.loads(totals))
+        if not fence():
+            return True
+        publish_started = time.time()
+        with span("scores.publish", league=league_name, generation=generation):
+            uploaded = upload_scoreboard(final_data, league["output"])
+        observe(redis, "publish", time.time() - publish_started, league_name)
+        if not uploaded:
+            increment(redis, "publish_failures_total", league=league_name)
+            return False
+        increment(redis, "publishes_total", league=league_name)
+        observe_published(redis, league_name, generation)
+        # A newer holder may have published past this one while the upload ran
+        if not fence():
+            return True
+        redis.set(league_key(SCORES_PUBLISHED_KEY, league_name), str(generation))
+        redis.zremrangebyscore(ready_key, "-inf", generation)
+        print(f"Successfully updated {league['output']} (generation {generation})")
+        after_publish(redis, league, final_data, fence)
+
+def update_leaderboard(redis, league_name, scores):
+    """
+    Mirrors the published totals (athlete id -> score) into the league's
+    leaderboard sorted set, dropping athletes that are no longer on the
+    roster, along with members left over from when it was keyed by name
+    """
+    key = league_key(LEADERBOARD_KEY, league_name)
+    with span("leaderboard.update", league=league_name, athletes=len(scores)) as s:
+        s["changed"] = redis.zadd(key, scores, ch=True) if scores else 0
+        gone = set(redis.zrange(key, 0, -1)) - set(scores)
+        if gone:
+            redis.zrem(key, *gone)
+
+def after_publish(redis, league, final_data, fence=lambda: True):
+    """
+    Keeps a daily snapshot for trend charts. The first publish of each day
+    uploads the archive of every completed day. fence() is checked before
+    each write, as in publish_ready_scores.
+    """
+    league_name = league["name"]
+    today = datetime.fromisoformat(final_data["lastUpdated"]).date()
+    if not fence():
+        return
+    with span("history.snapshot", league=league_name):
+        record_snapshot(redis, final_data, today, league_name)
+    if archive_due(redis, today, league_name) and fence():
+        # Yesterday's last snapshot is final now; today's isn't until tomorrow
+        if upload_to_github(load_history(redis, league_name, before=today), file_path=league["history"],
+                            message="Update score history"):
+            mark_published(redis, today, league_name)
 
-def upload_to_github(data_to_upload):
+@traced("upload_to_github")
+def upload_to_github(data_to_upload, file_path="scores.json", message="Update scores data", content=None):
     """
-    Creates or updates a file in a GitHub repository.
+    Creates or updates a file in a GitHub repository. data_to_upload is
+    written as indented JSON unless content (bytes) is given instead.
     """
     print("Trying to upload new information to Github")
     # --- Configuration ---
@@ -412,7 +970,7 @@ def upload_to_github(data_to_upload):
     # The name of your repository
     REPO_NAME = os.environ.get('GITHUB_REPO_NAME')         
     # The path to the file in your repository
-    FILE_PATH = "scores.json"             
+    FILE_PATH = file_path
     # Securely get the token from Vercel's environment variables
     GITHUB_TOKEN = os.environ.get("PAT_FOR_SECRETS")
     
@@ -421,7 +979,7 @@ def upload_to_github(data_to_upload):
         return
 
     # 1. Define API URL and headers
-    url = f"https://api.github.com/repos/{REPO_OWNER}/{REPO_NAME}/contents/{FILE_PATH}"
+    url = f"{GITHUB_API_URL}/repos/{REPO_OWNER}/{REPO_NAME}/contents/{FILE_PATH}"
     headers = {
         "Authorization": f"token {GITHUB_TOKEN}",
         "Accept": "application/vnd.github.v3+json"
@@ -431,7 +989,9 @@ def upload_to_github(data_to_upload):
     # This is required for updating an existing file
     sha = None
     try:
-        response = requests.get(url, headers=headers)
+        with span("github.get_sha", path=FILE_PATH) as s:
+            response = http_client.get("github", url, headers=headers)
+            s["http_status"] = response.status_code
         response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
         # If the file exists, get its SHA
         sha = response.json()['sha']
@@ -445,13 +1005,17 @@ def upload_to_github(data_to_upload):
             
     # 3. Prepare the data for upload
     # Convert your Python dictionary to a JSON string
-    content_json_string = json.dumps(data_to_upload, indent=2)
-    # GitHub API requires content to be Base64 encoded
-    content_base64 = base64.b64encode(content_json_string.encode('utf-8')).decode('utf-8')
+    with span("github.encode", path=FILE_PATH) as s:
+        if content is None:
+            content = json.dumps(data_to_upload, indent=2).encode('utf-8')
+        # GitHub API requires content to be Base64 encoded
+        content_base64 = base64.b64encode(content).decode('utf-8')
+        s["bytes"] = len(content)
+        s["encoded_bytes"] = len(content_base64)
 
     # 4. Create the JSON payload for the API request
     payload = {
-        "message": "Update scores data",  # Your commit message
+        "message": message,  # Your commit message
         "content": content_base64,
         "committer": {
             "name": os.environ.get("PERSONAL_NAME"),
@@ -464,9 +1028,12 @@ def upload_to_github(data_to_upload):
 
     # 5. Make the PUT request to create or update the file
     try:
-        response = requests.put(url, headers=headers, data=json.dumps(payload))
+        with span("github.put", path=FILE_PATH, bytes=len(content_base64)) as s:
+            response = http_client.put("github", url, headers=headers, data=json.dumps(payload))
+            s["http_status"] = response.status_code
         response.raise_for_status()
         print(f"Successfully uploaded new version of '{FILE_PATH}' to GitHub.")
+        return True
         #print(f"Commit SHA: {response.json()['commit']['sha']}")
     except requests.exceptions.HTTPError as err:
         print(f"Error uploading file to GitHub: {err}")
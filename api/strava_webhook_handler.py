@@ -1,13 +1,20 @@
 import os
-#import json
+import time
+import json
 from flask import Flask, request, jsonify
 #from vercel_kv import KV
+from upstash_redis import Redis
 import qstash
+from .freshness import increment
+from .flush_events import INBOX_KEY
+from .lanes import PROCESSING_URL, ACTIVITY_RETRIES
 
 # --- Configuration ---
 VERIFY_TOKEN = os.environ.get('STRAVA_VERIFY_TOKEN')
 
 QSTASH_TOKEN = os.environ.get('QSTASH_TOKEN')
+KV_REST_API_URL = os.environ.get("KV_REST_API_URL")
+KV_REST_API_TOKEN = os.environ.get("KV_REST_API_TOKEN")
 
 
 PAT_FOR_SECRETS = os.environ.get("PAT_FOR_SECRETS")
@@ -46,25 +53,32 @@ def handle_verification():
 
 def handle_event_reception():
     """
-    Receives the event from Strava, queues it for processing, and returns immediately.
+    Receives the event from Strava, appends it to the Redis inbox for
+    api/flush_events.py to forward to QStash, and returns immediately.
     """
     print("Receiving event from Strava...")
     event_data = request.get_json()
+    # Start of the freshness clock, see api/freshness.py
+    event_data['received_at'] = time.time()
+    redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
 
     try:
-        # Construct the full URL for the processing endpoint
-        #base_url = f"https://{os.environ.get('VERCEL_URL')}"
-        #processing_url = f"{base_url}/api/strava_activity_handler"
-        processing_url = "https://hr-github.vercel.app/api/strava_activity_handler"
-
-        # Publish the event to QStash for background processing
-        qstash_client.message.publish_json(
-            url=processing_url,
-            body=event_data,
-        )
-        print("✅ Event successfully queued for processing")
+        redis.rpush(INBOX_KEY, json.dumps(event_data))
+        print("✅ Event stored in the inbox")
     except Exception as e:
-        print(f"❌ ERROR: Failed to queue event with QStash. Error: {e}")
+        print(f"❌ ERROR: Failed to store event in Redis, publishing directly. Error: {e}")
+        try:
+            # Publish the event to QStash for background processing
+            qstash_client.message.publish_json(
+                url=PROCESSING_URL,
+                body=event_data,
+                retries=ACTIVITY_RETRIES,
+            )
+            print("✅ Event successfully queued for processing")
+        except Exception as e:
+            print(f"❌ ERROR: Failed to queue event with QStash. Error: {e}")
+    increment(redis, "events_received_total",
+              object_type=event_data.get('object_type'), aspect_type=event_data.get('aspect_type'))
 
     # Immediately return 200 OK to Strava
     return 'EVENT_RECEIVED', 200
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Structured timing spans for the activity pipeline.
+
+Each span is printed as a single JSON line so Vercel's logs can be
+filtered by stage or by the correlation id shared by everything that
+happened while handling one event.
+"""
+
+import json
+import time
+import functools
+import uuid
+import contextvars
+from contextlib import contextmanager
+
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+def start_trace(correlation_id=None):
+    """Sets the correlation id for the current event and returns it"""
+    correlation_id = correlation_id or uuid.uuid4().hex[:16]
+    _correlation_id.set(correlation_id)
+    return correlation_id
+
+def current_trace():
+    """Returns the correlation id of the event being handled, if any"""
+    return _correlation_id.get()
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Times the wrapped block and prints it as a JSON log line. The yielded
+    dict can be used to attach more fields (payload sizes, sample counts)
+    once they are known.
+    """
+    record = dict(fields)
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        status = "error"
+        record["error"] = str(e)
+        raise
+    finally:
+        line = {
+            "span": stage,
+            "correlation_id": current_trace(),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "status": status,
+            "ts": time.time(),
+        }
+        line.update(record)
+        print(json.dumps(line, default=str))
+
+def traced(stage):
+    """Decorator form of span for timing a whole function"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,599 @@
+"""
+In-memory stand-ins for the services the scoring pipeline talks to.
+
+InMemoryRedis executes raw Redis commands (the same lists upstash_redis sends
+over REST) against plain Python dicts, so it can sit behind the real client
+or behind an HTTP emulator. FakeGitHub mimics the part of the GitHub
+Contents API that upload_to_github uses.
+"""
+
+import base64
+import fnmatch
+import json
+import threading
+import time
+
+import requests
+from upstash_redis import Redis
+
+
+class RedisCommandError(Exception):
+    """Raised for commands the in-memory store can't run."""
+
+
+def _num(value):
+    """Redis style number formatting for replies"""
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _parse_bound(raw):
+    """Parses a ZRANGE/ZCOUNT score bound such as '(5', '-inf' or '+inf'"""
+    raw = str(raw)
+    exclusive = raw.startswith("(")
+    if exclusive:
+        raw = raw[1:]
+    return float(raw), exclusive
+
+
+class InMemoryRedis:
+    """
+    A tiny single process Redis. Values are stored by type in separate
+    dicts and expiry is checked lazily on access.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.strings = {}
+        self.hashes = {}
+        self.zsets = {}
+        self.sets = {}
+        self.lists = {}
+        self.expires = {}
+        self.command_counts = {}
+
+    # --- Housekeeping ---
+    def _stores(self):
+        return (self.strings, self.hashes, self.zsets, self.sets, self.lists)
+
+    def _expire_if_needed(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and time.time() >= deadline:
+            self._delete(key)
+
+    def _delete(self, key):
+        found = 0
+        for store in self._stores():
+            if key in store:
+                del store[key]
+                found = 1
+        self.expires.pop(key, None)
+        return found
+
+    def _exists(self, key):
+        self._expire_if_needed(key)
+        return any(key in store for store in self._stores())
+
+    def keys(self):
+        with self._lock:
+            all_keys = set()
+            for store in self._stores():
+                all_keys.update(store.keys())
+            for key in list(all_keys):
+                self._expire_if_needed(key)
+            return sorted(k for k in all_keys if self._exists(k))
+
+    def execute(self, command):
+        """Runs one command list and returns the REST style reply"""
+        name = str(command[0]).upper()
+        args = [a if isinstance(a, str) else _num(a) if isinstance(a, float) else str(a)
+                for a in command[1:]]
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            raise RedisCommandError(f"Unsupported command: {name}")
+        with self._lock:
+            self.command_counts[name] = self.command_counts.get(name, 0) + 1
+            if args:
+                self._expire_if_needed(args[0])
+            return handler(*args)
+
+    # --- Keys ---
+    def cmd_del(self, *keys):
+        return sum(self._delete(k) for k in keys)
+
+    def cmd_exists(self, *keys):
+        return sum(1 for k in keys if self._exists(k))
+
+    def cmd_expire(self, key, seconds):
+        if not self._exists(key):
+            return 0
+        self.expires[key] = time.time() + int(seconds)
+        return 1
+
+    def cmd_pexpire(self, key, millis):
+        if not self._exists(key):
+            return 0
+        self.expires[key] = time.time() + int(millis) / 1000
+        return 1
+
+    def cmd_ttl(self, key):
+        if not self._exists(key):
+            return -2
+        deadline = self.expires.get(key)
+        if deadline is None:
+            return -1
+        return max(int(deadline - time.time()), 0)
+
+    def cmd_keys(self, pattern):
+        return [k for k in self.keys() if fnmatch.fnmatchcase(k, pattern)]
+
+    def cmd_ping(self):
+        return "PONG"
+
+    # --- Scripts ---
+    # No Lua here: the scripts the pipeline sends are matched by their
+    # text and run as the Python below
+    def _release_lease(self, keys, args):
+        if self.cmd_get(keys[0]) == args[0]:
+            return self.cmd_del(keys[0])
+        return 0
+
+    def _extend_lease(self, keys, args):
+        if self.cmd_get(keys[0]) == args[0]:
+            return self.cmd_pexpire(keys[0], args[1])
+        return 0
+
+    def cmd_eval(self, script, numkeys, *rest):
+        from api.leases import RELEASE_SCRIPT, EXTEND_SCRIPT
+        scripts = {RELEASE_SCRIPT: self._release_lease, EXTEND_SCRIPT: self._extend_lease}
+        if script not in scripts:
+            raise RedisCommandError("Unsupported script")
+        keys, args = list(rest[:int(numkeys)]), list(rest[int(numkeys):])
+        for key in keys:
+            self._expire_if_needed(key)
+        return scripts[script](keys, args)
+
+    def cmd_flushall(self):
+        for store in self._stores():
+            store.clear()
+        self.expires.clear()
+        return "OK"
+
+    # --- Strings ---
+    def cmd_get(self, key):
+        return self.strings.get(key)
+
+    def cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        old = self.strings.get(key)
+        if "NX" in options and self._exists(key):
+            return None
+        if "XX" in options and not self._exists(key):
+            return None
+        deadline = self.expires.get(key) if "KEEPTTL" in options else None
+        self._delete(key)
+        self.strings[key] = value
+        if deadline is not None:
+            self.expires[key] = deadline
+        for flag, scale in (("EX", 1), ("PX", 0.001)):
+            if flag in options:
+                self.expires[key] = time.time() + int(options[options.index(flag) + 1]) * scale
+        if "GET" in options:
+            return old
+        return "OK"
+
+    def cmd_incrby(self, key, amount):
+        value = int(self.strings.get(key, "0")) + int(amount)
+        self.strings[key] = str(value)
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    def cmd_decr(self, key):
+        return self.cmd_incrby(key, -1)
+
+    def cmd_incrbyfloat(self, key, amount):
+        value = float(self.strings.get(key, "0")) + float(amount)
+        self.strings[key] = _num(value)
+        return self.strings[key]
+
+    def cmd_mget(self, *keys):
+        return [self.strings.get(k) for k in keys]
+
+    # --- Hashes ---
+    def cmd_hset(self, key, *pairs):
+        h = self.hashes.setdefault(key, {})
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            if field not in h:
+                added += 1
+            h[field] = value
+        return added
+
+    def cmd_hsetnx(self, key, field, value):
+        h = self.hashes.setdefault(key, {})
+        if field in h:
+            return 0
+        h[field] = value
+        return 1
+
+    def cmd_hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        h = self.hashes.get(key, {})
+        return [h.get(f) for f in fields]
+
+    def cmd_hgetall(self, key):
+        out = []
+        for field, value in self.hashes.get(key, {}).items():
+            out.extend([field, value])
+        return out
+
+    def cmd_hdel(self, key, *fields):
+        h = self.hashes.get(key, {})
+        removed = 0
+        for field in fields:
+            if field in h:
+                del h[field]
+                removed += 1
+        if key in self.hashes and not h:
+            del self.hashes[key]
+        return removed
+
+    def cmd_hlen(self, key):
+        return len(self.hashes.get(key, {}))
+
+    def cmd_hkeys(self, key):
+        return list(self.hashes.get(key, {}))
+
+    def cmd_hexists(self, key, field):
+        return int(field in self.hashes.get(key, {}))
+
+    def cmd_hincrby(self, key, field, amount):
+        h = self.hashes.setdefault(key, {})
+        value = int(h.get(field, "0")) + int(amount)
+        h[field] = str(value)
+        return value
+
+    def cmd_hincrbyfloat(self, key, field, amount):
+        h = self.hashes.setdefault(key, {})
+        value = float(h.get(field, "0")) + float(amount)
+        h[field] = _num(value)
+        return h[field]
+
+    def cmd_hscan(self, key, cursor, *options):
+        options = list(options)
+        count = 10
+        match = None
+        upper = [o.upper() for o in options]
+        if "COUNT" in upper:
+            count = int(options[upper.index("COUNT") + 1])
+        if "MATCH" in upper:
+            match = options[upper.index("MATCH") + 1]
+        fields = list(self.hashes.get(key, {}).items())
+        start = int(cursor)
+        page = fields[start:start + count]
+        next_cursor = start + count if start + count < len(fields) else 0
+        out = []
+        for field, value in page:
+            if match is None or fnmatch.fnmatchcase(field, match):
+                out.extend([field, value])
+        return [str(next_cursor), out]
+
+    # --- Sets ---
+    def cmd_sadd(self, key, *members):
+        s = self.sets.setdefault(key, set())
+        before = len(s)
+        s.update(members)
+        return len(s) - before
+
+    def cmd_srem(self, key, *members):
+        s = self.sets.get(key, set())
+        removed = len(s & set(members))
+        s.difference_update(members)
+        if key in self.sets and not s:
+            del self.sets[key]
+        return removed
+
+    def cmd_smembers(self, key):
+        return sorted(self.sets.get(key, set()))
+
+    def cmd_scard(self, key):
+        return len(self.sets.get(key, set()))
+
+    def cmd_sismember(self, key, member):
+        return int(member in self.sets.get(key, set()))
+
+    # --- Sorted sets ---
+    def _sorted(self, key, rev=False):
+        z = self.zsets.get(key, {})
+        items = sorted(z.items(), key=lambda kv: (kv[1], kv[0]))
+        if rev:
+            items.reverse()
+        return items
+
+    def cmd_zadd(self, key, *args):
+        args = list(args)
+        flags = set()
+        while args and args[0].upper() in ("NX", "XX", "GT", "LT", "CH", "INCR"):
+            flags.add(args.pop(0).upper())
+        z = self.zsets.setdefault(key, {})
+        changed = 0
+        for score, member in zip(args[::2], args[1::2]):
+            score = float(score)
+            exists = member in z
+            if "NX" in flags and exists or "XX" in flags and not exists:
+                continue
+            if "INCR" in flags:
+                score += z.get(member, 0.0)
+            if exists and ("GT" in flags and score <= z[member] or "LT" in flags and score >= z[member]):
+                continue
+            if not exists or ("CH" in flags and z[member] != score):
+                changed += 1
+            z[member] = score
+        if not z:
+            del self.zsets[key]
+        return changed
+
+    def cmd_zincrby(self, key, amount, member):
+        z = self.zsets.setdefault(key, {})
+        z[member] = z.get(member, 0.0) + float(amount)
+        return _num(z[member])
+
+    def cmd_zrem(self, key, *members):
+        z = self.zsets.get(key, {})
+        removed = 0
+        for member in members:
+            if member in z:
+                del z[member]
+                removed += 1
+        if key in self.zsets and not z:
+            del self.zsets[key]
+        return removed
+
+    def cmd_zscore(self, key, member):
+        score = self.zsets.get(key, {}).get(member)
+        return None if score is None else _num(score)
+
+    def cmd_zmscore(self, key, *members):
+        z = self.zsets.get(key, {})
+        return [None if z.get(m) is None else _num(z[m]) for m in members]
+
+    def cmd_zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def _rank(self, key, member, rev):
+        for i, (m, _) in enumerate(self._sorted(key, rev)):
+            if m == member:
+                return i
+        return None
+
+    def cmd_zrank(self, key, member):
+        return self._rank(key, member, False)
+
+    def cmd_zrevrank(self, key, member):
+        return self._rank(key, member, True)
+
+    @staticmethod
+    def _reply(items, withscores):
+        out = []
+        for member, score in items:
+            out.append(member)
+            if withscores:
+                out.append(_num(score))
+        return out
+
+    def _by_score(self, key, low, high, rev=False):
+        lo, lo_ex = _parse_bound(low)
+        hi, hi_ex = _parse_bound(high)
+        items = []
+        for member, score in self._sorted(key, rev):
+            if score < lo or (lo_ex and score == lo):
+                continue
+            if score > hi or (hi_ex and score == hi):
+                continue
+            items.append((member, score))
+        return items
+
+    def cmd_zrange(self, key, start, stop, *options):
+        options = list(options)
+        upper = [o.upper() for o in options]
+        rev = "REV" in upper
+        withscores = "WITHSCORES" in upper
+        if "BYSCORE" in upper:
+            low, high = (stop, start) if rev else (start, stop)
+            items = self._by_score(key, low, high, rev)
+        else:
+            items = self._sorted(key, rev)
+            start, stop = int(start), int(stop)
+            n = len(items)
+            if start < 0:
+                start = max(n + start, 0)
+            if stop < 0:
+                stop = n + stop
+            items = items[start:stop + 1]
+        if "LIMIT" in upper:
+            i = upper.index("LIMIT")
+            offset, count = int(options[i + 1]), int(options[i + 2])
+            items = items[offset:] if count < 0 else items[offset:offset + count]
+        return self._reply(items, withscores)
+
+    def cmd_zrevrange(self, key, start, stop, *options):
+        return self.cmd_zrange(key, start, stop, "REV", *options)
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        return self.cmd_zrange(key, low, high, "BYSCORE", *options)
+
+    def cmd_zrevrangebyscore(self, key, high, low, *options):
+        return self.cmd_zrange(key, high, low, "BYSCORE", "REV", *options)
+
+    def cmd_zcount(self, key, low, high):
+        return len(self._by_score(key, low, high))
+
+    def cmd_zremrangebyscore(self, key, low, high):
+        doomed = [m for m, _ in self._by_score(key, low, high)]
+        return self.cmd_zrem(key, *doomed) if doomed else 0
+
+    # --- Lists ---
+    def cmd_rpush(self, key, *values):
+        lst = self.lists.setdefault(key, [])
+        lst.extend(values)
+        return len(lst)
+
+    def cmd_lpush(self, key, *values):
+        lst = self.lists.setdefault(key, [])
+        for value in values:
+            lst.insert(0, value)
+        return len(lst)
+
+    def cmd_llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def cmd_lrange(self, key, start, stop):
+        lst = self.lists.get(key, [])
+        start, stop = int(start), int(stop)
+        n = len(lst)
+        if start < 0:
+            start = max(n + start, 0)
+        if stop < 0:
+            stop = n + stop
+        return lst[start:stop + 1]
+
+    def cmd_ltrim(self, key, start, stop):
+        if key in self.lists:
+            self.lists[key] = self.cmd_lrange(key, start, stop)
+            if not self.lists[key]:
+                del self.lists[key]
+        return "OK"
+
+    def _pop(self, key, count, left):
+        lst = self.lists.get(key, [])
+        if not lst:
+            return None
+        n = 1 if count is None else int(count)
+        if left:
+            popped, self.lists[key] = lst[:n], lst[n:]
+        else:
+            popped, self.lists[key] = lst[-n:][::-1], lst[:-n]
+        if not self.lists[key]:
+            del self.lists[key]
+        return popped[0] if count is None else popped
+
+    def cmd_lpop(self, key, count=None):
+        return self._pop(key, count, True)
+
+    def cmd_rpop(self, key, count=None):
+        return self._pop(key, count, False)
+
+    def cmd_lrem(self, key, count, value):
+        lst = self.lists.get(key, [])
+        count = int(count)
+        kept, removed = [], 0
+        for item in lst:
+            if item == value and (count == 0 or removed < abs(count)):
+                removed += 1
+                continue
+            kept.append(item)
+        if key in self.lists:
+            self.lists[key] = kept
+            if not kept:
+                del self.lists[key]
+        return removed
+
+
+class EngineTransport:
+    """Replaces the HTTP layer of an upstash_redis client with an InMemoryRedis"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def execute(self, url, headers, command, from_pipeline=False):
+        if from_pipeline:
+            return [self.engine.execute(c) for c in command]
+        return self.engine.execute(command)
+
+    def close(self):
+        pass
+
+
+def redis_factory(engine):
+    """
+    Returns a drop in replacement for the Redis class that talks to the
+    given engine, so code that builds Redis(url=..., token=...) itself can
+    be pointed at memory without changing it.
+    """
+    def make_redis(url=None, token=None, **kwargs):
+        client = Redis(url=url or "http://in-memory", token=token or "in-memory",
+                       allow_telemetry=False)
+        client._http = EngineTransport(engine)
+        return client
+    return make_redis
+
+
+class FakeResponse:
+    """Just enough of requests.Response for the pipeline code"""
+
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = headers or {}
+        self.text = json.dumps(payload) if payload is not None else ""
+        self.content = self.text.encode("utf-8")
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeGitHub:
+    """
+    Stands in for the requests module inside strava_functions and
+    http_client and answers the GitHub Contents API calls that
+    upload_to_github makes. Uploaded files are kept in memory, decoded,
+    so they can be inspected.
+    """
+    exceptions = requests.exceptions
+
+    def __init__(self):
+        self.files = {}
+        self.calls = {"GET": 0, "PUT": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _path(url):
+        return url.split("/contents/", 1)[1]
+
+    def get(self, url, headers=None, **kwargs):
+        with self._lock:
+            self.calls["GET"] += 1
+            path = self._path(url)
+            if path not in self.files:
+                return FakeResponse(404, {"message": "Not Found"})
+            return FakeResponse(200, {"sha": self.files[path]["sha"], "path": path})
+
+    def put(self, url, headers=None, data=None, json=None, **kwargs):
+        with self._lock:
+            self.calls["PUT"] += 1
+            path = self._path(url)
+            payload = json if json is not None else _json_loads(data)
+            current = self.files.get(path)
+            if current and payload.get("sha") != current["sha"]:
+                return FakeResponse(409, {"message": "sha does not match"})
+            content = base64.b64decode(payload["content"])
+            sha = f"{len(self.files)}-{self.calls['PUT']}"
+            self.files[path] = {"sha": sha, "content": content}
+            return FakeResponse(201 if current is None else 200, {"content": {"sha": sha}})
+
+    def content(self, path="scores.json"):
+        return self.files[path]["content"]
+
+
+def _json_loads(data):
+    return json.loads(data)
@@ -0,0 +1,291 @@
+"""
+Golden dataset regression check for the scoring code.
+
+Runs a frozen, anonymized dataset through the scoring code at a reference
+git revision (the "old" code, HEAD by default) and through the working
+tree (the "new" code), then reports every per-athlete difference in the
+published scoreboard and in zone times per stream, along with how long
+each stage took under both.
+
+Usage (from the repository root):
+    python -m benchmarks.golden                      # compare against HEAD
+    python -m benchmarks.golden --ref HEAD~5
+    python -m benchmarks.golden --freeze             # rewrite the dataset (synthetic)
+    python -m benchmarks.golden --freeze --from-redis
+
+The dataset lives in benchmarks/golden/dataset.json, with a frozen
+"today" so date dependent rules (current week, PTO) are stable.
+--from-redis captures the stored activities of the live roster
+(KV_REST_API_URL, KV_REST_API_TOKEN, STRAVA_USERS, HR_DATA) with athlete
+names and ids replaced. Redis only keeps zone totals, so the streams are
+always synthetic, generated from each athlete's HR values.
+
+Exits with status 1 when any difference is larger than --tolerance.
+"""
+
+import argparse
+import ast
+import contextlib
+import importlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+from benchmarks import fakes, synthetic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+DEFAULT_DATASET = os.path.join(HERE, "golden", "dataset.json")
+
+
+# --- Dataset ---
+def freeze_synthetic(args):
+    today = date.fromisoformat(args.today)
+    users, hr_data = synthetic.make_roster(args.athletes, seed=args.seed)
+    activities = synthetic.make_activities(users, args.activities, seed=args.seed, today=today)
+    return users, hr_data, activities, today
+
+
+def freeze_from_redis(args):
+    from upstash_redis import Redis
+
+    redis = Redis(url=os.environ["KV_REST_API_URL"], token=os.environ["KV_REST_API_TOKEN"])
+    live_users = json.loads(os.environ["STRAVA_USERS"])
+    live_hr = json.loads(os.environ["HR_DATA"])
+    users, hr_data, activities = {}, {}, {}
+    activity_id = 1000000000
+    for i, athlete_id in enumerate(live_users):
+        anon_id = str(100000 + i)
+        name = f"Athlete{i:03d}"
+        users[anon_id] = {"access_token": "golden", "refresh_token": "golden",
+                          "expires_at": 4102444800, "name": name}
+        hr_data[anon_id] = {"name": name, "hr_values": live_hr[athlete_id]["hr_values"]}
+        records = {}
+        for record in redis.hgetall(athlete_id).values():
+            activity_id += 1
+            records[str(activity_id)] = ast.literal_eval(record)
+        activities[anon_id] = records
+    return users, hr_data, activities, date.today()
+
+
+def freeze(args):
+    users, hr_data, activities, today = freeze_from_redis(args) if args.from_redis else freeze_synthetic(args)
+    streams = {}
+    for i, (athlete_id, values) in enumerate(hr_data.items()):
+        resting, max_hr = values["hr_values"]
+        hr, times = synthetic.make_stream(args.samples, resting, max_hr, seed=args.seed + i)
+        streams[athlete_id] = {"heartrate": hr, "time": times}
+    dataset = {"today": today.isoformat(), "users": users, "hr_data": hr_data,
+               "activities": activities, "streams": streams}
+    os.makedirs(os.path.dirname(args.dataset), exist_ok=True)
+    with open(args.dataset, "w") as f:
+        json.dump(dataset, f, separators=(",", ":"))
+    total = sum(len(a) for a in activities.values())
+    print(f"Froze {len(users)} athletes, {total} activities and {len(streams)} streams to {args.dataset}")
+
+
+# --- Loading the old and new code ---
+def load_reference(ref, workdir):
+    """Imports strava_functions as it was at ref, as its own package"""
+    package = "golden_ref_api"
+    target = os.path.join(workdir, package)
+    os.makedirs(target)
+    files = subprocess.run(["git", "ls-tree", "--name-only", ref, "api/"], cwd=ROOT,
+                           check=True, capture_output=True, text=True).stdout.split()
+    for path in files:
+        if not path.endswith(".py"):
+            continue
+        source = subprocess.run(["git", "show", f"{ref}:{path}"], cwd=ROOT,
+                                check=True, capture_output=True, text=True).stdout
+        with open(os.path.join(target, os.path.basename(path)), "w") as f:
+            f.write(source)
+    sys.path.insert(0, workdir)
+    return importlib.import_module(f"{package}.strava_functions")
+
+
+def freeze_clock(module, today):
+    """Makes the module's date.today() and datetime.now() return the frozen day"""
+    class FrozenDate(date):
+        @classmethod
+        def today(cls):
+            return cls(today.year, today.month, today.day)
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            moment = cls(today.year, today.month, today.day, 12, 0, 0)
+            return tz.localize(moment) if hasattr(tz, "localize") else moment.replace(tzinfo=tz)
+
+    module.date = FrozenDate
+    module.datetime = FrozenDatetime
+
+
+def configure_environment(dataset):
+    os.environ["STRAVA_USERS"] = json.dumps(dataset["users"])
+    os.environ["HR_DATA"] = json.dumps(dataset["hr_data"])
+    os.environ.pop("LEAGUES", None)
+    os.environ.setdefault("KV_REST_API_URL", "http://in-memory")
+    os.environ.setdefault("KV_REST_API_TOKEN", "in-memory")
+    os.environ.setdefault("GITHUB_REPO_OWNER", "golden")
+    os.environ.setdefault("GITHUB_REPO_NAME", "golden")
+    os.environ.setdefault("PAT_FOR_SECRETS", "golden")
+
+
+# --- Running a version ---
+def timed(timings, stage, func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args)
+    timings[stage] += time.perf_counter() - start
+    return result
+
+
+def run_version(module, dataset, today):
+    """Scores the dataset with one version of the code"""
+    freeze_clock(module, today)
+    timings = defaultdict(float)
+
+    zones = {}
+    for athlete_id, stream in dataset["streams"].items():
+        zone_times, _ = timed(timings, "time_in_zones", module.time_in_zones,
+                              athlete_id, stream["heartrate"], stream["time"])
+        zones[athlete_id] = {k: float(v) for k, v in zone_times.items()}
+
+    for records in dataset["activities"].values():
+        daily_scores = defaultdict(float)
+        for record in records.values():
+            daily_scores[date.fromisoformat(record["date"])] += (
+                record["z1"] + record["z2"] + record["z3"] + 2 * (record["z4"] + record["z5"])) / 60
+        timed(timings, "score_processor", module.score_processor, daily_scores)
+
+    engine = fakes.InMemoryRedis()
+    for athlete_id, records in dataset["activities"].items():
+        for activity_id, record in records.items():
+            engine.execute(["HSET", athlete_id, activity_id, str(record)])
+    github = fakes.FakeGitHub()
+    module.Redis = fakes.redis_factory(engine)
+    module.requests = github
+    # Versions with api/http_client.py make their calls through it
+    client = sys.modules.get(module.__name__.rsplit(".", 1)[0] + ".http_client")
+    if client is not None:
+        client.Redis = module.Redis
+        client.requests = github
+    timed(timings, "update_scores", module.update_scores)
+    scoreboard = json.loads(github.content("scores.json"))
+    return {"zones": zones, "scoreboard": scoreboard, "timings": dict(timings)}
+
+
+# --- Comparing ---
+def flatten(value, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, for field by field comparison"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, inner in value.items():
+            flat.update(flatten(inner, f"{prefix}{key}."))
+        return flat
+    return {prefix[:-1]: value}
+
+
+def differences(old, new, tolerance):
+    """[(field, old, new)] for every value that moved more than tolerance"""
+    old, new = flatten(old), flatten(new)
+    diffs = []
+    for field in sorted(set(old) | set(new)):
+        a, b = old.get(field), new.get(field)
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            if abs(a - b) > tolerance:
+                diffs.append((field, a, b))
+        elif a != b:
+            diffs.append((field, a, b))
+    return diffs
+
+
+def compare(old, new, tolerance):
+    by_name = lambda board: {a["name"]: a for a in board["leaderboard"]}
+    old_board, new_board = by_name(old["scoreboard"]), by_name(new["scoreboard"])
+    failures = 0
+
+    print(f"{'athlete':<14}{'old score':>12}{'new score':>12}{'diff':>10}  other fields changed")
+    for name in sorted(set(old_board) | set(new_board)):
+        a, b = old_board.get(name, {}), new_board.get(name, {})
+        diffs = differences(a, b, tolerance)
+        failures += len(diffs)
+        score_a, score_b = a.get("score"), b.get("score")
+        delta = (score_b - score_a) if score_a is not None and score_b is not None else float("nan")
+        others = [f for f, _, _ in diffs if f != "score"]
+        print(f"{name:<14}{score_a if score_a is not None else '-':>12}"
+              f"{score_b if score_b is not None else '-':>12}{delta:>+10.3f}  {', '.join(others) or '-'}")
+
+    for field in ("total_score", "potential"):
+        a, b = old["scoreboard"].get(field), new["scoreboard"].get(field)
+        if differences({field: a}, {field: b}, tolerance):
+            failures += 1
+            print(f"{field} changed: {a} -> {b}")
+
+    stream_diffs = 0
+    for athlete_id in old["zones"]:
+        for field, a, b in differences(old["zones"][athlete_id], new["zones"].get(athlete_id, {}), tolerance):
+            stream_diffs += 1
+            print(f"stream {athlete_id} {field}: {a} -> {b}")
+    failures += stream_diffs
+    print(f"Zone times identical for {len(old['zones'])} streams" if not stream_diffs
+          else f"{stream_diffs} zone time differences")
+
+    print()
+    print(f"{'stage':<18}{'old ms':>12}{'new ms':>12}{'change':>10}")
+    for stage, old_seconds in old["timings"].items():
+        new_seconds = new["timings"].get(stage, 0.0)
+        change = (new_seconds - old_seconds) / old_seconds if old_seconds else 0.0
+        print(f"{stage:<18}{old_seconds * 1000:>12.3f}{new_seconds * 1000:>12.3f}{change:>+10.1%}")
+    return failures
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--ref", default="HEAD", help="git revision holding the old code")
+    arg_parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    arg_parser.add_argument("--tolerance", type=float, default=1e-9)
+    arg_parser.add_argument("--freeze", action="store_true", help="write a new dataset and exit")
+    arg_parser.add_argument("--from-redis", action="store_true", help="freeze the live data, anonymized")
+    arg_parser.add_argument("--athletes", type=int, default=8)
+    arg_parser.add_argument("--activities", type=int, default=60)
+    arg_parser.add_argument("--samples", type=int, default=1800, help="samples per stream")
+    arg_parser.add_argument("--today", default="2026-06-15", help="frozen date for synthetic data")
+    arg_parser.add_argument("--seed", type=int, default=7)
+    args = arg_parser.parse_args(argv)
+
+    if args.freeze:
+        freeze(args)
+        return 0
+
+    with open(args.dataset) as f:
+        dataset = json.load(f)
+    today = date.fromisoformat(dataset["today"])
+    configure_environment(dataset)
+
+    workdir = tempfile.mkdtemp(prefix="golden-")
+    try:
+        old_module = load_reference(args.ref, workdir)
+        from api import strava_functions as new_module
+        old = run_version(old_module, dataset, today)
+        new = run_version(new_module, dataset, today)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Golden dataset: {len(dataset['users'])} athletes, frozen at {today}, old code at {args.ref}")
+    print()
+    failures = compare(old, new, args.tolerance)
+    print()
+    print("No differences." if not failures else f"{failures} differences above tolerance {args.tolerance}.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
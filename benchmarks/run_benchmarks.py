@@ -0,0 +1,189 @@
+"""
+Offline benchmarks for the scoring pipeline.
+
+Runs time_in_zones, score_processor, update_scores and the scores.json
+build against synthetic data, with Redis and GitHub replaced by in-memory
+stand-ins, so nothing touches the network.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --athletes 20 --activities 250 --samples 7200
+    python -m benchmarks.run_benchmarks --save-baseline
+
+Results are written to benchmarks/results.json. If a baseline exists at
+benchmarks/baseline.json every benchmark is compared to it and the run
+exits with status 1 when one is slower than the allowed tolerance.
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import date
+
+from benchmarks import fakes, synthetic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS = os.path.join(HERE, "results.json")
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+
+
+def configure_environment(users, hr_data):
+    """Sets the environment variables strava_functions reads"""
+    os.environ["STRAVA_USERS"] = json.dumps(users)
+    os.environ["HR_DATA"] = json.dumps(hr_data)
+    os.environ.setdefault("KV_REST_API_URL", "http://in-memory")
+    os.environ.setdefault("KV_REST_API_TOKEN", "in-memory")
+    os.environ.setdefault("GITHUB_REPO_OWNER", "bench")
+    os.environ.setdefault("GITHUB_REPO_NAME", "bench")
+    os.environ.setdefault("PAT_FOR_SECRETS", "bench")
+
+
+def install_fakes(strava_functions, engine, github):
+    """Points strava_functions at the in-memory Redis and GitHub"""
+    strava_functions.Redis = fakes.redis_factory(engine)
+    strava_functions.requests = github
+    strava_functions.http_client.Redis = strava_functions.Redis
+    strava_functions.http_client.requests = github
+
+
+def measure(func, repeat):
+    """Runs func repeat times and returns timing stats in seconds"""
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "runs": repeat,
+    }
+
+
+def run(args):
+    from api import strava_functions
+
+    users, hr_data = synthetic.make_roster(args.athletes, seed=args.seed)
+    configure_environment(users, hr_data)
+    activities = synthetic.make_activities(users, args.activities, seed=args.seed)
+    engine = fakes.InMemoryRedis()
+    synthetic.load_into_redis(engine, activities)
+    github = fakes.FakeGitHub()
+    install_fakes(strava_functions, engine, github)
+
+    athlete_id = next(iter(users))
+    resting, max_hr = hr_data[athlete_id]["hr_values"]
+    hr_stream, time_stream = synthetic.make_stream(args.samples, resting, max_hr, seed=args.seed)
+
+    daily_scores = defaultdict(float)
+    for record in activities[athlete_id].values():
+        score = (record["z1"] + record["z2"] + record["z3"] + 2 * (record["z4"] + record["z5"])) / 60
+        daily_scores[date.fromisoformat(record["date"])] += score
+
+    results = {}
+    results["time_in_zones"] = measure(
+        lambda: strava_functions.time_in_zones(athlete_id, hr_stream, time_stream), args.repeat)
+    results["time_in_zones_chunked"] = measure(
+        lambda: strava_functions.time_in_zones_chunked(athlete_id, hr_stream, time_stream), args.repeat)
+    results["score_processor"] = measure(
+        lambda: strava_functions.score_processor(daily_scores), args.repeat)
+    results["update_scores"] = measure(strava_functions.update_scores, args.repeat)
+
+    final_data = json.loads(github.content())
+    def build_scores_json():
+        content = json.dumps(final_data, indent=2)
+        base64.b64encode(content.encode("utf-8")).decode("utf-8")
+    results["scores_json_build"] = measure(build_scores_json, args.repeat)
+
+    return {
+        "meta": {
+            "athletes": args.athletes,
+            "activities_per_athlete": args.activities,
+            "samples_per_stream": args.samples,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "redis_commands": dict(engine.command_counts),
+            "scores_json_bytes": len(github.content()),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Prints a comparison table and returns the names that regressed"""
+    regressions = []
+    if current["meta"].get("athletes") != baseline["meta"].get("athletes") or \
+       current["meta"].get("activities_per_athlete") != baseline["meta"].get("activities_per_athlete") or \
+       current["meta"].get("samples_per_stream") != baseline["meta"].get("samples_per_stream"):
+        print("⚠️ Baseline was recorded with different data sizes, comparison is approximate.")
+    print(f"{'benchmark':<24}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<24}{'-':>14}{stats['min'] * 1000:>14.3f}{'new':>10}")
+            continue
+        change = stats["min"] / base["min"] - 1 if base["min"] else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  ❌"
+        print(f"{name:<24}{base['min'] * 1000:>14.3f}{stats['min'] * 1000:>14.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--athletes", type=int, default=20)
+    arg_parser.add_argument("--activities", type=int, default=250, help="activities per athlete")
+    arg_parser.add_argument("--samples", type=int, default=7200, help="samples per HR/time stream")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", default=DEFAULT_RESULTS)
+    arg_parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    arg_parser.add_argument("--save-baseline", action="store_true",
+                            help="store this run as the new baseline")
+    arg_parser.add_argument("--tolerance", type=float, default=0.20,
+                            help="allowed slowdown before a benchmark counts as a regression")
+    args = arg_parser.parse_args(argv)
+
+    current = run(args)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        for name, stats in current["results"].items():
+            print(f"{name:<24}{stats['min'] * 1000:>14.3f} ms")
+        print("No baseline found, run with --save-baseline to record one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"Performance regressions: {', '.join(regressions)}")
+        return 1
+    print("No performance regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Size report for the published scoreboard: the original pretty printed
+scores.json against the compact format (SCORES_FORMAT=compact), raw and
+as gzip and brotli would send them on the wire (brotli only when it is
+installed).
+
+Usage (from the repository root):
+    python -m benchmarks.scoreboard_size
+    python -m benchmarks.scoreboard_size --athletes 10,50,200 --activities 300
+    python -m benchmarks.scoreboard_size --scores scores.json
+
+--scores measures an existing scores.json (for example the one in the
+repository) instead of synthetic leagues.
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+
+from benchmarks import synthetic
+
+
+def build_synthetic(n_athletes, n_activities):
+    from api.leagues import load_leagues
+    from api.strava_functions import build_scoreboard
+
+    users, _ = synthetic.make_roster(n_athletes)
+    activities = synthetic.make_activities(users, n_activities)
+    league = load_leagues(users)["default"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_scoreboard(league, users, activities)
+
+
+def compressed_variants(content):
+    """suffix -> compressed bytes. Brotli is skipped when it isn't installed"""
+    variants = {".gz": gzip.compress(content, compresslevel=9)}
+    try:
+        import brotli
+        variants[".br"] = brotli.compress(content, quality=11)
+    except ImportError:
+        pass
+    return variants
+
+
+def sizes(final_data):
+    from api.strava_functions import compact_scoreboard, serialize_scores
+
+    pretty = serialize_scores(final_data)
+    compact = serialize_scores(compact_scoreboard(final_data), compact=True)
+    row = {"pretty": len(pretty), "compact": len(compact)}
+    for name, content in (("pretty", pretty), ("compact", compact)):
+        for suffix, variant in compressed_variants(content).items():
+            row[name + suffix] = len(variant)
+    return row
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--athletes", default="10,25,50,100", help="comma separated league sizes")
+    arg_parser.add_argument("--activities", type=int, default=200, help="stored activities per athlete")
+    arg_parser.add_argument("--scores", help="measure this scores.json instead")
+    args = arg_parser.parse_args(argv)
+
+    os.environ.pop("LEAGUES", None)
+    if args.scores:
+        with open(args.scores) as f:
+            cases = [(os.path.basename(args.scores), json.load(f))]
+    else:
+        cases = [(f"{n} athletes", build_synthetic(n, args.activities))
+                 for n in (int(a) for a in args.athletes.split(","))]
+
+    columns = ["pretty", "pretty.gz", "pretty.br", "compact", "compact.gz", "compact.br"]
+    print(f"{'scoreboard':<16}" + "".join(f"{c:>12}" for c in columns) + f"{'saved':>10}")
+    for label, final_data in cases:
+        row = sizes(final_data)
+        saved = 1 - row["compact"] / row["pretty"]
+        print(f"{label:<16}" + "".join(f"{row[c]:>12,}" if c in row else f"{'-':>12}" for c in columns)
+              + f"{saved:>10.1%}")
+    print("\nBytes. 'saved' compares compact JSON with the pretty file; "
+          "GitHub Pages and Vercel also compress on the wire.")
+
+
+if __name__ == "__main__":
+    main()
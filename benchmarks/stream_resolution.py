@@ -0,0 +1,114 @@
+"""
+Accuracy vs bytes report for Strava stream resolutions.
+
+For each sample activity the HR/time streams are scored at full
+resolution and at Strava's low/medium/high resolutions, and the report
+shows the payload size, parse time and how far the activity score moves.
+A second table shows what each accuracy budget (STREAM_MAX_SAMPLE_SECONDS)
+would pick for those activities and what it would cost.
+
+Usage (from the repository root):
+    python -m benchmarks.stream_resolution
+    python -m benchmarks.stream_resolution --durations 1800,3600,21600,86400 --budgets 0,5,10,30
+    python -m benchmarks.stream_resolution --stream-files saved/*.json
+
+--stream-files takes responses saved from the streams endpoint
+(keys=heartrate,time, key_by_type=true) so real activities can be used
+instead of synthetic ones. Downsampling is done locally with evenly
+spaced picks, which approximates what Strava returns.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from benchmarks import synthetic
+
+ATHLETE_ID = "100000"
+RESTING, MAX_HR = 55, 185
+
+
+def configure_environment():
+    os.environ.setdefault("STRAVA_USERS", json.dumps({ATHLETE_ID: {"name": "Sample"}}))
+    os.environ["HR_DATA"] = json.dumps({ATHLETE_ID: {"name": "Sample", "hr_values": [RESTING, MAX_HR]}})
+
+
+def load_samples(args):
+    """[(label, hr, times)] from saved stream files or synthetic streams"""
+    samples = []
+    if args.stream_files:
+        for path in args.stream_files:
+            with open(path) as f:
+                streams = json.load(f)
+            samples.append((os.path.basename(path), streams["heartrate"]["data"], streams["time"]["data"]))
+        return samples
+    for i, duration in enumerate(args.durations):
+        hr, times = synthetic.make_stream(duration, RESTING, MAX_HR, seed=args.seed + i)
+        samples.append((f"synthetic {duration / 3600:.1f}h", hr, times))
+    return samples
+
+
+def score_stream(strava_functions, hr, times):
+    """Returns the activity score, stream payload bytes and parse time"""
+    payload = json.dumps({"heartrate": {"data": hr}, "time": {"data": times}})
+    started = time.perf_counter()
+    streams = json.loads(payload)
+    parse_ms = (time.perf_counter() - started) * 1000
+    zones, _ = strava_functions.time_in_zones(ATHLETE_ID, streams["heartrate"]["data"],
+                                              streams["time"]["data"])
+    return strava_functions.activity_score(zones), len(payload), parse_ms
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--durations", type=lambda v: [int(d) for d in v.split(",")],
+                            default=[1800, 3600, 10800, 21600, 43200, 86400],
+                            help="synthetic activity lengths in samples (~seconds)")
+    arg_parser.add_argument("--budgets", type=lambda v: [float(b) for b in v.split(",")],
+                            default=[0, 2, 5, 10, 20, 60],
+                            help="STREAM_MAX_SAMPLE_SECONDS values to compare")
+    arg_parser.add_argument("--stream-files", nargs="*")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args(argv)
+
+    configure_environment()
+    from api import strava_functions
+
+    resolutions = [("full", None)] + list(strava_functions.STREAM_RESOLUTIONS)
+    rows = {}
+    print(f"{'activity':<18}{'resolution':<12}{'points':>8}{'bytes':>11}{'parse ms':>10}"
+          f"{'score':>10}{'error':>9}")
+    for label, hr, times in load_samples(args):
+        elapsed = times[-1] - times[0] if times else 0
+        rows[label] = {"elapsed": elapsed}
+        full_score = None
+        for resolution, points in resolutions:
+            sub_hr = synthetic.downsample(hr, points) if points else hr
+            sub_times = synthetic.downsample(times, points) if points else times
+            score, size, parse_ms = score_stream(strava_functions, sub_hr, sub_times)
+            if full_score is None:
+                full_score = score
+            error = abs(score - full_score) / full_score if full_score else 0.0
+            rows[label][resolution] = {"bytes": size, "error": error}
+            print(f"{label:<18}{resolution:<12}{len(sub_hr):>8}{size:>11}{parse_ms:>10.2f}"
+                  f"{score:>10.2f}{error:>9.2%}")
+
+    print()
+    print(f"{'budget s':<10}{'total bytes':>13}{'vs full':>9}{'mean error':>12}{'max error':>11}  picks")
+    full_bytes = sum(row["full"]["bytes"] for row in rows.values())
+    for budget in args.budgets:
+        total = 0
+        errors = []
+        picks = []
+        for row in rows.values():
+            resolution = strava_functions.pick_stream_resolution(row["elapsed"], budget) or "full"
+            total += row[resolution]["bytes"]
+            errors.append(row[resolution]["error"])
+            picks.append(resolution)
+        print(f"{budget:<10g}{total:>13}{total / full_bytes:>9.1%}"
+              f"{sum(errors) / len(errors):>12.2%}{max(errors):>11.2%}  {','.join(picks)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Synthetic data generators for the benchmarks.
+
+Everything is driven by a seeded random.Random so two runs with the same
+settings produce the same roster, activities and streams.
+"""
+
+import random
+from datetime import date, timedelta
+
+SPORTS = ["Run", "Ride", "WeightTraining", "Walk", "Hike", "Swim", "Yoga"]
+
+
+def make_roster(n_athletes, seed=0):
+    """Builds STRAVA_USERS and HR_DATA style dictionaries"""
+    rng = random.Random(seed)
+    users = {}
+    hr_data = {}
+    for i in range(n_athletes):
+        athlete_id = str(100000 + i)
+        name = f"Athlete{i:03d}"
+        resting = rng.randint(45, 70)
+        max_hr = rng.randint(170, 200)
+        users[athlete_id] = {
+            "access_token": f"token-{athlete_id}",
+            "refresh_token": f"refresh-{athlete_id}",
+            "expires_at": 4102444800,
+            "name": name,
+        }
+        hr_data[athlete_id] = {"name": name, "hr_values": [resting, max_hr]}
+    return users, hr_data
+
+
+def make_stream(n_samples, resting=60, max_hr=190, seed=0):
+    """
+    Builds a heartrate and time stream shaped like Strava's. Time mostly
+    ticks by one second, with some duplicated timestamps, some longer
+    recording gaps and the odd pause over 300 seconds.
+    """
+    rng = random.Random(seed)
+    hr = []
+    times = []
+    t = 0
+    bpm = resting + 30
+    for _ in range(n_samples):
+        bpm += rng.randint(-3, 3)
+        bpm = min(max(bpm, resting), max_hr)
+        hr.append(bpm)
+        times.append(t)
+        roll = rng.random()
+        if roll < 0.02:
+            step = 0
+        elif roll < 0.10:
+            step = rng.randint(2, 5)
+        elif roll < 0.101:
+            step = rng.randint(301, 1200)
+        else:
+            step = 1
+        t += step
+    return hr, times
+
+
+def downsample(values, points):
+    """
+    Evenly spaced picks of at most `points` values, standing in for
+    Strava's stream `resolution` parameter
+    """
+    if len(values) <= points:
+        return list(values)
+    step = len(values) / points
+    return [values[int(i * step)] for i in range(points)]
+
+
+def make_activity_record(rng, day, sport=None):
+    """Builds a stored activity in the format activity_processing saves"""
+    tot_time = float(rng.randint(900, 5400))
+    split = [rng.random() for _ in range(6)]
+    total = sum(split)
+    zones = [tot_time * s / total for s in split[:5]]
+    record = {f"z{i + 1}": zones[i] for i in range(5)}
+    record["sport"] = sport or rng.choice(SPORTS)
+    record["tot_time"] = tot_time
+    record["date"] = day.isoformat()
+    return record
+
+
+def make_activities(users, activities_per_athlete, seed=0, today=None):
+    """
+    Builds {athlete_id: {activity_id: record}} with activity dates spread
+    from the start of the year up to today.
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    season_start = date(today.year, 1, 1)
+    season_days = max((today - season_start).days, 0)
+    activities = {}
+    activity_id = 1000000000
+    for athlete_id in users:
+        athlete_activities = {}
+        for _ in range(activities_per_athlete):
+            activity_id += 1
+            day = season_start + timedelta(days=rng.randint(0, season_days))
+            athlete_activities[str(activity_id)] = make_activity_record(rng, day)
+        activities[athlete_id] = athlete_activities
+    return activities
+
+
+def load_into_redis(engine, activities):
+    """Stores the activities the way the webhook handler does, as str(dict)"""
+    for athlete_id, athlete_activities in activities.items():
+        for activity_id, record in athlete_activities.items():
+            engine.execute(["HSET", athlete_id, activity_id, str(record)])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Exports every stored activity to a CSV (or Parquet) file for offline
+analysis.
+
+Each athlete's hash is walked with HSCAN and rows are written as they
+arrive, so memory stays flat no matter how many athletes or activities
+there are. Needs KV_REST_API_URL, KV_REST_API_TOKEN and STRAVA_USERS in
+the environment.
+
+Usage:
+    python export_activities.py activities.csv
+    python export_activities.py activities.parquet --batch-size 1000
+    python export_activities.py runs.csv --athletes 123 456
+
+Parquet output needs pyarrow installed.
+"""
+
+import os
+import csv
+import json
+import argparse
+from upstash_redis import Redis
+from api.strava_functions import iter_activities
+
+COLUMNS = ["athlete_id", "athlete_name", "activity_id", "date", "sport",
+           "z1", "z2", "z3", "z4", "z5", "tot_time"]
+
+def export_rows(redis, users, athletes, batch_size):
+    """Yields one row per activity, athlete by athlete"""
+    for athlete_id in athletes:
+        name = users.get(athlete_id, {}).get("name", "")
+        for activity_id, record in iter_activities(redis, athlete_id, batch_size):
+            yield [athlete_id, name, activity_id, record["date"], record["sport"],
+                   record["z1"], record["z2"], record["z3"], record["z4"], record["z5"],
+                   record["tot_time"]]
+
+def write_csv(path, rows):
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def write_parquet(path, rows, batch_size):
+    """Writes one row group per batch_size rows"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export needs pyarrow (pip install pyarrow), or export to .csv")
+    schema = pa.schema([("athlete_id", pa.string()), ("athlete_name", pa.string()),
+                        ("activity_id", pa.string()), ("date", pa.string()), ("sport", pa.string())] +
+                       [(c, pa.float64()) for c in ("z1", "z2", "z3", "z4", "z5", "tot_time")])
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_pylist([dict(zip(COLUMNS, r)) for r in batch], schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist([dict(zip(COLUMNS, r)) for r in batch], schema))
+            count += len(batch)
+    return count
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Export all activity data to CSV or Parquet")
+    arg_parser.add_argument("output", help="output file, .csv or .parquet")
+    arg_parser.add_argument("--batch-size", type=int, default=500,
+                            help="records per HSCAN call (and per Parquet row group)")
+    arg_parser.add_argument("--athletes", nargs="*", help="only export these athlete ids")
+    args = arg_parser.parse_args(argv)
+
+    redis = Redis(url=os.environ.get("KV_REST_API_URL"), token=os.environ.get("KV_REST_API_TOKEN"))
+    users = json.loads(os.environ.get("STRAVA_USERS", "{}"))
+    athletes = args.athletes or list(users)
+    rows = export_rows(redis, users, athletes, args.batch_size)
+
+    if args.output.endswith(".parquet"):
+        count = write_parquet(args.output, rows, args.batch_size)
+    else:
+        count = write_csv(args.output, rows)
+    print(f"Exported {count} activities for {len(athletes)} athletes to {args.output}")
+
+if __name__ == "__main__":
+    main()
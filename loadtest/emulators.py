@@ -0,0 +1,478 @@
+"""
+Local stand-ins for the services the activity pipeline depends on.
+
+Each emulator is a small Flask app that can be served on a random local
+port with ServerThread:
+    strava_app   -- activity detail, streams, athlete activities and
+                    oauth, with Strava's X-RateLimit headers and 429s
+    qstash_app   -- /v2/publish, delivering messages with a signed
+                    Upstash-Signature JWT, retries and delays, plus
+                    queues with their own parallelism and schedules
+                    (QStashState.schedule)
+    upstash_app  -- the Upstash Redis REST protocol over an InMemoryRedis
+    github_app   -- the Contents API with SHA checks and 409 conflicts
+"""
+
+import base64
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import jwt
+import requests
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+from benchmarks import synthetic
+
+
+class ServerThread:
+    """Serves a WSGI app on 127.0.0.1 from a background thread"""
+
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class LazyApp:
+    """WSGI app whose target is filled in after the server has a port"""
+
+    def __init__(self):
+        self.app = None
+
+    def __call__(self, environ, start_response):
+        return self.app(environ, start_response)
+
+
+class CallCounter:
+    """Thread safe counter keyed by endpoint name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+# --- Strava ---
+class StravaState:
+    """
+    Activities known to the Strava emulator and its rate limit windows.
+    Limits follow Strava's "15 minute,daily" format.
+    """
+
+    def __init__(self, samples=3600, latency=0.0, limit_15min=200, limit_daily=2000):
+        self.samples = samples
+        self.latency = latency
+        self.limit_15min = limit_15min
+        self.limit_daily = limit_daily
+        self.activities = {}
+        self.calls = CallCounter()
+        self._lock = threading.Lock()
+        self._usage_15min = 0
+        self._usage_daily = 0
+        self._window_start = time.time()
+
+    def add_activity(self, athlete_id, activity_id, sport="Run", start=None, samples=None):
+        start = start or datetime.now(timezone.utc)
+        self.activities[str(activity_id)] = {
+            "id": int(activity_id),
+            "athlete": {"id": int(athlete_id)},
+            "sport_type": sport,
+            "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "start_date_local": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "elapsed_time": samples or self.samples,
+            "moving_time": samples or self.samples,
+            "has_heartrate": True,
+            "samples": samples or self.samples,
+        }
+
+    def take(self):
+        """Counts one request against the limits, False once they're used up"""
+        with self._lock:
+            if time.time() - self._window_start >= 900:
+                self._window_start = time.time()
+                self._usage_15min = 0
+            if self._usage_15min >= self.limit_15min or self._usage_daily >= self.limit_daily:
+                return False
+            self._usage_15min += 1
+            self._usage_daily += 1
+            return True
+
+    def headers(self):
+        return {
+            "X-RateLimit-Limit": f"{self.limit_15min},{self.limit_daily}",
+            "X-RateLimit-Usage": f"{self._usage_15min},{self._usage_daily}",
+        }
+
+
+def strava_app(state):
+    app = Flask("strava_emulator")
+
+    def limited(name, build):
+        state.calls.add(name)
+        if state.latency:
+            time.sleep(state.latency)
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return Response('{"message": "Authorization Error"}', 401, mimetype="application/json")
+        if not state.take():
+            state.calls.add("429")
+            resp = jsonify(message="Rate Limit Exceeded")
+            resp.status_code = 429
+        else:
+            resp = build()
+        resp.headers.update(state.headers())
+        return resp
+
+    @app.route("/api/v3/activities/<activity_id>", methods=["GET"])
+    def activity(activity_id):
+        def build():
+            found = state.activities.get(activity_id)
+            if found is None:
+                return Response('{"message": "Record Not Found"}', 404, mimetype="application/json")
+            return jsonify({k: v for k, v in found.items() if k != "samples"})
+        return limited("activity", build)
+
+    @app.route("/api/v3/activities/<activity_id>/streams", methods=["GET"])
+    def streams(activity_id):
+        def build():
+            found = state.activities.get(activity_id)
+            if found is None:
+                return Response('{"message": "Record Not Found"}', 404, mimetype="application/json")
+            hr, times = synthetic.make_stream(found["samples"], seed=int(activity_id))
+            resolution = request.args.get("resolution")
+            if resolution in ("low", "medium", "high"):
+                target = {"low": 100, "medium": 1000, "high": 10000}[resolution]
+                hr = synthetic.downsample(hr, target)
+                times = synthetic.downsample(times, target)
+            keys = request.args.get("keys", "").split(",")
+            body = {}
+            if "heartrate" in keys:
+                body["heartrate"] = {"data": hr, "series_type": "time",
+                                     "original_size": len(hr), "resolution": resolution or "high"}
+            if "time" in keys:
+                body["time"] = {"data": times, "series_type": "time",
+                                "original_size": len(times), "resolution": resolution or "high"}
+            return jsonify(body)
+        return limited("streams", build)
+
+    @app.route("/api/v3/athlete/activities", methods=["GET"])
+    def athlete_activities():
+        def build():
+            token = request.headers["Authorization"].split(" ", 1)[1]
+            athlete_id = token.rsplit("-", 1)[-1]
+            after = int(request.args.get("after", 0))
+            before = int(request.args.get("before", 2 ** 40))
+            per_page = int(request.args.get("per_page", 30))
+            page = int(request.args.get("page", 1))
+            found = []
+            for act in state.activities.values():
+                start = datetime.strptime(act["start_date"], "%Y-%m-%dT%H:%M:%SZ")
+                ts = start.replace(tzinfo=timezone.utc).timestamp()
+                if str(act["athlete"]["id"]) == athlete_id and after < ts < before:
+                    found.append({k: v for k, v in act.items() if k != "samples"})
+            found.sort(key=lambda a: a["start_date"])
+            return jsonify(found[(page - 1) * per_page:page * per_page])
+        return limited("athlete_activities", build)
+
+    @app.route("/oauth/token", methods=["POST"])
+    @app.route("/api/v3/oauth/token", methods=["POST"])
+    def oauth():
+        state.calls.add("oauth")
+        athlete_id = request.form.get("refresh_token", "refresh-0").rsplit("-", 1)[-1]
+        return jsonify({
+            "access_token": f"token-{athlete_id}",
+            "refresh_token": f"refresh-{athlete_id}",
+            "expires_at": int(time.time()) + 21600,
+            "athlete": {"id": int(athlete_id), "firstname": f"Athlete{athlete_id}"},
+        })
+
+    return app
+
+
+# --- QStash ---
+def sign(body, url, key):
+    """Builds the Upstash-Signature JWT QStash attaches to each delivery"""
+    now = int(time.time())
+    body_hash = base64.urlsafe_b64encode(hashlib.sha256(body.encode()).digest()).decode().rstrip("=")
+    claims = {"iss": "Upstash", "sub": url, "exp": now + 300, "nbf": now, "iat": now,
+              "jti": uuid.uuid4().hex, "body": body_hash}
+    return jwt.encode(claims, key, algorithm="HS256")
+
+
+class QStashState:
+    """
+    Messages published to the emulator and their delivery history. Failed
+    deliveries are retried with exponential backoff (scaled down by
+    backoff_scale so a load test doesn't take minutes).
+    """
+
+    def __init__(self, signing_key, parallelism=50, retries=3, backoff_scale=0.01):
+        self.signing_key = signing_key
+        self.retries = retries
+        self.backoff_scale = backoff_scale
+        self.pool = ThreadPoolExecutor(max_workers=parallelism)
+        # Queue name -> (parallelism, pool delivering that queue's messages)
+        self.queues = {}
+        self.messages = {}
+        self.calls = CallCounter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def upsert_queue(self, name, parallelism):
+        with self._lock:
+            current = self.queues.get(name)
+            if current is None or current[0] != parallelism:
+                self.queues[name] = (parallelism, ThreadPoolExecutor(max_workers=parallelism))
+
+    def publish(self, destination, body, headers, delay=0.0, queue=None):
+        message_id = f"msg_{next(self._ids)}"
+        message = {
+            "id": message_id, "url": destination, "body": body, "headers": headers,
+            "published_at": time.time(), "attempts": [], "done": threading.Event(),
+            "status": None, "retries": int(headers.pop("Upstash-Retries", self.retries)),
+            "queue": queue,
+        }
+        with self._lock:
+            self.messages[message_id] = message
+            if queue and queue not in self.queues:
+                # QStash creates a queue on first use with a parallelism of 1
+                self.queues[queue] = (1, ThreadPoolExecutor(max_workers=1))
+            pool = self.queues[queue][1] if queue else self.pool
+        pool.submit(self._deliver, message, delay)
+        return message_id
+
+    def _deliver(self, message, delay):
+        if delay:
+            time.sleep(delay)
+        for retried in range(message["retries"] + 1):
+            headers = dict(message["headers"])
+            headers["Upstash-Signature"] = sign(message["body"], message["url"], self.signing_key)
+            headers["Upstash-Message-Id"] = message["id"]
+            headers["Upstash-Retried"] = str(retried)
+            started = time.time()
+            try:
+                resp = requests.post(message["url"], data=message["body"].encode(), headers=headers)
+                status = resp.status_code
+                retry_after = resp.headers.get("Retry-After")
+            except requests.exceptions.RequestException:
+                status, retry_after = 599, None
+            message["attempts"].append({"started": started, "finished": time.time(), "status": status})
+            self.calls.add("delivery")
+            if 200 <= status < 300:
+                message["status"] = status
+                break
+            self.calls.add("retry" if retried < message["retries"] else "failed")
+            message["status"] = status
+            wait = float(retry_after) if retry_after else 2 ** retried
+            time.sleep(wait * self.backoff_scale)
+        message["done"].set()
+
+    def schedule(self, destination, interval):
+        """
+        Calls destination every interval seconds like a QStash schedule
+        would, until stop_schedules. Each call waits for the last to finish.
+        """
+        def run():
+            while not self._stopped.wait(interval):
+                headers = {"Upstash-Signature": sign("", destination, self.signing_key),
+                           "Upstash-Schedule-Id": "scd_loadtest"}
+                try:
+                    requests.post(destination, data=b"", headers=headers)
+                except requests.exceptions.RequestException:
+                    pass
+                self.calls.add("schedule")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop_schedules(self):
+        self._stopped.set()
+
+    def wait(self, timeout):
+        """Waits for every message, including ones published while waiting"""
+        deadline = time.time() + timeout
+        while True:
+            pending = [m for m in list(self.messages.values()) if not m["done"].is_set()]
+            if not pending:
+                return True
+            for message in pending:
+                if not message["done"].wait(max(deadline - time.time(), 0)):
+                    return False
+
+
+def _parse_delay(raw):
+    if not raw:
+        return 0.0
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if raw[-1] in units:
+        return float(raw[:-1]) * units[raw[-1]]
+    return float(raw)
+
+
+def qstash_app(state):
+    app = Flask("qstash_emulator")
+
+    def forwarded_headers(source):
+        headers = {}
+        for key, value in source.items():
+            if key.lower().startswith("upstash-forward-"):
+                headers[key[len("Upstash-Forward-"):]] = value
+            elif key.lower() == "content-type":
+                headers["Content-Type"] = value
+            elif key.lower() == "upstash-retries":
+                headers["Upstash-Retries"] = value
+        return headers
+
+    @app.route("/v2/publish/<path:destination>", methods=["POST"])
+    def publish(destination):
+        state.calls.add("publish")
+        delay = _parse_delay(request.headers.get("Upstash-Delay"))
+        message_id = state.publish(destination, request.get_data(as_text=True),
+                                   forwarded_headers(request.headers), delay)
+        return jsonify(messageId=message_id)
+
+    @app.route("/v2/batch", methods=["POST"])
+    def batch():
+        results = []
+        for message in request.get_json():
+            state.calls.add("publish")
+            headers = message.get("headers") or {}
+            delay = _parse_delay(headers.get("Upstash-Delay"))
+            body = message.get("body")
+            if not isinstance(body, str):
+                body = json.dumps(body)
+            message_id = state.publish(message["destination"], body, forwarded_headers(headers), delay,
+                                       queue=message.get("queue"))
+            results.append({"messageId": message_id})
+        return jsonify(results)
+
+    @app.route("/v2/schedules/<path:destination>", methods=["POST"])
+    def create_schedule(destination):
+        # The load test runs its own, faster schedule (QStashState.schedule)
+        state.calls.add("schedule_upsert")
+        return jsonify(scheduleId=request.headers.get("Upstash-Schedule-Id") or "schedule")
+
+    @app.route("/v2/queues", methods=["POST"])
+    def upsert_queue():
+        state.calls.add("queue_upsert")
+        body = request.get_json()
+        state.upsert_queue(body["queueName"], int(body.get("parallelism", 1)))
+        return ""
+
+    return app
+
+
+# --- Upstash Redis REST ---
+def _encode(result):
+    if isinstance(result, str):
+        return result if result == "OK" else base64.b64encode(result.encode()).decode()
+    if isinstance(result, list):
+        return [_encode(r) for r in result]
+    return result
+
+
+def upstash_app(engine, token, latency=0.0):
+    app = Flask("upstash_emulator")
+    calls = CallCounter()
+    app.config["calls"] = calls
+
+    def run(command):
+        try:
+            result = engine.execute(command)
+        except Exception as e:
+            return {"error": f"ERR {e}"}
+        if request.headers.get("Upstash-Encoding") == "base64":
+            result = _encode(result)
+        return {"result": result}
+
+    def authorized():
+        return request.headers.get("Authorization") == f"Bearer {token}"
+
+    @app.route("/", methods=["POST"])
+    def single():
+        if not authorized():
+            return jsonify(error="Unauthorized"), 401
+        if latency:
+            time.sleep(latency)
+        command = request.get_json()
+        calls.add(str(command[0]).upper())
+        reply = run(command)
+        return jsonify(reply), 400 if "error" in reply else 200
+
+    @app.route("/pipeline", methods=["POST"])
+    @app.route("/multi-exec", methods=["POST"])
+    def pipeline():
+        if not authorized():
+            return jsonify(error="Unauthorized"), 401
+        if latency:
+            time.sleep(latency)
+        commands = request.get_json()
+        for command in commands:
+            calls.add(str(command[0]).upper())
+        return jsonify([run(c) for c in commands])
+
+    return app
+
+
+# --- GitHub Contents API ---
+class GitHubState:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.files = {}
+        self.calls = CallCounter()
+        self._lock = threading.Lock()
+
+
+def github_app(state):
+    app = Flask("github_emulator")
+
+    @app.route("/repos/<owner>/<repo>/contents/<path:path>", methods=["GET", "PUT"])
+    def contents(owner, repo, path):
+        if state.latency:
+            time.sleep(state.latency * random.uniform(0.5, 1.5))
+        if request.method == "GET":
+            state.calls.add("GET")
+            with state._lock:
+                found = state.files.get(path)
+            if found is None:
+                return jsonify(message="Not Found"), 404
+            return jsonify(sha=found["sha"], path=path,
+                           content=base64.b64encode(found["content"]).decode())
+        state.calls.add("PUT")
+        payload = request.get_json(force=True)
+        with state._lock:
+            current = state.files.get(path)
+            if current is not None and not payload.get("sha"):
+                state.calls.add("422")
+                return jsonify(message='"sha" wasn\'t supplied.'), 422
+            if current is not None and payload["sha"] != current["sha"]:
+                state.calls.add("409")
+                return jsonify(message=f"{path} does not match {payload['sha']}"), 409
+            content = base64.b64decode(payload["content"])
+            sha = hashlib.sha1(content + str(time.time()).encode()).hexdigest()
+            state.files[path] = {"sha": sha, "content": content, "updated": time.time()}
+        return jsonify(content={"path": path, "sha": sha}, commit={"sha": sha}), 200 if current else 201
+
+    return app
@@ -0,0 +1,278 @@
+"""
+End-to-end load test: Strava webhook -> Redis inbox -> flush_events ->
+QStash -> process_queued_event -> update_scores -> upload_to_github, with
+every external service replaced by the local emulators in
+loadtest/emulators.py.
+
+Usage (from the repository root):
+    python -m loadtest.run_load --athletes 50 --bursts 3 --samples 3600
+
+Each burst posts one activity create event per athlete to the webhook
+handler at the same time. --bulk queues that many catch-up events in the
+bulk lane first, to check live events still get through quickly. The run reports webhook ack latency, end to end
+latency (webhook POST until QStash sees a 2xx from the processor),
+throughput and the number of calls each emulated service received.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import fakes, synthetic
+from loadtest import emulators
+
+SIGNING_KEY = "sig_loadtest_current_0123456789abcdef"
+NEXT_SIGNING_KEY = "sig_loadtest_next_0123456789abcdef"
+REDIS_TOKEN = "loadtest-redis-token"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def start_services(args, users, hr_data):
+    """Starts the emulators, configures the environment and serves the handlers"""
+    engine = fakes.InMemoryRedis()
+    strava = emulators.StravaState(samples=args.samples, latency=args.strava_latency / 1000,
+                                   limit_15min=args.strava_limit[0], limit_daily=args.strava_limit[1])
+    qstash_state = emulators.QStashState(SIGNING_KEY, parallelism=args.parallelism,
+                                         retries=args.retries)
+    github = emulators.GitHubState(latency=args.github_latency / 1000)
+    upstash = emulators.upstash_app(engine, REDIS_TOKEN, latency=args.redis_latency / 1000)
+
+    servers = {
+        "strava": emulators.ServerThread(emulators.strava_app(strava)).start(),
+        "qstash": emulators.ServerThread(emulators.qstash_app(qstash_state)).start(),
+        "upstash": emulators.ServerThread(upstash).start(),
+        "github": emulators.ServerThread(emulators.github_app(github)).start(),
+    }
+
+    # The handler modules read their configuration at import time, so the
+    # processor's port has to be known before they're imported
+    processor_app = emulators.LazyApp()
+    servers["processor"] = emulators.ServerThread(processor_app).start()
+    flusher_app = emulators.LazyApp()
+    servers["flusher"] = emulators.ServerThread(flusher_app).start()
+    os.environ.update({
+        "STRAVA_USERS": json.dumps(users),
+        "HR_DATA": json.dumps(hr_data),
+        "STRAVA_CLIENT_ID": "loadtest",
+        "STRAVA_CLIENT_SECRET": "loadtest",
+        "STRAVA_BASE_URL": servers["strava"].url,
+        "GITHUB_API_URL": servers["github"].url,
+        "GITHUB_REPO_OWNER": "loadtest",
+        "GITHUB_REPO_NAME": "loadtest",
+        "PAT_FOR_SECRETS": "loadtest",
+        "KV_REST_API_URL": servers["upstash"].url,
+        "KV_REST_API_TOKEN": REDIS_TOKEN,
+        "QSTASH_URL": servers["qstash"].url,
+        "QSTASH_TOKEN": "loadtest",
+        "QSTASH_CURRENT_SIGNING_KEY": SIGNING_KEY,
+        "QSTASH_NEXT_SIGNING_KEY": NEXT_SIGNING_KEY,
+        "VERCEL_MANUAL_SECRET": "loadtest",
+        "PROCESSING_URL": f"{servers['processor'].url}/api/strava_activity_handler",
+        "FLUSH_URL": f"{servers['flusher'].url}/api/flush_events",
+        "LIVE_BUSY_SECONDS": "2",
+        "BULK_YIELD_DELAY": "1s",
+    })
+
+    from api import strava_activity_handler, strava_webhook_handler, flush_events
+    processor_app.app = strava_activity_handler.app
+    flusher_app.app = flush_events.app
+    qstash_state.schedule(os.environ["FLUSH_URL"], args.flush_interval)
+    servers["webhook"] = emulators.ServerThread(strava_webhook_handler.app).start()
+
+    return {
+        "servers": servers, "engine": engine, "flusher": flush_events, "strava": strava, "qstash": qstash_state,
+        "github": github, "upstash_calls": upstash.config["calls"],
+    }
+
+
+def run_burst(env, users, burst, session_times):
+    """Posts one create event per athlete at the same time"""
+    webhook_url = f"{env['servers']['webhook'].url}/api/strava_webhook_handler"
+    events = []
+    for i, athlete_id in enumerate(users):
+        activity_id = 9000000000 + burst * 100000 + i
+        env["strava"].add_activity(athlete_id, activity_id)
+        events.append({
+            "object_type": "activity", "aspect_type": "create", "object_id": activity_id,
+            "owner_id": int(athlete_id), "subscription_id": 1, "event_time": int(time.time()),
+            "updates": {},
+        })
+
+    def post(event):
+        sent = time.time()
+        resp = requests.post(webhook_url, json=event)
+        session_times[event["object_id"]] = sent
+        return time.time() - sent, resp.status_code
+
+    with ThreadPoolExecutor(max_workers=len(events)) as pool:
+        return list(pool.map(post, events))
+
+
+def queue_bulk(env, users, count):
+    """Queues catch-up events in the bulk lane, as reprocessing dead letters does"""
+    from api.lanes import BULK, PROCESSING_URL, ACTIVITY_RETRIES, ensure_queues, lane_message
+    from api.strava_activity_handler import qstash_client
+    athletes = list(users)
+    events = []
+    for i in range(count):
+        athlete_id = athletes[i % len(athletes)]
+        activity_id = 8000000000 + i
+        env["strava"].add_activity(athlete_id, activity_id)
+        events.append({"object_type": "activity", "aspect_type": "create", "object_id": activity_id,
+                       "owner_id": int(athlete_id), "updates": {}, "lane": BULK})
+    ensure_queues(qstash_client)
+    for start in range(0, len(events), 100):
+        qstash_client.message.batch_json([lane_message(BULK, PROCESSING_URL, event, retries=ACTIVITY_RETRIES)
+                                          for event in events[start:start + 100]])
+    return {event["object_id"]: event["owner_id"] for event in events}
+
+
+def wait_for_inbox(env, timeout):
+    """Waits until the flusher has forwarded every event in the inbox"""
+    deadline = time.time() + timeout
+    while env["engine"].execute(["LLEN", env["flusher"].INBOX_KEY]):
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def collect(env, sent_times, started, finished, bulk=None):
+    """Turns emulator bookkeeping into the report"""
+    # Deferred and requeued events are delivered more than once, the last
+    # delivery is the one that handled them
+    handled = {}
+    failed = 0
+    for message in env["qstash"].messages.values():
+        # Only activity handler deliveries, not flush triggers
+        if message["url"] != os.environ["PROCESSING_URL"]:
+            continue
+        body = json.loads(message["body"])
+        if body.get("lane") == "bulk":
+            continue
+        object_id = body.get("object_id")
+        sent = sent_times.get(object_id)
+        if message["status"] and 200 <= message["status"] < 300 and sent is not None:
+            finished_at = message["attempts"][-1]["finished"]
+            handled[object_id] = max(handled.get(object_id, finished_at), finished_at)
+        else:
+            failed += 1
+    e2e = [finished_at - sent_times[object_id] for object_id, finished_at in handled.items()]
+    wall = finished - started
+    bulk = bulk or {}
+    bulk_stored = sum(1 for object_id, athlete_id in bulk.items()
+                      if env["engine"].execute(["HEXISTS", str(athlete_id), str(object_id)]))
+    return {
+        "bulk": {"queued": len(bulk), "stored": bulk_stored},
+        "events": len(sent_times),
+        "completed": len(e2e),
+        "failed": failed,
+        "wall_seconds": wall,
+        "throughput_per_second": len(e2e) / wall if wall else 0.0,
+        "e2e_latency": {
+            "p50": percentile(e2e, 50), "p99": percentile(e2e, 99),
+            "mean": statistics.fmean(e2e) if e2e else 0.0, "max": max(e2e, default=0.0),
+        },
+        "calls": {
+            "strava": env["strava"].calls.as_dict(),
+            "qstash": env["qstash"].calls.as_dict(),
+            "redis": env["upstash_calls"].as_dict(),
+            "github": env["github"].calls.as_dict(),
+        },
+    }
+
+
+def print_report(report):
+    print(f"Events sent:        {report['events']}")
+    print(f"Completed / failed: {report['completed']} / {report['failed']}")
+    print(f"Wall time:          {report['wall_seconds']:.2f} s")
+    print(f"Throughput:         {report['throughput_per_second']:.2f} events/s")
+    ack = report["webhook_ack_latency"]
+    print(f"Webhook ack:        p50 {ack['p50'] * 1000:.1f} ms, p99 {ack['p99'] * 1000:.1f} ms")
+    e2e = report["e2e_latency"]
+    print(f"End to end:         p50 {e2e['p50']:.2f} s, p99 {e2e['p99']:.2f} s, max {e2e['max']:.2f} s")
+    if report["bulk"]["queued"]:
+        print(f"Bulk events:        {report['bulk']['stored']} of {report['bulk']['queued']} stored")
+    for service, counts in report["calls"].items():
+        summary = ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+        print(f"{service + ' calls:':<20}{summary}")
+
+
+def parse_limit(raw):
+    limit_15min, limit_daily = raw.split(",")
+    return int(limit_15min), int(limit_daily)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--athletes", type=int, default=50)
+    arg_parser.add_argument("--bursts", type=int, default=1)
+    arg_parser.add_argument("--burst-interval", type=float, default=1.0, help="seconds between bursts")
+    arg_parser.add_argument("--samples", type=int, default=3600, help="stream samples per activity")
+    arg_parser.add_argument("--activities", type=int, default=100, help="stored activities per athlete")
+    arg_parser.add_argument("--parallelism", type=int, default=50, help="concurrent QStash deliveries")
+    arg_parser.add_argument("--bulk", type=int, default=0, help="catch-up events queued in the bulk lane")
+    arg_parser.add_argument("--flush-interval", type=float, default=0.5,
+                            help="seconds between scheduled inbox flushes")
+    arg_parser.add_argument("--retries", type=int, default=3, help="QStash delivery retries")
+    arg_parser.add_argument("--strava-latency", type=float, default=50, help="ms per Strava call")
+    arg_parser.add_argument("--github-latency", type=float, default=300, help="ms per GitHub call")
+    arg_parser.add_argument("--redis-latency", type=float, default=2, help="ms per Redis call")
+    arg_parser.add_argument("--strava-limit", type=parse_limit, default=(200, 2000),
+                            help="Strava rate limit as '15min,daily'")
+    arg_parser.add_argument("--timeout", type=float, default=600)
+    arg_parser.add_argument("--log", default=os.devnull, help="where handler output goes")
+    arg_parser.add_argument("--json", help="also write the report to this file")
+    args = arg_parser.parse_args(argv)
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    users, hr_data = synthetic.make_roster(args.athletes)
+    env = start_services(args, users, hr_data)
+    synthetic.load_into_redis(env["engine"], synthetic.make_activities(users, args.activities))
+
+    sent_times = {}
+    acks = []
+    started = time.time()
+    with open(args.log, "w") as log, contextlib.redirect_stdout(log):
+        bulk = queue_bulk(env, users, args.bulk) if args.bulk else {}
+        for burst in range(args.bursts):
+            acks.extend(run_burst(env, users, burst, sent_times))
+            if burst < args.bursts - 1:
+                time.sleep(args.burst_interval)
+        deadline = time.time() + args.timeout
+        completed = (wait_for_inbox(env, args.timeout)
+                     and env["qstash"].wait(max(deadline - time.time(), 0)))
+        env["qstash"].stop_schedules()
+    finished = time.time()
+
+    report = collect(env, sent_times, started, finished, bulk)
+    ack_times = [a[0] for a in acks]
+    report["webhook_ack_latency"] = {"p50": percentile(ack_times, 50), "p99": percentile(ack_times, 99)}
+    report["webhook_non_200"] = sum(1 for a in acks if a[1] != 200)
+    if not completed:
+        print(f"⚠️ Timed out after {args.timeout}s with deliveries still running")
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    all_stored = report["bulk"]["stored"] == report["bulk"]["queued"]
+    return 0 if completed and all_stored and not report["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
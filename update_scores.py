@@ -1,261 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Builds scores.json offline from a local dump of the stored activities,
+with the same scoring code the site runs (strava_functions.build_scoreboard)
+and no network, for fast local iteration and profiling.
+
+A dump is a JSON file holding the roster and every athlete's activity
+hash, records either as stored in Redis (strings) or as objects:
+
+    {"users": {"123": {"name": "Sean", ...}},
+     "activities": {"123": {"9876543210": {"date": "2026-03-02", "z1": 600, ...}}}}
+
+--save-dump writes objects, which skips parsing every record on each
+build (a season of 25 athletes scores in ~25 ms instead of ~400 ms).
+The golden dataset (benchmarks/golden/dataset.json) is a valid dump.
+
+Usage:
+    python update_scores.py --save-dump dump.json       # needs KV_REST_API_URL,
+                                                        # KV_REST_API_TOKEN, STRAVA_USERS
+    python update_scores.py dump.json                   # writes ./out/scores.json
+    python update_scores.py dump.json --out-dir /tmp --now 2026-03-15T12:00:00-06:00
+    python update_scores.py dump.json --repeat 20 --profile
+    python update_scores.py dump.json --compact         # as SCORES_FORMAT=compact publishes
+
+Leagues come from LEAGUES in the environment or --leagues, and every
+league's output file is written to --out-dir (./out by default, so a
+local run never overwrites the scores.json committed at the root).
+"""
+
 import os
+import sys
 import json
 import time
-import requests
-from vercel_kv import KV
-from datetime import datetime#, timedelta
-#from dateutil import parser
-
-def token_expired(expires_at):
-    """Check if the Strava token is expired."""
-    return time.time() >= expires_at
-
-def refresh_strava_token(client_id, client_secret, refresh_token):
-    """Refresh the Strava access token."""
-    print("Strava token is expired, refreshing...")
-    response = requests.post(
-        "https://www.strava.com/oauth/token",
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token,
-        }
-    )
-    
-    if response.status_code != 200:
-        raise Exception(f"Token refresh failed: {response.text}")
-    
-    token_data = response.json()
-    print("Token refreshed successfully.")
-    #print("IMPORTANT: You must manually update the STRAVA_USERS secret in your GitHub repository with the new token values below.")
-    #print(f"New tokens: {token_data}")
-    return token_data
-
-def get_activities(user_creds, after_timestamp):
-    """Fetch recent activities for a user."""
-    headers = {'Authorization': f'Bearer {user_creds["access_token"]}'}
-    params = {'after': after_timestamp, 'per_page': 50}
-    activities = []
-    page = 1
-    while True:
-        params['page'] = page
-        response = requests.get('https://www.strava.com/api/v3/athlete/activities', headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
-        if not data:
-            break
-        activities.extend(data)
-        page += 1
-    return activities
-
-def calculate_score(hr_data, duration_seconds, zones):
-    """Calculate the score for a single activity based on time in HR zones."""
-    if not hr_data:
+import argparse
+import contextlib
+from datetime import datetime
+import pytz
+from api.strava_functions import build_scoreboard, iter_activities, compact_scoreboard, serialize_scores
+from api.leagues import load_leagues
+from api.profiling import profile_call
+
+def save_dump(path):
+    """Copies the roster and every athlete's activities out of Redis"""
+    from upstash_redis import Redis
+
+    redis = Redis(url=os.environ["KV_REST_API_URL"], token=os.environ["KV_REST_API_TOKEN"])
+    users = json.loads(os.environ["STRAVA_USERS"])
+    activities = {athlete_id: dict(iter_activities(redis, athlete_id)) for athlete_id in users}
+    with open(path, "w") as f:
+        json.dump({"users": users, "activities": activities}, f)
+    total = sum(len(a) for a in activities.values())
+    print(f"Saved {total} activities for {len(users)} athletes to {path}")
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def build_all(leagues, users, activities, now):
+    return {name: build_scoreboard(league, users, activities, now) for name, league in leagues.items()}
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("dump", nargs="?", help="activity dump to score")
+    arg_parser.add_argument("--save-dump", metavar="PATH", help="write a dump from Redis and exit")
+    arg_parser.add_argument("--roster", help="STRAVA_USERS style JSON file, overrides the dump's users")
+    arg_parser.add_argument("--leagues", help="LEAGUES style JSON file")
+    arg_parser.add_argument("--out-dir", default="out", help="where to write the output (default: ./out)")
+    arg_parser.add_argument("--now", help="ISO timestamp to score as of (default: now, Mountain time)")
+    arg_parser.add_argument("--repeat", type=positive_int, default=1, help="build this many times and report timings")
+    arg_parser.add_argument("--profile", action="store_true", help="print the hottest functions")
+    arg_parser.add_argument("--compact", action="store_true",
+                            help="write rounded, minified JSON")
+    arg_parser.add_argument("--verbose", action="store_true", help="show the scoring code's progress output")
+    args = arg_parser.parse_args(argv)
+
+    if args.save_dump:
+        save_dump(args.save_dump)
         return 0
-
-    sample_interval = duration_seconds / len(hr_data)
-    
-    time_in_zones = {f"Zone {i+1}": 0 for i in range(5)}
-
-    for hr in hr_data:
-        if zones[0][1] <= hr <= zones[0][2]: time_in_zones["Zone 1"] += sample_interval
-        elif zones[1][1] <= hr <= zones[1][2]: time_in_zones["Zone 2"] += sample_interval
-        elif zones[2][1] <= hr <= zones[2][2]: time_in_zones["Zone 3"] += sample_interval
-        elif zones[3][1] <= hr <= zones[3][2]: time_in_zones["Zone 4"] += sample_interval
-        elif zones[4][1] <= hr <= zones[4][2]: time_in_zones["Zone 5"] += sample_interval
-            
-    # Score: 1x for Z1-3, 2x for Z4-5
-    activity_score = (time_in_zones["Zone 1"] + time_in_zones["Zone 2"] + time_in_zones["Zone 3"] +
-                      2 * (time_in_zones["Zone 4"] + time_in_zones["Zone 5"]))
-    
-    return activity_score / 60 # Return score in minutes
-
-
-def calculate_activity_score(activity_data):
-    """
-    Calculates the final score based on pre-calculated time-in-zone data
-    stored in the activity's record.
-    """
-    score = activity_data["z1"] + activity_data["z2"] + activity_data["z3"] + 2*(activity_data["z4"] + activity_data["z5"])
-    score = score/60
-    
-    return score
-
-def main():
-    # --- Load secrets from environment variables ---
-    try:
-        #client_id = os.environ["STRAVA_CLIENT_ID"]
-        #client_secret = os.environ["STRAVA_CLIENT_SECRET"]
-        users = json.loads(os.environ["STRAVA_USERS"])
-        #hr_data_config = json.loads(os.environ["HR_DATA"])
-    except (KeyError, json.JSONDecodeError) as e:
-        print(f"Error: Missing or invalid environment variable. Please check your GitHub Secrets. Details: {e}")
-        return
-    
-    score_board = {}
-    per_zone = {}
-    
-    for athlete_id in users:
-        name = users[athlete_id]['name']
-        score_board[name] = 0
-        per_zone[name] = {'Z1':0,"Z2":0,"Z3":0,"Z4":0,"Z5":0}
-        zone1 = 0
-        zone2 = 0
-        zone3 = 0
-        zone4 = 0
-        zone5 = 0
-        tot_time = 0
-        try:
-            # hgetall retrieves all fields (activity IDs) and values (activity data)
-            activities = KV.hgetall(athlete_id)
-            if not activities:
-                print(f"No activities found in Vercel KV for athlete {name}.")
-                return
-    
-            print(f"\nFound {len(activities)} activities to process in Vercel KV.")
-            
-            total_score_all_activities = 0
-    
-            for activity_id, activity_json_str in activities.items():
-                
-                try:
-                    # The data from KV is a JSON string, so we need to parse it
-                    activity_data = json.loads(activity_json_str)
-    
-                    # Verify that this record actually contains our zone data
-                    if 'z1' not in activity_data:
-                        print("⚠️ Skipping activity: Record does not contain pre-calculated zone data.")
-                        continue
-                    
-                    # Calculate the score for this single activity
-                    activity_score = calculate_activity_score(activity_data)
-                    total_score_all_activities += activity_score
-                    
-                    # Update time spent in zones
-                    zone1 += activity_data["z1"]
-                    zone2 += activity_data["z2"]
-                    zone3 += activity_data["z3"]
-                    zone4 += activity_data["z4"]
-                    zone5 += activity_data["z5"]
-                    tot_time += activity_data["tot_time"]
-                    
-    
-                    print("\n--- Results (from stored data) ---")
-                    for i in range(1, 6):
-                        zone_key = f'z{i}'
-                        seconds = activity_data.get(zone_key, 0)
-                        print(f"Time in Zone {i}: {seconds / 60:.2f} minutes")
-                    
-                    print(f"🏆 Score for this Activity: {activity_score:.2f} points")
-    
-                except json.JSONDecodeError:
-                    print("⚠️ Skipping activity: Could not parse the stored JSON data.")
-                except Exception as e:
-                    print(f"An error occurred while analyzing activity: {e}")
-            
-            #print(f"\n{'='*40}\n🏁 Grand Total Score for Athlete {athlete_id}: {total_score_all_activities:.2f} points\n{'='*40}")
-            zone1 /= tot_time
-            zone2 /= tot_time
-            zone3 /= tot_time
-            zone4 /= tot_time
-            zone5 /= tot_time
-            per_zone[name]['Z1'] = zone1*100
-            per_zone[name]['Z2'] = zone2*100
-            per_zone[name]['Z3'] = zone3*100
-            per_zone[name]['Z4'] = zone4*100
-            per_zone[name]['Z5'] = zone5*100
-            score_board[name] = total_score_all_activities
-    
-        except Exception as e:
-            print(f"An error occurred while fetching from Vercel KV: {e}")
-
-    """days_back = 14 # Look at activities from the last 14 days
-    start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_back)
-    after_timestamp = int(start_date.timestamp())
-
-    daily_scores = {}
-
-    # --- Main logic loop for each user ---
-    for name, user_creds in users.items():
-        print(f"Processing data for {name}...")
-        
-        # 1. Ensure token is valid
-        if token_expired(user_creds["expires_at"]):
-            new_tokens = refresh_strava_token(client_id, client_secret, user_creds["refresh_token"])
-            # Update credentials for the current run
-            user_creds["access_token"] = new_tokens["access_token"]
-            user_creds["refresh_token"] = new_tokens["refresh_token"]
-            user_creds["expires_at"] = new_tokens["expires_at"]
-            
-            
-            # The printed message will alert the user to update the secret for future runs.
-            
-        # 2. Fetch activities
-        try:
-            activities = get_activities(user_creds, after_timestamp)
-            print(f"Found {len(activities)} activities for {name} in the last {days_back} days.")
-        except Exception as e:
-            print(f"Could not fetch activities for {name}. Error: {e}")
-            continue
-
-        # 3. Process each activity
-        for activity in activities:
-            date_str = parser.parse(activity['start_date_local']).strftime("%Y-%m-%d")
-
-            # Initialize daily score if not present
-            if date_str not in daily_scores: daily_scores[date_str] = {}
-            if name not in daily_scores[date_str]: daily_scores[date_str][name] = 0
-
-            # Get HR stream
-            headers = {'Authorization': f'Bearer {user_creds["access_token"]}'}
-            stream_url = f"https://www.strava.com/api/v3/activities/{activity['id']}/streams"
-            stream_params = {'keys': 'heartrate', 'key_by_type': 'true'}
-            
-            stream_resp = requests.get(stream_url, headers=headers, params=stream_params)
-            if stream_resp.status_code == 200:
-                hr_stream = stream_resp.json().get('heartrate', {}).get('data', [])
-                
-                # Simple zone definition for scoring
-                max_hr = hr_data_config[name][1]
-                zones = [
-                    ("Z1", 0, 0.6 * max_hr),
-                    ("Z2", 0.6 * max_hr, 0.7 * max_hr),
-                    ("Z3", 0.7 * max_hr, 0.8 * max_hr),
-                    ("Z4", 0.8 * max_hr, 0.9 * max_hr),
-                    ("Z5", 0.9 * max_hr, max_hr * 1.5) # Buffer for max
-                ]
-
-                score = calculate_score(hr_stream, activity['elapsed_time'], zones)
-                
-                # Add score for the day, capping at 50
-                current_score = daily_scores[date_str][name]
-                daily_scores[date_str][name] = min(current_score + score, 50)
-
-    # 4. Aggregate total scores
-    leaderboard = {}
-    for date, user_scores in daily_scores.items():
-        for name, score in user_scores.items():
-            if name not in leaderboard: leaderboard[name] = 0
-            leaderboard[name] += score
-
-    # Format for JSON output
-    leaderboard_list = [{"name": name, "score": round(score, 1)} for name, score in leaderboard.items()]"""
-    
-    score_board_list = [{"name": name, "score": round(score_board[name],1), "zones" : per_zone[name]} for name, score in score_board.items()]
-
-    final_data = {
-        "lastUpdated": datetime.now().isoformat(),
-        "leaderboard": score_board_list
-    }
-
-    # 5. Write to scores.json
-    with open("scores.json", "w") as f:
-        json.dump(final_data, f, indent=2)
-
-    print("Successfully updated scores.json")
+    if not args.dump:
+        arg_parser.error("a dump file is required (or --save-dump)")
+
+    with open(args.dump) as f:
+        dump = json.load(f)
+    users = dump.get("users") or json.loads(os.environ["STRAVA_USERS"])
+    if args.roster:
+        with open(args.roster) as f:
+            users = json.load(f)
+    if args.leagues:
+        with open(args.leagues) as f:
+            os.environ["LEAGUES"] = f.read()
+    leagues = load_leagues(users)
+    activities = dump["activities"]
+    mountain_tz = pytz.timezone('America/Denver')
+    if args.now:
+        now = datetime.fromisoformat(args.now)
+        now = mountain_tz.localize(now) if now.tzinfo is None else now.astimezone(mountain_tz)
+    else:
+        now = datetime.now(mountain_tz)
+
+    timings = []
+    report = None
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(output):
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = build_all(leagues, users, activities, now)
+            timings.append(time.perf_counter() - start)
+        if args.profile:
+            _, report = profile_call(build_all, leagues, users, activities, now)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for name, final_data in results.items():
+        path = os.path.join(args.out_dir, leagues[name]["output"])
+        if args.compact:
+            final_data = compact_scoreboard(final_data)
+        content = serialize_scores(final_data, compact=args.compact)
+        with open(path, "wb") as f:
+            f.write(content)
+        print(f"Wrote {os.path.basename(path)} {len(content):,} bytes ({len(final_data['leaderboard'])} athletes)")
+
+    total = sum(len(activities.get(a, {})) for a in users)
+    timings.sort()
+    print(f"Scored {total} activities in {timings[0] * 1000:.1f} ms "
+          f"(median {timings[len(timings) // 2] * 1000:.1f} ms over {len(timings)} runs)")
+    if report:
+        print(f"\n{'function':<40}{'calls':>10}{'tottime ms':>14}{'cumtime ms':>14}")
+        for hot in report["hot_functions"][:15]:
+            name = f"{os.path.basename(hot['file'])}:{hot['line']}({hot['function']})"
+            print(f"{name[:39]:<40}{hot['calls']:>10}{hot['tottime_ms']:>14.3f}{hot['cumtime_ms']:>14.3f}")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
-
+    sys.exit(main())